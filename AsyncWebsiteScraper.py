@@ -0,0 +1,254 @@
+import asyncio
+import aiohttp
+from MongoConnection import get_mongo_collection
+from WebsiteScraper import (extract_emails_from_html, save_scraped_emails, save_failed_fetch, build_page_state,
+                            page_unchanged, website_scan, record_fetch, DEFAULT_MAX_AGE_DAYS)
+from crawl_frontier import CrawlFrontier, CRAWL_MAX_PAGES, CRAWL_MAX_BYTES
+from http_transport import (BodyDecoder, content_type_allowed, ssl_context, HTTP_MAX_BYTES, HTTP_CHUNK_SIZE,
+                            HTTP_USER_AGENT, DNS_CACHE_TTL)
+from bulk_writer import BulkWriter
+from validators import companies_schema
+import metrics
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the concurrent crawl; all can be overridden per call
+DEFAULT_CONCURRENCY = 100     # sites fetched at the same time across all hosts
+DEFAULT_PER_HOST_LIMIT = 2    # open connections to any single host
+DEFAULT_TIMEOUT = 30          # seconds for the whole request
+DEFAULT_CONNECT_TIMEOUT = 10  # seconds to establish the connection
+PRODUCER_BATCH_SIZE = 200
+
+
+async def fetch_website(session, website, etag=None, last_modified=None):
+    """
+    Conditionally fetch a page; like WebsiteScraper.fetch_website, non-text
+    content types are skipped and at most HTTP_MAX_BYTES are read.
+
+    :return: (status_code, html, headers), or None if the site could not be read.
+    """
+    if not website or website == 'N/A':
+        return None
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        start = time.perf_counter()
+        async with session.get(website, headers=headers) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type')
+            if response.status == 304:
+                decoder = BodyDecoder(content_type)
+            elif not content_type_allowed(content_type):
+                metrics.inc('http_fetch_errors_total', stage='website_async', reason='content_type')
+                return None
+            else:
+                decoder = BodyDecoder(content_type, HTTP_MAX_BYTES)
+                async for chunk in response.content.iter_chunked(HTTP_CHUNK_SIZE):
+                    if not decoder.feed(chunk):
+                        metrics.inc('http_truncated_total')
+                        break
+            record_fetch('website_async', response.status, decoder.nbytes, time.perf_counter() - start)
+            return response.status, decoder.text(), response.headers
+    except asyncio.TimeoutError:
+        metrics.inc('http_fetch_errors_total', stage='website_async', reason='timeout')
+        logger.debug("Timeout occurred while scraping %s. Skipping this site.", website)
+        return None
+    except aiohttp.ClientResponseError as e:
+        metrics.inc('http_requests_total', api='website', stage='website_async', status=e.status)
+        return None
+    except aiohttp.ClientSSLError:
+        metrics.inc('http_fetch_errors_total', stage='website_async', reason='tls')
+        return None
+    except (aiohttp.ClientError, ValueError, LookupError):
+        metrics.inc('http_fetch_errors_total', stage='website_async', reason='connection')
+        return None
+
+
+async def scrape_website_async(session, website):
+    """Async counterpart of WebsiteScraper.scrape_website."""
+    page = await fetch_website(session, website)
+    if page is None:
+        return []
+    try:
+        return extract_emails_from_html(page[1])
+    except Exception:
+        return []
+
+
+async def _extract_emails(html):
+    try:
+        return await asyncio.to_thread(extract_emails_from_html, html)
+    except Exception:
+        return []
+
+
+async def crawl_contact_pages_async(session, website, homepage_html,
+                                    max_pages=CRAWL_MAX_PAGES, max_bytes=CRAWL_MAX_BYTES):
+    """Async counterpart of WebsiteScraper.crawl_contact_pages."""
+    frontier = CrawlFrontier(website, max_pages, max_bytes)
+    frontier.record(len(homepage_html.encode('utf-8', 'replace')))
+    frontier.add_links(homepage_html, website)
+
+    if not frontier.exhausted:
+        sitemap = await fetch_website(session, frontier.sitemap_url)
+        if sitemap is not None:
+            frontier.record(len(sitemap[1].encode('utf-8', 'replace')), page=False)
+            frontier.add_sitemap(sitemap[1])
+
+    while True:
+        url = frontier.pop()
+        if url is None:
+            return []
+        page = await fetch_website(session, url)
+        if page is None:
+            frontier.record(0)
+            continue
+        html = page[1]
+        frontier.record(len(html.encode('utf-8', 'replace')))
+        emails = await _extract_emails(html)
+        if emails:
+            return emails
+        frontier.add_links(html, url)
+
+
+async def process_page_async(session, writer, company, page, force=False):
+    """Async counterpart of WebsiteScraper.process_page."""
+    page_state = build_page_state(page)
+    if page_unchanged(company, page, page_state, force):
+        await asyncio.to_thread(writer.update, {'_id': company['_id']}, {'$set': page_state}, validate=False)
+        return None
+
+    html = page[1]
+    emails = await _extract_emails(html)
+    if not emails:
+        emails = await crawl_contact_pages_async(session, company.get('website'), html)
+    await asyncio.to_thread(save_scraped_emails, writer, company, emails, page_state)
+    return emails
+
+
+def _next_batch(documents, size):
+    batch = []
+    for company in documents:
+        batch.append(company)
+        if len(batch) >= size:
+            break
+    return batch
+
+
+async def _produce(scan, queue, workers, limit=None):
+    """Claim the scan's partitions one at a time and stream their companies into the work queue."""
+    produced = 0
+    try:
+        while limit is None or produced < limit:
+            partition = await asyncio.to_thread(scan.claim)
+            if partition is None:
+                break
+            documents = partition.documents()
+            while limit is None or produced < limit:
+                size = PRODUCER_BATCH_SIZE if limit is None else min(PRODUCER_BATCH_SIZE, limit - produced)
+                batch = await asyncio.to_thread(_next_batch, documents, size)
+                if not batch:
+                    break
+                for company in batch:
+                    await queue.put((partition, company))
+                produced += len(batch)
+    finally:
+        for _ in range(workers):
+            await queue.put(None)
+
+
+async def _consume(session, writer, queue, stats, force):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        partition, company = item
+        etag = None if force else company.get('website_etag')
+        last_modified = None if force else company.get('website_last_modified')
+        page = await fetch_website(session, company.get('website', 'N/A'), etag, last_modified)
+        try:
+            # Parse and write back as soon as the site is done rather than at the end of the run
+            if page is None:
+                emails = []
+                await asyncio.to_thread(save_failed_fetch, writer, company)
+            else:
+                emails = await process_page_async(session, writer, company, page, force)
+        except Exception as e:
+            emails = []
+            logger.warning("Failed to save %s: %s", company.get('company_name', 'Unknown'), e)
+        await asyncio.to_thread(partition.done, company['_id'])
+        stats['scraped'] += 1
+        if emails is None:
+            stats['unchanged'] += 1
+        elif emails:
+            stats['with_email'] += 1
+
+
+async def update_company_info_async(concurrency=DEFAULT_CONCURRENCY,
+                                    per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                                    timeout=DEFAULT_TIMEOUT,
+                                    connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                                    max_age_days=DEFAULT_MAX_AGE_DAYS,
+                                    force=False,
+                                    limit=None):
+    """
+    Scrape company websites concurrently and update the companies collection.
+
+    Selection, conditional requests, unchanged-page skipping and the
+    partitioned, checkpointed scan behave as in WebsiteScraper.update_company_info.
+
+    :param concurrency: Maximum number of sites fetched at the same time.
+    :param per_host_limit: Maximum simultaneous connections to one host.
+    :param timeout: Total timeout in seconds for each request.
+    :param connect_timeout: Timeout in seconds for establishing a connection.
+    :param max_age_days: Re-scrape companies checked longer ago than this; None selects all.
+    :param force: Ignore stored validators and content hashes and re-parse every page.
+    :param limit: Maximum number of companies to scrape.
+    :return: Dict with the number of companies scraped, unchanged and with an email.
+    """
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    writer = BulkWriter(companies_collection, schema=companies_schema)
+    scan = website_scan(companies_collection, writer, max_age_days)
+    await asyncio.to_thread(scan.plan)
+    stats = {'scraped': 0, 'unchanged': 0, 'with_email': 0}
+
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host_limit,
+                                     ttl_dns_cache=DNS_CACHE_TTL, ssl=ssl_context())
+    client_timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    # trust_env honours HTTP_PROXY/NO_PROXY like the requests-based scraper does
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout, trust_env=True,
+                                     headers={'User-Agent': HTTP_USER_AGENT},
+                                     cookie_jar=aiohttp.DummyCookieJar()) as session:
+        workers = [
+            asyncio.create_task(_consume(session, writer, queue, stats, force))
+            for _ in range(concurrency)
+        ]
+        try:
+            await _produce(scan, queue, len(workers), limit)
+            await asyncio.gather(*workers)
+        finally:
+            await asyncio.to_thread(scan.close)
+
+    await asyncio.to_thread(writer.close)
+
+    return stats
+
+
+def update_company_info(**kwargs):
+    """Blocking entry point for the async crawl; accepts the same options."""
+    return asyncio.run(update_company_info_async(**kwargs))
+
+
+if __name__ == '__main__':
+    from logging_config import configure_logging
+    configure_logging()
+    print("Start scraping websites concurrently...")
+    print(update_company_info())
+    print("Finished updating company info.")
@@ -1,8 +1,28 @@
-from GoogleMapsScraper import collect_and_save_data
-from WebsiteScraper import update_company_info
-from HunterScraper import hunter_scraper
-from MongoConnection import get_mongo_collection
+"""
+Business Data Scraper: discover companies on Google Maps, scrape their websites
+for emails, and enrich them with Hunter.io and LinkedIn.
+
+Usage:
+    python Business_Data_Scraper.py [all]           Streaming pipeline, then website and Hunter catch-up
+    python Business_Data_Scraper.py discover        Google Maps search for industry_location_sets
+    python Business_Data_Scraper.py websites        Scrape company websites for emails
+    python Business_Data_Scraper.py hunter          Enrich companies with Hunter.io
+    python Business_Data_Scraper.py linkedin        Enrich companies with LinkedIn
+    python Business_Data_Scraper.py pipeline        Discover, scrape and hunt as one overlapping pipeline
+    python Business_Data_Scraper.py verify          Check collected emails against their mail servers (not part of all)
+
+Every stage takes --limit, --concurrency and --dry-run; see <stage> --help.
+Stage modules are imported only when their stage runs, so a stage needs only
+its own dependencies and credentials, and no client connects before it is used.
+"""
+from logging_config import configure_logging
 from datetime import datetime
+import argparse
+import metrics
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
 
 # List of (industry, location) sets to iterate through
 industry_location_sets = [
@@ -18,61 +38,191 @@ industry_location_sets = [
     ('roofing', 'Hamilton Ontario'),
     ('roofing', 'Vaughan Ontario'),
     ('roofing', 'Toronto Ontario')
-   
+
     # Add more (industry, location) pairs as needed
 ]
 
-def run_google_maps_scraper(industry, location):
+def count_companies(query):
+    """Number of companies matching a query; used by --dry-run."""
+    from MongoConnection import get_mongo_collection
+    return get_mongo_collection('TestingDatabase', 'companies').count_documents(query)
+
+def run_google_maps_scraper(industry, location, limit=None, concurrency=None):
     """Run the GoogleMapsScraper to add new companies to the database."""
-    print(f"Running GoogleMapsScraper for {industry} in {location}...")
-    collect_and_save_data(industry, location)
+    from GoogleMapsScraper import collect_and_save_data, PLACES_DETAILS_WORKERS
+    logger.info("Running GoogleMapsScraper for %s in %s...", industry, location)
+    with metrics.timer('stage_seconds', stage='google_maps'):
+        return collect_and_save_data(industry, location, limit=limit,
+                                     max_workers=concurrency or PLACES_DETAILS_WORKERS)
 
-def run_website_scraper():
+def run_website_scraper(concurrent=True, limit=None, concurrency=None, **options):
     """Run the WebsiteScraper to update company information."""
-    print("Running WebsiteScraper to update company information...")
-    update_company_info()
+    logger.info("Running WebsiteScraper to update company information...")
+    with metrics.timer('stage_seconds', stage='website'):
+        if concurrent:
+            import AsyncWebsiteScraper
+            if concurrency:
+                options['concurrency'] = concurrency
+            stats = AsyncWebsiteScraper.update_company_info(limit=limit, **options)
+        else:
+            from WebsiteScraper import update_company_info
+            if concurrency:
+                options['workers'] = concurrency
+            stats = update_company_info(limit=limit, **options)
+    logger.info("Website stage: %s", stats)
+    return stats
 
-def run_hunter_scraper():
+def run_hunter_scraper(workers=None, limit=None):
     """Run the HunterScraper to further enrich company and people data."""
-    print("Running HunterScraper to enrich data...")
-    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
-    
-    # Fetch companies that haven't been processed by HunterScraper
-    companies = companies_collection.find({'has_been_hunted': False})
-    
-    for company in companies:
-        domain = company.get('website', '')
-        if domain:
-            hunter_scraper(domain)
-
-            # Retrieve required fields
-            company_name = company.get('company_name', 'Unknown Company')
-            search_term_used = company.get('search_term_used', 'Unknown Search Term')
-
-            # Update the has_been_hunted flag along with required fields
-            companies_collection.update_one(
-                {'_id': company['_id']},
-                {'$set': {
-                    'has_been_hunted': True,
-                    'company_name': company_name,
-                    'search_term_used': search_term_used
-                }}
-            )
-            print(f"Updated Hunter status for company: {company_name}")
-
-
-def main():
-    # Step 1: Add new companies using GoogleMapsScraper
+    from HunterScraper import run_hunter_stage, get_hunter_client, HUNTER_WORKERS
+    logger.info("Running HunterScraper to enrich data...")
+    with metrics.timer('stage_seconds', stage='hunter'):
+        stats = run_hunter_stage(workers or HUNTER_WORKERS, limit=limit)
+    logger.info("Hunter stage: %s", stats)
+    logger.info("Hunter.io client stats: %s, cache: %s", get_hunter_client().stats, get_hunter_client().cache.stats())
+    return stats
+
+def run_linkedin_scraper(workers=None, limit=None):
+    """Run the LinkedInScraper to add LinkedIn details to companies."""
+    from LinkedInScraper import update_linkedin_info, LINKEDIN_WORKERS
+    logger.info("Running LinkedInScraper to enrich data...")
+    with metrics.timer('stage_seconds', stage='linkedin'):
+        stats = update_linkedin_info(workers or LINKEDIN_WORKERS, limit=limit)
+    logger.info("LinkedIn stage: %s", stats)
+    return stats
+
+def run_email_verifier(concurrency=None, limit=None):
+    """Run the EmailVerifier to check collected emails over SMTP."""
+    from EmailVerifier import verify_emails, VERIFY_CONCURRENCY
+    logger.info("Running EmailVerifier...")
+    with metrics.timer('stage_seconds', stage='verify'):
+        stats = verify_emails(concurrency or VERIFY_CONCURRENCY, limit=limit)
+    logger.info("Verification stage: %s", stats)
+    return stats
+
+def run_streaming_pipeline(limit=None, concurrency=None):
+    """Run discovery, website scraping and Hunter enrichment as one overlapping pipeline."""
+    from Pipeline import run_pipeline, WEBSITE_WORKERS
+    logger.info("Running streaming pipeline...")
+    with metrics.timer('stage_seconds', stage='pipeline'):
+        stats = run_pipeline(industry_location_sets, website_workers=concurrency or WEBSITE_WORKERS, limit=limit)
+    logger.info("Pipeline: %s", stats)
+    return stats
+
+def main(streaming=True, limit=None):
+    if streaming:
+        # Steps 1-3 for new companies, overlapped: each one is scraped and
+        # hunted as soon as discovery has saved it
+        run_streaming_pipeline(limit)
+    else:
+        # Step 1: Add new companies using GoogleMapsScraper
+        for industry, location in industry_location_sets:
+            run_google_maps_scraper(industry, location, limit)
+
+    # Step 2: Update companies using WebsiteScraper (stale ones from earlier runs when streaming)
+    run_website_scraper(limit=limit)
+
+    # Step 3: Enrich data using HunterScraper (leftovers from earlier runs when streaming)
+    run_hunter_scraper(limit=limit)
+
+def discover_command(args):
+    if args.dry_run:
+        for industry, location in industry_location_sets:
+            print(f"Would search: {industry} in {location}")
+        return
+    remaining = args.limit
     for industry, location in industry_location_sets:
-        run_google_maps_scraper(industry, location)
+        if remaining is not None and remaining <= 0:
+            break
+        stats = run_google_maps_scraper(industry, location, remaining, args.concurrency)
+        if remaining is not None:
+            remaining -= stats['inserted']
+
+def websites_command(args):
+    from WebsiteScraper import DEFAULT_MAX_AGE_DAYS
+    max_age_days = DEFAULT_MAX_AGE_DAYS if args.max_age_days is None else args.max_age_days
+    if args.dry_run:
+        from WebsiteScraper import stale_companies_query
+        print(f"Would scrape {count_companies(stale_companies_query(max_age_days))} companies")
+        return
+    run_website_scraper(not args.sync, args.limit, args.concurrency, max_age_days=max_age_days, force=args.force)
+
+def hunter_command(args):
+    if args.dry_run:
+        from HunterScraper import UNHUNTED_QUERY
+        print(f"Would hunt {count_companies(UNHUNTED_QUERY)} companies")
+        return
+    run_hunter_scraper(args.concurrency, args.limit)
+
+def linkedin_command(args):
+    if args.dry_run:
+        from LinkedInScraper import unchecked_companies_query
+        print(f"Would check {count_companies(unchecked_companies_query())} companies on LinkedIn")
+        return
+    run_linkedin_scraper(args.concurrency, args.limit)
+
+def verify_command(args):
+    if args.dry_run:
+        from EmailVerifier import pending_count
+        print(f"Would verify {pending_count()} emails")
+        return
+    run_email_verifier(args.concurrency, args.limit)
+
+def pipeline_command(args):
+    if args.dry_run:
+        for industry, location in industry_location_sets:
+            print(f"Would search, scrape and hunt: {industry} in {location}")
+        return
+    run_streaming_pipeline(args.limit, args.concurrency)
+
+def all_command(args):
+    if args.dry_run:
+        pipeline_command(args)
+        websites_command(argparse.Namespace(**vars(args), max_age_days=None, sync=False, force=False))
+        hunter_command(args)
+        return
+    main(limit=args.limit)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log-level', default=None, help='DEBUG, INFO, WARNING... (default: LOG_LEVEL or INFO)')
+    stage_options = argparse.ArgumentParser(add_help=False)
+    stage_options.add_argument('--limit', type=int, default=None, help='Maximum number of companies to process')
+    stage_options.add_argument('--concurrency', type=int, default=None, help="Workers for the stage (default: the stage's setting)")
+    stage_options.add_argument('--dry-run', action='store_true', help='Report what would be processed without calling any API or writing')
 
-    # Step 2: Update companies using WebsiteScraper
-    run_website_scraper()
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('all', parents=[stage_options], help='Run every stage').set_defaults(handler=all_command)
+    commands.add_parser('discover', parents=[stage_options], help='Search Google Maps').set_defaults(handler=discover_command)
+    websites = commands.add_parser('websites', parents=[stage_options], help='Scrape company websites')
+    websites.add_argument('--sync', action='store_true', help='Use the sequential scraper')
+    websites.add_argument('--force', action='store_true', help='Re-parse pages even if unchanged')
+    websites.add_argument('--max-age-days', type=float, default=None,
+                          help='Re-scrape companies checked longer ago than this (default: WEBSITE_MAX_AGE_DAYS or 30)')
+    websites.set_defaults(handler=websites_command)
+    commands.add_parser('hunter', parents=[stage_options], help='Enrich with Hunter.io').set_defaults(handler=hunter_command)
+    commands.add_parser('linkedin', parents=[stage_options], help='Enrich with LinkedIn').set_defaults(handler=linkedin_command)
+    commands.add_parser('verify', parents=[stage_options], help='Verify emails over SMTP').set_defaults(handler=verify_command)
+    commands.add_parser('pipeline', parents=[stage_options], help='Discover, scrape and hunt, overlapped').set_defaults(handler=pipeline_command)
+    parser.set_defaults(handler=all_command, limit=None, concurrency=None, dry_run=False)
+    return parser
 
-    # Step 3: Enrich data using HunterScraper
-    run_hunter_scraper()
+def cli(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(*([args.log_level] if args.log_level else []))
+    metrics.start_metrics_server()
+    logger.info("Starting Business Data Scraper at %s", datetime.now())
+    try:
+        args.handler(args)
+    finally:
+        # Only report and close Mongo if a stage actually used it
+        mongo = sys.modules.get('MongoConnection')
+        if mongo is not None:
+            logger.info("MongoDB connection stats: %s", mongo.get_connection_stats())
+            mongo.close_mongo_clients()
+        if not args.dry_run:
+            logger.info("Metrics snapshot written to %s", metrics.write_snapshot())
+    logger.info("Finished Business Data Scraper at %s", datetime.now())
 
 if __name__ == '__main__':
-    print(f"Starting Business Data Scraper at {datetime.now()}")
-    main()
-    print(f"Finished Business Data Scraper at {datetime.now()}")
\ No newline at end of file
+    cli()
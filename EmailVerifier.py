@@ -0,0 +1,371 @@
+"""
+Verify collected email addresses against their domain's mail servers.
+
+Addresses come from companies.email, companies.other_emails and people.email,
+and are grouped by domain. Each domain gets one MX lookup (cached on disk) and
+one SMTP session that probes a random address to detect catch-all servers and
+then sends RCPT TO for each of its addresses, without ever sending a message.
+Sessions to the same mail server are limited by a per-MX semaphore, because
+providers that host many domains throttle or block parallel probes.
+
+Results go to the email_verifications collection (_id is the address) with
+verified_at and expires_at; a TTL index removes expired results, so the next
+run verifies those addresses again.
+
+For local runs, DNS_NAMESERVER=127.0.0.1:5353 and SMTP_VERIFY_PORT=2525 point
+the verifier at stubs.nameserver and stubs.mailserver.
+"""
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+from MongoConnection import get_mongo_collection
+from validators import email_verifications_schema
+from bulk_writer import BulkWriter
+from email_extraction import is_valid_email
+from cache import SQLiteCache
+from collections import defaultdict
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import threading
+import asyncio
+import metrics
+import socket
+import uuid
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Defaults target real mail servers; override them to test against local stubs
+DNS_NAMESERVER = os.getenv('DNS_NAMESERVER')  # host[:port]; the system resolver when unset
+DNS_TIMEOUT = float(os.getenv('DNS_TIMEOUT', '5'))
+SMTP_VERIFY_PORT = int(os.getenv('SMTP_VERIFY_PORT', '25'))
+SMTP_HELO_HOST = os.getenv('SMTP_HELO_HOST') or socket.getfqdn()
+SMTP_MAIL_FROM = os.getenv('SMTP_MAIL_FROM', f'verify@{SMTP_HELO_HOST}')
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '15'))
+
+VERIFY_CONCURRENCY = int(os.getenv('VERIFY_CONCURRENCY', '50'))  # Domains verified at the same time
+VERIFY_PER_MX_LIMIT = int(os.getenv('VERIFY_PER_MX_LIMIT', '2'))  # Sessions open to one mail server
+VERIFY_RCPTS_PER_SESSION = 20  # Servers commonly cap recipients per transaction
+
+# Definite answers are kept for EMAIL_VERIFY_TTL_DAYS, 'unknown' ones (greylisting,
+# timeouts) are retried after EMAIL_VERIFY_RETRY_DAYS
+EMAIL_VERIFY_TTL_DAYS = float(os.getenv('EMAIL_VERIFY_TTL_DAYS', '30'))
+EMAIL_VERIFY_RETRY_DAYS = float(os.getenv('EMAIL_VERIFY_RETRY_DAYS', '1'))
+MX_CACHE_TTL = float(os.getenv('MX_CACHE_TTL_HOURS', '24')) * 3600
+
+CURSOR_BATCH_SIZE = 1000
+
+
+class SmtpError(Exception):
+    """Raised when an SMTP session cannot be opened or breaks off."""
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_mx_cache():
+    """Returns the on-disk cache of MX hosts by domain, opening it on first use."""
+    with _caches_lock:
+        if 'mx' not in _caches:
+            _caches['mx'] = SQLiteCache('mx', ttl=MX_CACHE_TTL)
+        return _caches['mx']
+
+def get_catch_all_cache():
+    """Returns the on-disk cache of catch-all probe results by domain."""
+    with _caches_lock:
+        if 'catch_all' not in _caches:
+            _caches['catch_all'] = SQLiteCache('catch_all', ttl=EMAIL_VERIFY_TTL_DAYS * 86400)
+        return _caches['catch_all']
+
+def make_resolver():
+    """Async resolver using DNS_NAMESERVER when set, else the system configuration."""
+    resolver = dns.asyncresolver.Resolver(configure=not DNS_NAMESERVER)
+    if DNS_NAMESERVER:
+        host, _, port = DNS_NAMESERVER.partition(':')
+        resolver.nameservers = [host]
+        resolver.port = int(port or 53)
+    resolver.lifetime = DNS_TIMEOUT
+    return resolver
+
+async def _addresses(resolver, host):
+    try:
+        answer = await resolver.resolve(host, 'A')
+    except dns.exception.DNSException:
+        return []
+    return [record.address for record in answer]
+
+async def lookup_mx(resolver, domain):
+    """
+    Mail servers of a domain, best preference first, from the MX cache when fresh.
+
+    A domain without MX records falls back to its own A record (RFC 5321); a null
+    MX ('.') means the domain takes no mail.
+
+    :return: List of [host, ip] pairs, empty if the domain takes no mail, or None
+        if DNS could not answer (not cached, so the next run retries).
+    """
+    cached = get_mx_cache().get(domain)
+    if cached is not None:
+        return cached
+    try:
+        with metrics.timer('dns_lookup_seconds', record='MX'):
+            answer = await resolver.resolve(domain, 'MX')
+        hosts = [str(record.exchange).rstrip('.') for record in sorted(answer, key=lambda record: record.preference)]
+        hosts = [host for host in hosts if host]
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        hosts = [domain] if await _addresses(resolver, domain) else []
+    except dns.exception.DNSException as e:
+        metrics.inc('dns_lookup_failures_total', record='MX')
+        logger.debug("MX lookup failed for %s: %s", domain, e)
+        return None
+
+    servers = []
+    for host in hosts:
+        servers.extend([host, ip] for ip in (await _addresses(resolver, host))[:1])
+    get_mx_cache().set(domain, servers)
+    return servers
+
+
+class SmtpSession:
+    """Minimal SMTP client speaking just enough of the protocol to ask about recipients."""
+
+    def __init__(self, host, ip, port=SMTP_VERIFY_PORT, timeout=SMTP_TIMEOUT):
+        self.host = host
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.reader = self.writer = None
+
+    async def _reply(self):
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise SmtpError(f"{self.host} closed the connection")
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            lines.append(line[4:])
+            if len(line) < 4 or line[3] != '-':  # "250-..." continues, "250 ..." ends the reply
+                break
+        try:
+            return int(line[:3]), ' '.join(lines)
+        except ValueError:
+            raise SmtpError(f"Malformed reply from {self.host}: {line!r}")
+
+    async def command(self, line):
+        self.writer.write(line.encode('utf-8') + b'\r\n')
+        await self.writer.drain()
+        return await self._reply()
+
+    async def open(self):
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port), self.timeout)
+            code, message = await self._reply()
+        except (OSError, asyncio.TimeoutError) as e:
+            raise SmtpError(f"Could not connect to {self.host}: {e}") from e
+        if code != 220:
+            raise SmtpError(f"{self.host} refused the session: {code} {message}")
+        code, message = await self.command(f'EHLO {SMTP_HELO_HOST}')
+        if code != 250:
+            code, message = await self.command(f'HELO {SMTP_HELO_HOST}')
+        if code != 250:
+            raise SmtpError(f"{self.host} rejected HELO: {code} {message}")
+
+    async def start_transaction(self):
+        code, message = await self.command(f'MAIL FROM:<{SMTP_MAIL_FROM}>')
+        if code != 250:
+            raise SmtpError(f"{self.host} rejected MAIL FROM: {code} {message}")
+
+    async def rcpt(self, email):
+        return await self.command(f'RCPT TO:<{email}>')
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(b'QUIT\r\n')
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        self.writer.close()
+
+
+def status_for(code, catch_all):
+    """Maps a RCPT TO reply code to a verification status."""
+    if code in (250, 251):
+        return 'catch_all' if catch_all else 'valid'
+    if 500 <= code < 600:
+        return 'invalid'
+    return 'unknown'  # 4xx: greylisting, rate limiting or a full mailbox
+
+def _result(email, domain, status, code=None, message=None, mx_host=None, catch_all=None):
+    return {'email': email, 'domain': domain, 'status': status, 'smtp_code': code,
+            'smtp_message': (message or '')[:200] or None, 'mx_host': mx_host, 'catch_all': catch_all}
+
+async def _open_session(servers):
+    """Opens a session on the first mail server that answers, trying them in preference order."""
+    error = None
+    for host, ip in servers:
+        session = SmtpSession(host, ip)
+        try:
+            with metrics.timer('smtp_connect_seconds'):
+                await session.open()
+            return session
+        except (SmtpError, OSError, asyncio.TimeoutError) as e:
+            error = e
+            await session.close()
+    raise SmtpError(str(error))
+
+async def smtp_check(servers, domain, emails):
+    """
+    Asks the domain's mail server about each address in one session.
+
+    A RCPT TO for a random local part runs first unless the catch-all cache
+    already knows the domain; servers that accept it accept anything, so their
+    addresses are reported as 'catch_all' instead of 'valid'.
+
+    :return: List of result dicts, one per address.
+    """
+    catch_all = get_catch_all_cache().get(domain)
+    results = []
+    session = await _open_session(servers)
+    try:
+        for start in range(0, len(emails), VERIFY_RCPTS_PER_SESSION):
+            if start:
+                await session.command('RSET')
+            await session.start_transaction()
+            if catch_all is None:
+                code, _ = await session.rcpt(f'{uuid.uuid4().hex[:16]}@{domain}')
+                if code in (250, 251) or 500 <= code < 600:  # 4xx says nothing either way
+                    catch_all = code in (250, 251)
+                    get_catch_all_cache().set(domain, catch_all)
+            for email in emails[start:start + VERIFY_RCPTS_PER_SESSION]:
+                code, message = await session.rcpt(email)
+                metrics.inc('smtp_rcpt_total', code=code // 100 * 100)
+                results.append(_result(email, domain, status_for(code, catch_all), code, message,
+                                       session.host, catch_all))
+    except (SmtpError, OSError, asyncio.TimeoutError) as e:
+        logger.debug("SMTP session with %s broke off: %s", session.host, e)
+        checked = {result['email'] for result in results}
+        results.extend(_result(email, domain, 'unknown', message=str(e), mx_host=session.host)
+                       for email in emails if email not in checked)
+    finally:
+        await session.close()
+    return results
+
+async def verify_domain(resolver, mx_slots, domain, emails):
+    """
+    Verifies every address at one domain with one MX lookup and one SMTP session.
+
+    :param mx_slots: Per-MX semaphores, shared by every domain the run verifies.
+    :return: List of result dicts, one per address.
+    """
+    servers = await lookup_mx(resolver, domain)
+    if servers is None:
+        return [_result(email, domain, 'unknown', message='DNS lookup failed') for email in emails]
+    if not servers:
+        return [_result(email, domain, 'no_mx') for email in emails]
+    async with mx_slots[servers[0][0]]:
+        try:
+            with metrics.timer('smtp_session_seconds'):
+                return await smtp_check(servers, domain, emails)
+        except SmtpError as e:
+            metrics.inc('smtp_connect_failures_total')
+            logger.debug("No mail server of %s answered: %s", domain, e)
+            return [_result(email, domain, 'unknown', message=str(e), mx_host=servers[0][0]) for email in emails]
+
+def save_result(writer, result, now=None):
+    now = now or datetime.now()
+    days = EMAIL_VERIFY_RETRY_DAYS if result['status'] == 'unknown' else EMAIL_VERIFY_TTL_DAYS
+    document = {**result, 'verified_at': now, 'expires_at': now + timedelta(days=days)}
+    writer.update({'_id': result['email']}, {'$set': document}, upsert=True, label=result['email'])
+    metrics.inc('email_verifications_total', status=result['status'])
+
+def ensure_verification_indexes(verifications_collection):
+    """TTL index that drops results once expires_at has passed, plus a lookup index on domain."""
+    verifications_collection.create_index('expires_at', expireAfterSeconds=0, name='expires_at_ttl')
+    verifications_collection.create_index('domain', name='domain_lookup')
+
+def pending_addresses(verifications_collection, limit=None):
+    """
+    Collects addresses without a current verification result, grouped by domain.
+
+    :return: Dict mapping each domain to a sorted list of its addresses.
+    """
+    fresh = {document['_id'] for document in verifications_collection.find(
+        {'expires_at': {'$gt': datetime.now()}}, {'_id': 1}, batch_size=CURSOR_BATCH_SIZE)}
+    sources = [
+        ('companies', {'$or': [{'email': {'$type': 'string'}}, {'other_emails.0': {'$exists': True}}]},
+         {'_id': 0, 'email': 1, 'other_emails': 1}),
+        ('people', {'email': {'$type': 'string'}}, {'_id': 0, 'email': 1}),
+    ]
+    by_domain = defaultdict(set)
+    count = 0
+    for collection_name, query, projection in sources:
+        cursor = get_mongo_collection('TestingDatabase', collection_name).find(
+            query, projection, batch_size=CURSOR_BATCH_SIZE)
+        for document in cursor:
+            for email in [document.get('email')] + list(document.get('other_emails') or []):
+                email = (email or '').strip().lower()
+                if not email or email in fresh or not is_valid_email(email):
+                    continue
+                domain = email.rpartition('@')[2]
+                if email in by_domain[domain]:
+                    continue
+                by_domain[domain].add(email)
+                count += 1
+                if limit is not None and count >= limit:
+                    cursor.close()
+                    return {domain: sorted(emails) for domain, emails in by_domain.items()}
+    return {domain: sorted(emails) for domain, emails in by_domain.items() if emails}
+
+async def _verify_worker(domains, resolver, mx_slots, writer, stats):
+    for domain, emails in domains:  # The iterator is shared, so each domain goes to one worker
+        for result in await verify_domain(resolver, mx_slots, domain, emails):
+            await asyncio.to_thread(save_result, writer, result)
+            stats[result['status']] += 1
+
+async def verify_emails_async(concurrency=VERIFY_CONCURRENCY, per_mx_limit=VERIFY_PER_MX_LIMIT, limit=None):
+    """
+    Verifies every address without a current result.
+
+    :param concurrency: Domains verified at the same time.
+    :param per_mx_limit: Maximum simultaneous sessions with one mail server.
+    :param limit: Maximum number of addresses to verify.
+    :return: Dict counting results by status.
+    """
+    verifications_collection = get_mongo_collection('TestingDatabase', 'email_verifications')
+    await asyncio.to_thread(ensure_verification_indexes, verifications_collection)
+    by_domain = await asyncio.to_thread(pending_addresses, verifications_collection, limit)
+    logger.info("Verifying %d addresses at %d domains", sum(map(len, by_domain.values())), len(by_domain))
+
+    resolver = make_resolver()
+    mx_slots = defaultdict(lambda: asyncio.Semaphore(per_mx_limit))
+    writer = BulkWriter(verifications_collection, schema=email_verifications_schema)
+    stats = defaultdict(int)
+    domains = iter(by_domain.items())
+    try:
+        await asyncio.gather(*(_verify_worker(domains, resolver, mx_slots, writer, stats)
+                               for _ in range(max(1, min(concurrency, len(by_domain))))))
+    finally:
+        await asyncio.to_thread(writer.close)
+    logger.info("MX cache: %s, catch-all cache: %s", get_mx_cache().stats(), get_catch_all_cache().stats())
+    return dict(stats)
+
+def verify_emails(concurrency=VERIFY_CONCURRENCY, per_mx_limit=VERIFY_PER_MX_LIMIT, limit=None):
+    """Synchronous entry point for verify_emails_async."""
+    return asyncio.run(verify_emails_async(concurrency, per_mx_limit, limit))
+
+def pending_count():
+    """Number of addresses a run would verify; used by --dry-run."""
+    by_domain = pending_addresses(get_mongo_collection('TestingDatabase', 'email_verifications'))
+    return sum(map(len, by_domain.values()))
+
+
+if __name__ == '__main__':
+    from logging_config import configure_logging
+    configure_logging()
+    print(verify_emails())
@@ -0,0 +1,480 @@
+"""
+Find and merge companies that are the same business under different records.
+
+Usage:
+    python EntityResolution.py cluster [--max-block-size N] [--name-similarity 0.5]
+    python EntityResolution.py show [--limit 20]          Print clusters for review
+    python EntityResolution.py merge [--dry-run] [--limit N] [--include-large]
+
+The insert-time dedupe only catches exact name, site or place_id matches, so
+'ABC Roofing Inc.' and 'ABC Roofing' at the same phone number are stored twice.
+`cluster` loads the names, phones, addresses and domains of every company in
+one projected scan and normalizes them (see normalizers.py). Candidate pairs
+come from blocks of records sharing an exact key, and from MinHash/LSH buckets
+over the distinctive words of the name, so the number of comparisons grows
+with the number of records rather than its square. A pair is matched when it
+shares a Google place_id, two of phone/domain/address, or one of them and a
+similar name. Matches are joined into clusters with union-find and stored in
+company_clusters.
+
+`merge` keeps the most complete company of each cluster, fills its missing
+fields from the others, combines their emails into email/other_emails, and
+deletes the others after archiving them in company_merges.
+"""
+from MongoConnection import get_mongo_collection
+from bulk_writer import BulkWriter
+from dedupe import DEDUPE_FIELDS
+from normalizers import normalize_entity_name, normalize_phone, normalize_address, normalize_domain
+from logging_config import configure_logging
+from collections import Counter
+from datetime import datetime
+from hashlib import blake2b
+from array import array
+import argparse
+import metrics
+import random
+import zlib
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+ER_MAX_BLOCK_SIZE = int(os.getenv('ER_MAX_BLOCK_SIZE', '50'))  # Larger blocks (call centres, facebook.com) say nothing
+ER_NAME_SIMILARITY = float(os.getenv('ER_NAME_SIMILARITY', '0.5'))  # Jaccard similarity of name trigrams
+ER_MAX_CLUSTER_SIZE = int(os.getenv('ER_MAX_CLUSTER_SIZE', '20'))  # Larger clusters are left for review
+ER_BATCH_SIZE = 5000
+COMMON_TOKEN_SHARE = 0.001  # Name words in more than this share of companies, e.g. 'roofing', are not distinctive
+MINHASH_BANDS = 8
+MINHASH_ROWS = 3  # 8 bands of 3 rows: pairs above ~0.5 similarity share a bucket with high probability
+MERSENNE_PRIME = (1 << 61) - 1
+
+LOAD_FIELDS = ('company_name', 'phone_number', 'address', 'website', 'domain') + DEDUPE_FIELDS
+BLOCK_FIELDS = ('name', 'phone', 'domain', 'address', 'place_id')
+EVIDENCE_FIELDS = ('phone', 'domain', 'address')
+
+# Fields a surviving company takes from its duplicates when it has no value of its own
+MERGE_FILL_FIELDS = (
+    'address', 'industry', 'website', 'domain', 'phone_number', 'year_founded', 'logo_url', 'short_description',
+    'linkedin_url', 'linkedin_id', 'linkedin_description', 'linkedin_employees',
+    'linkedin_specialities', 'linkedin_industries', 'linkedin_checked_at',
+)
+EMPTY_VALUES = (None, '', 'N/A', [])
+
+_random = random.Random(20240601)  # Fixed seed: signatures must agree between runs
+MINHASH_PARAMETERS = [(_random.randrange(1, MERSENNE_PRIME), _random.randrange(MERSENNE_PRIME))
+                      for _ in range(MINHASH_BANDS * MINHASH_ROWS)]
+
+
+def _optional_key(value):
+    """64-bit digest of a key, or 0 if there is none."""
+    if not value:
+        return 0
+    return int.from_bytes(blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big') or 1
+
+
+def trigrams(text):
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_similarity(a, b):
+    """Jaccard similarity of the two names' character trigrams."""
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    a, b = trigrams(a), trigrams(b)
+    return len(a & b) / len(a | b)
+
+
+_permuted_trigrams = {}  # At most 37**3 alphanumeric trigrams, so this stays small
+
+
+def _permuted(trigram):
+    values = _permuted_trigrams.get(trigram)
+    if values is None:
+        h = zlib.crc32(trigram.encode('utf-8'))
+        values = _permuted_trigrams[trigram] = tuple((a * h + b) % MERSENNE_PRIME for a, b in MINHASH_PARAMETERS)
+    return values
+
+
+def minhash_bands(text):
+    """Yields one bucket key per LSH band of the text's trigram MinHash signature."""
+    signature = [min(column) for column in zip(*map(_permuted, trigrams(text)))]
+    for band in range(MINHASH_BANDS):
+        rows = tuple(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS])
+        yield hash((band, rows)) & 0xFFFFFFFFFFFFFFFF
+
+
+class CompanyRecords:
+    """
+    Normalized match keys of every company, held in flat arrays indexed by record number.
+
+    Keys are stored as 64-bit digests with 0 for a missing value, so a
+    million companies take tens of megabytes.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.names = []  # Distinctive words of each name; filled in by build_names()
+        self.entity_names = []
+        self.keys = {field: array('Q') for field in BLOCK_FIELDS}
+
+    @classmethod
+    def load(cls, companies_collection, batch_size=ER_BATCH_SIZE):
+        projection = {field: 1 for field in LOAD_FIELDS}
+        with metrics.timer('entity_resolution_seconds', phase='load'):
+            records = cls.from_documents(companies_collection.find({}, projection, batch_size=batch_size))
+        logger.info("Loaded %d companies for entity resolution.", len(records))
+        return records
+
+    @classmethod
+    def from_documents(cls, documents):
+        records = cls()
+        for company in documents:
+            records.add(company)
+        records.build_names()
+        return records
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, company):
+        name = normalize_entity_name(company.get('company_name'))
+        self.ids.append(company['_id'])
+        self.entity_names.append(name)
+        self.keys['name'].append(_optional_key(name))
+        self.keys['phone'].append(_optional_key(normalize_phone(company.get('phone_number'))))
+        self.keys['domain'].append(_optional_key(company.get('domain') or normalize_domain(company.get('website'))))
+        self.keys['address'].append(_optional_key(normalize_address(company.get('address'))))
+        self.keys['place_id'].append(_optional_key(company.get('place_id')))
+
+    def build_names(self):
+        """
+        Drops the words shared by many companies from each name, so 'ABC Roofing'
+        and 'XYZ Roofing' are not similar just because both are roofers.
+        """
+        counts = Counter(token for name in self.entity_names if name for token in set(name.split()))
+        common = max(2, int(len(self) * COMMON_TOKEN_SHARE))
+        self.names = []
+        for name in self.entity_names:
+            if not name:
+                self.names.append(None)
+                continue
+            distinctive = ' '.join(token for token in name.split() if counts[token] <= common)
+            self.names.append(distinctive or name)
+        self.entity_names = None
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = array('l', range(size))
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+def _blocks(keyed, index_bits, max_block_size):
+    """
+    Groups (key, index) pairs packed as key << index_bits | index.
+
+    Sorting packed ints is much cheaper than building a dict of lists per key.
+
+    :return: (blocks of 2 to max_block_size indexes, indexes of larger blocks)
+    """
+    keyed.sort()
+    mask = (1 << index_bits) - 1
+    blocks, oversized = [], []
+    start = 0
+    for end in range(1, len(keyed) + 1):
+        if end < len(keyed) and keyed[end] >> index_bits == keyed[start] >> index_bits:
+            continue
+        size = end - start
+        if size > max_block_size:
+            oversized.extend(packed & mask for packed in keyed[start:end])
+        elif size > 1:
+            blocks.append([packed & mask for packed in keyed[start:end]])
+        start = end
+    return blocks, oversized
+
+
+def candidate_blocks(records, max_block_size=ER_MAX_BLOCK_SIZE):
+    """
+    Returns the blocks of records to compare pairwise: records sharing a
+    normalized name, phone, domain, address or place_id, or an LSH bucket of
+    their name's MinHash signature.
+
+    Keys shared by more than max_block_size records are cleared from the
+    records, so a call centre's phone number or a shared hosting domain
+    neither forms a block nor counts as evidence in match().
+    """
+    index_bits = max(len(records), 1).bit_length()
+    blocks = []
+    for field in BLOCK_FIELDS:
+        keys = records.keys[field]
+        field_blocks, oversized = _blocks([key << index_bits | i for i, key in enumerate(keys) if key],
+                                          index_bits, max_block_size)
+        for i in oversized:
+            keys[i] = 0
+        blocks.extend(field_blocks)
+        metrics.inc('entity_resolution_blocks_total', len(field_blocks), key=field)
+
+    with metrics.timer('entity_resolution_seconds', phase='minhash'):
+        buckets = array('Q')
+        for name in records.names:
+            buckets.extend(minhash_bands(name) if name else [0] * MINHASH_BANDS)
+    # One band at a time, so only one band's packed keys are in memory
+    for band in range(MINHASH_BANDS):
+        band_blocks, _ = _blocks([buckets[i * MINHASH_BANDS + band] << index_bits | i
+                                  for i, name in enumerate(records.names) if name],
+                                 index_bits, max_block_size)
+        blocks.extend(band_blocks)
+        metrics.inc('entity_resolution_blocks_total', len(band_blocks), key='minhash')
+    return blocks
+
+
+def match(records, i, j, name_threshold=ER_NAME_SIMILARITY):
+    """True if records i and j are judged to be the same company."""
+    keys = records.keys
+    place_ids = keys['place_id']
+    if place_ids[i] and place_ids[i] == place_ids[j]:
+        return True
+    evidence = 0
+    for field in EVIDENCE_FIELDS:
+        values = keys[field]
+        if values[i] and values[i] == values[j]:
+            evidence += 1
+    if evidence >= 2:
+        return True
+    return evidence == 1 and name_similarity(records.names[i], records.names[j]) >= name_threshold
+
+
+def find_clusters(records, max_block_size=ER_MAX_BLOCK_SIZE, name_threshold=ER_NAME_SIMILARITY):
+    """
+    Compares the records within each candidate block and joins matches with union-find.
+
+    :return: Lists of record indexes, one per cluster of two or more records.
+    """
+    blocks = candidate_blocks(records, max_block_size)
+    components = UnionFind(len(records))
+    comparisons = 0
+    with metrics.timer('entity_resolution_seconds', phase='compare'):
+        for block in blocks:
+            for position, i in enumerate(block):
+                for j in block[position + 1:]:
+                    if components.find(i) == components.find(j):
+                        continue
+                    comparisons += 1
+                    if match(records, i, j, name_threshold):
+                        components.union(i, j)
+    metrics.inc('entity_resolution_comparisons_total', comparisons)
+
+    clusters = {}
+    for i in range(len(records)):
+        root = components.find(i)
+        if root != i:  # Roots are the lowest index of their cluster, so each is seen before its members
+            clusters.setdefault(root, [root]).append(i)
+    clusters = list(clusters.values())
+    logger.info("Compared %d pairs in %d blocks: %d clusters.", comparisons, len(blocks), len(clusters))
+    return clusters
+
+
+def cluster_companies(max_block_size=ER_MAX_BLOCK_SIZE, name_threshold=ER_NAME_SIMILARITY):
+    """
+    Finds the duplicate clusters among all companies and replaces the contents of company_clusters with them.
+
+    :return: Dict with the number of companies, clusters and duplicates found.
+    """
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    clusters_collection = get_mongo_collection('TestingDatabase', 'company_clusters')
+    records = CompanyRecords.load(companies_collection)
+    clusters = find_clusters(records, max_block_size, name_threshold)
+
+    clusters_collection.delete_many({})
+    now = datetime.now()
+    with BulkWriter(clusters_collection) as writer:
+        for members in clusters:
+            ids = sorted(records.ids[i] for i in members)
+            writer.insert({
+                '_id': ids[0],
+                'members': ids,
+                'size': len(ids),
+                'review': len(ids) > ER_MAX_CLUSTER_SIZE,
+                'created_at': now,
+            }, label=str(ids[0]))
+    return {
+        'companies': len(records),
+        'clusters': len(clusters),
+        'duplicates': sum(len(members) - 1 for members in clusters),
+    }
+
+
+def _filled(value):
+    return value not in EMPTY_VALUES
+
+
+def merge_cluster(companies):
+    """
+    Works out how to merge one cluster of full company documents.
+
+    The company with the most filled-in fields survives (the oldest _id on a
+    tie). It keeps its own values and takes missing ones from the others in
+    the same order; emails of all members are combined, the survivor's own
+    email first.
+
+    :return: (survivor, $set document, unique-key $set document, duplicate _ids).
+        The unique keys can only be set once the duplicates holding them are gone.
+    """
+    ranked = sorted(companies, key=lambda c: (-sum(_filled(c.get(f)) for f in MERGE_FILL_FIELDS + ('email',)), c['_id']))
+    survivor, duplicates = ranked[0], ranked[1:]
+
+    updates, unique_updates = {}, {}
+    for field in MERGE_FILL_FIELDS:
+        if not _filled(survivor.get(field)):
+            value = next((c[field] for c in duplicates if _filled(c.get(field))), None)
+            if value is not None:
+                updates[field] = value
+    for field in DEDUPE_FIELDS:
+        if not _filled(survivor.get(field)):
+            value = next((c[field] for c in duplicates if _filled(c.get(field))), None)
+            if value is not None:
+                unique_updates[field] = value
+
+    emails = []
+    for company in ranked:
+        for email in [company.get('email')] + list(company.get('other_emails') or []):
+            if _filled(email) and email.lower() not in emails:
+                emails.append(email.lower())
+    if emails:
+        updates['email'], updates['other_emails'] = emails[0], emails[1:]
+    if any(c.get('has_been_hunted') for c in duplicates) and not survivor.get('has_been_hunted'):
+        updates['has_been_hunted'] = True
+    return survivor, updates, unique_updates, [c['_id'] for c in duplicates]
+
+
+def merge_clusters(dry_run=False, limit=None, include_large=False, batch_size=500):
+    """
+    Merges the clusters stored by cluster_companies, batch by batch.
+
+    Each duplicate is archived in company_merges, with the _id of the company
+    it was merged into, before it is deleted. Merged clusters are removed from
+    company_clusters, so an interrupted merge can be re-run.
+
+    :param dry_run: Only count what would be merged.
+    :param limit: Maximum number of clusters to merge.
+    :param include_large: Also merge clusters flagged for review.
+    :return: Dict with the number of clusters merged and companies removed.
+    """
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    clusters_collection = get_mongo_collection('TestingDatabase', 'company_clusters')
+    merges_collection = get_mongo_collection('TestingDatabase', 'company_merges')
+    query = {} if include_large else {'review': False}
+    stats = {'clusters': 0, 'removed': 0, 'skipped': 0}
+
+    cursor = clusters_collection.find(query, batch_size=batch_size).sort('_id', 1).limit(limit or 0)
+    batch = []
+    for cluster in cursor:
+        batch.append(cluster)
+        if len(batch) >= batch_size:
+            _merge_batch(batch, companies_collection, clusters_collection, merges_collection, stats, dry_run)
+            batch = []
+    if batch:
+        _merge_batch(batch, companies_collection, clusters_collection, merges_collection, stats, dry_run)
+    logger.info("Entity resolution merge%s: %s", ' (dry run)' if dry_run else '', stats)
+    return stats
+
+
+def _merge_batch(clusters, companies_collection, clusters_collection, merges_collection, stats, dry_run):
+    ids = [_id for cluster in clusters for _id in cluster['members']]
+    companies = {company['_id']: company for company in companies_collection.find({'_id': {'$in': ids}})}
+
+    merges = []
+    for cluster in clusters:
+        members = [companies[_id] for _id in cluster['members'] if _id in companies]
+        if len(members) < 2:  # Already merged, or deleted since clustering
+            stats['skipped'] += 1
+            continue
+        merges.append(merge_cluster(members))
+        stats['clusters'] += 1
+        stats['removed'] += len(members) - 1
+    if dry_run:
+        return
+
+    now = datetime.now()
+    with BulkWriter(merges_collection) as archive:
+        for survivor, _, _, duplicate_ids in merges:
+            for _id in duplicate_ids:
+                archive.update({'_id': _id}, {'$set': {'merged_into': survivor['_id'], 'merged_at': now,
+                                                       'company': companies[_id]}},
+                               upsert=True, validate=False)
+    # Survivors are updated and duplicates deleted only once every duplicate is archived
+    with BulkWriter(companies_collection) as writer:
+        for survivor, updates, _, duplicate_ids in merges:
+            if updates:
+                writer.update({'_id': survivor['_id']}, {'$set': updates}, validate=False,
+                              label=survivor.get('company_name'))
+            for _id in duplicate_ids:
+                writer.delete({'_id': _id})
+    with BulkWriter(companies_collection) as writer:
+        for survivor, _, unique_updates, _ in merges:
+            if unique_updates:
+                writer.update({'_id': survivor['_id']}, {'$set': unique_updates}, validate=False,
+                              label=survivor.get('company_name'))
+    with BulkWriter(clusters_collection) as writer:
+        for cluster in clusters:
+            writer.delete({'_id': cluster['_id']})
+
+
+def show_clusters(limit=20):
+    """Prints the largest stored clusters with the fields they were matched on."""
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    clusters_collection = get_mongo_collection('TestingDatabase', 'company_clusters')
+    projection = {field: 1 for field in LOAD_FIELDS}
+    for cluster in clusters_collection.find().sort('size', -1).limit(limit):
+        flag = ' (review)' if cluster.get('review') else ''
+        print(f"Cluster {cluster['_id']}: {cluster['size']} companies{flag}")
+        for company in companies_collection.find({'_id': {'$in': cluster['members']}}, projection):
+            print(f"  {company.get('company_name')} | {company.get('phone_number')} | "
+                  f"{company.get('domain') or company.get('website')} | {company.get('address')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cluster = commands.add_parser('cluster', help='Find duplicate clusters and store them in company_clusters')
+    cluster.add_argument('--max-block-size', type=int, default=ER_MAX_BLOCK_SIZE,
+                         help='Ignore keys shared by more companies than this')
+    cluster.add_argument('--name-similarity', type=float, default=ER_NAME_SIMILARITY,
+                         help='Name trigram similarity needed alongside one shared phone, domain or address')
+
+    show = commands.add_parser('show', help='Print the largest clusters')
+    show.add_argument('--limit', type=int, default=20)
+
+    merge = commands.add_parser('merge', help='Merge the stored clusters')
+    merge.add_argument('--dry-run', action='store_true', help='Only count what would be merged')
+    merge.add_argument('--limit', type=int, default=None, help='Maximum number of clusters to merge')
+    merge.add_argument('--include-large', action='store_true',
+                       help=f'Also merge clusters of more than {ER_MAX_CLUSTER_SIZE} companies')
+
+    args = parser.parse_args()
+    configure_logging()
+    if args.command == 'cluster':
+        print(cluster_companies(args.max_block_size, args.name_similarity))
+    elif args.command == 'show':
+        show_clusters(args.limit)
+    elif args.command == 'merge':
+        print(merge_clusters(args.dry_run, args.limit, args.include_large))
+
+
+if __name__ == '__main__':
+    main()
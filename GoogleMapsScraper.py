@@ -1,23 +1,74 @@
 import googlemaps
 import time
+from concurrent.futures import ThreadPoolExecutor
+from rate_limiting import TokenBucket
+from cache import SQLiteCache
 from MongoConnection import get_mongo_collection
-from validators import validate_data, companies_schema
+from validators import companies_schema
+from bulk_writer import BulkWriter
+from dedupe import CompanyDedupeIndex, ensure_company_indexes
+from normalizers import normalize_company_name, normalize_domain, normalize_website
 from datetime import datetime
+import threading
 import sys
 from dotenv import load_dotenv
+import metrics
 import os
+import logging
 
-load_dotenv()
-
-# Connect to the 'companies' collection
-companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+logger = logging.getLogger(__name__)
 
-# Initialize the Google Maps client
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+load_dotenv()
 
 # Set UTF-8 encoding for output
 sys.stdout.reconfigure(encoding='utf-8')
 
+# Alternative API host, e.g. the local stub in stubs/places.py
+GOOGLE_MAPS_BASE_URL = os.getenv('GOOGLE_MAPS_BASE_URL')
+
+# Places API quota, shared by text searches and details lookups. SearchJobs
+# workers split it between the jobs running at the time.
+PLACES_QPS = float(os.getenv('PLACES_QPS', '10'))
+PLACES_DETAILS_WORKERS = int(os.getenv('PLACES_DETAILS_WORKERS', '8'))
+places_limiter = TokenBucket(PLACES_QPS)
+
+# Place Details responses are cached on disk between runs
+PLACES_CACHE_TTL = float(os.getenv('PLACES_CACHE_TTL_DAYS', '30')) * 86400
+PLACES_CACHE_MAX_ENTRIES = int(os.getenv('PLACES_CACHE_MAX_ENTRIES', '200000'))
+
+# next_page_token polling
+PAGE_TOKEN_INITIAL_WAIT = 1.5
+PAGE_TOKEN_RETRY_WAIT = 0.5
+PAGE_TOKEN_RETRIES = 6
+
+
+_gmaps = None
+_places_cache = None
+_clients_lock = threading.Lock()
+
+def get_gmaps_client():
+    """
+    Returns the shared Google Maps client, creating it on first use.
+
+    Requests are paced by places_limiter, so the client's own throttle is set
+    no lower than PLACES_QPS.
+    """
+    global _gmaps
+    with _clients_lock:
+        if _gmaps is None:
+            _gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'),
+                                       queries_per_second=max(int(PLACES_QPS), 1),
+                                       queries_per_minute=max(int(PLACES_QPS * 60), 60),
+                                       **({'base_url': GOOGLE_MAPS_BASE_URL} if GOOGLE_MAPS_BASE_URL else {}))
+        return _gmaps
+
+def get_places_cache():
+    """Returns the on-disk Place Details cache, opening it on first use."""
+    global _places_cache
+    with _clients_lock:
+        if _places_cache is None:
+            _places_cache = SQLiteCache('place_details', ttl=PLACES_CACHE_TTL, max_entries=PLACES_CACHE_MAX_ENTRIES)
+        return _places_cache
 
 def clean_website(website):
     # Check if the website is not None and is a string before processing
@@ -25,92 +76,200 @@ def clean_website(website):
         website = website.split('?')[0]
     return website
 
-def get_businesses(industry, location):
-    businesses = []
-    next_page_token = None
-    
-    while True:
-        if next_page_token:
-            places_result = gmaps.places(query=f'{industry} in {location}', page_token=next_page_token)
-        else:
-            places_result = gmaps.places(query=f'{industry} in {location}')
-        
-        for place in places_result['results']:
-            business_info = {
-                'company_name': place.get('name', 'N/A'),
-                'address': place.get('formatted_address', 'N/A')
-            }
+def places_request(endpoint, **params):
+    """Calls a Places endpoint ('places' or 'place') under the shared rate limit, recording its latency."""
+    places_limiter.acquire()
+    status = 'OK'
+    try:
+        with metrics.timer('http_request_seconds', api='places', endpoint=endpoint):
+            return getattr(get_gmaps_client(), endpoint)(**params)
+    except googlemaps.exceptions.ApiError as e:
+        status = e.status
+        raise
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        metrics.inc('http_requests_total', api='places', endpoint=endpoint, status=status)
 
-            place_id = place['place_id']
-            details = gmaps.place(place_id=place_id, fields=['name', 'formatted_address', 'formatted_phone_number', 'website'])
-            result = details.get('result', {})
-
-            business_info['phone_number'] = result.get('formatted_phone_number')
-            business_info['website'] = clean_website(result.get('website', None))
-            business_info['scrape_timestamp'] = datetime.now()
-            business_info['search_term_used'] = f'{industry} in {location}'
-            
-            # Add to list of businesses
-            businesses.append(business_info)
-    
-        next_page_token = places_result.get('next_page_token')
-        
-        if not next_page_token:
-            break
-        else:
-            # Wait a few seconds before using the next_page_token
-            time.sleep(2)
-    
-    return businesses
+def fetch_place_details(place_id):
+    """Fetch Place Details for one place, from the on-disk cache if fresh, else under the shared Places rate limit."""
+    result = get_places_cache().get(place_id)
+    if result is not None:
+        return result
+    details = places_request('place', place_id=place_id,
+                             fields=['name', 'formatted_address', 'formatted_phone_number', 'website'])
+    result = details.get('result', {})
+    get_places_cache().set(place_id, result)
+    return result
+
+def fetch_next_page(query, page_token):
+    """
+    Fetch the next page of a text search.
+
+    A next_page_token only becomes valid a short while after it is issued, so
+    the request is retried on INVALID_REQUEST instead of sleeping a fixed time.
+    """
+    time.sleep(PAGE_TOKEN_INITIAL_WAIT)
+    for attempt in range(PAGE_TOKEN_RETRIES):
+        try:
+            return places_request('places', query=query, page_token=page_token)
+        except googlemaps.exceptions.ApiError as e:
+            if e.status != 'INVALID_REQUEST' or attempt == PAGE_TOKEN_RETRIES - 1:
+                raise
+            time.sleep(PAGE_TOKEN_RETRY_WAIT)
+
+def _complete_business(business_info, future, query):
+    """
+    Adds the details to a business, or returns None if the lookup failed.
+
+    A business saved without its details would keep its place_id, and so be
+    skipped as known by every later search; dropping it lets the next search retry it.
+    """
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.warning("Failed to fetch details for %s: %s", business_info['company_name'], e)
+        metrics.inc('companies_discovered_total', outcome='details_failed')
+        return None
+
+    business_info['phone_number'] = result.get('formatted_phone_number')
+    business_info['website'] = clean_website(result.get('website', None))
+    business_info['scrape_timestamp'] = datetime.now()
+    business_info['search_term_used'] = query
+    return business_info
+
+def iter_businesses(industry, location, max_workers=PLACES_DETAILS_WORKERS, is_known_place=None):
+    """
+    Search Google Maps for businesses and yield them with their details, page by page.
+
+    Details lookups for a page run on a thread pool while the next page token
+    becomes valid, so a query takes about as long as its page waits. A page's
+    businesses are yielded as soon as the next page has been requested, so
+    callers can save them while the search continues.
 
-def collect_and_save_data(industry, location):
-    """Collect data from Google Maps and save it to the database, avoiding duplicates."""
+    :param is_known_place: Optional callable taking a place_id. Hits for which it
+        returns True are already stored, so they are dropped without a details call.
+    """
+    query = f'{industry} in {location}'
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        places_result = places_request('places', query=query)
+
+        while places_result is not None:
+            pending = []  # (business_info, details future) in search order
+            for place in places_result['results']:
+                business_info = {
+                    'company_name': place.get('name', 'N/A'),
+                    'address': place.get('formatted_address', 'N/A')
+                }
+
+                place_id = place['place_id']
+                if is_known_place is not None and is_known_place(place_id):
+                    logger.debug("Skipping known place: %s", business_info['company_name'])
+                    continue
+                business_info['place_id'] = place_id
+                pending.append((business_info, pool.submit(fetch_place_details, place_id)))
+
+            next_page_token = places_result.get('next_page_token')
+            # Details for this page keep running while we wait for the token
+            places_result = fetch_next_page(query, next_page_token) if next_page_token else None
+
+            for business_info, future in pending:
+                business = _complete_business(business_info, future, query)
+                if business is not None:
+                    yield business
+
+def get_businesses(industry, location, max_workers=PLACES_DETAILS_WORKERS, is_known_place=None):
+    """Search Google Maps for businesses and return them all as a list; see iter_businesses."""
+    return list(iter_businesses(industry, location, max_workers, is_known_place))
+
+# Loaded once per run and shared by every (industry, location) query
+_dedupe_index = None
+
+def get_dedupe_index(companies_collection):
+    """Returns the run's dedupe index, loading it and ensuring the unique indexes on first use."""
+    global _dedupe_index
+    if _dedupe_index is None:
+        ensure_company_indexes(companies_collection)
+        _dedupe_index = CompanyDedupeIndex.load(companies_collection)
+    return _dedupe_index
+
+def reset_dedupe_index():
+    """Drops the loaded dedupe index, so the next query reloads it with the companies other workers stored since."""
+    global _dedupe_index
+    _dedupe_index = None
+
+def collect_and_save_data(industry, location, on_inserted=None, limit=None,
+                          max_workers=PLACES_DETAILS_WORKERS, **writer_options):
+    """
+    Collect data from Google Maps and save it to the database, avoiding duplicates.
+
+    Businesses are saved as the search yields them rather than after it finishes.
+
+    :param on_inserted: Optional callable receiving each batch of newly inserted
+        company documents (with their _id) once the batch is written.
+    :param limit: Stop the search once this many new companies are queued.
+    :param max_workers: Concurrent Place Details lookups.
+    :param writer_options: Passed on to the BulkWriter, e.g. a small batch_size for streaming.
+    """
     companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    dedupe_index = get_dedupe_index(companies_collection)
     
-    # Fetch data from Google Maps
-    businesses = get_businesses(industry, location)
-
-    for business in businesses:
-        # Explicitly check for None to handle missing or empty company names correctly
-        company_name = business.get('company_name')
-        website = clean_website(business.get('website'))
-
-        # Correct the check to ensure valid company names are processed
-        if company_name is None or company_name.strip() == '':
-            print(f"Skipping entry due to missing company_name: {business}")
-            continue  # Skip to the next business if company_name is missing
-
-        # Check if the company already exists in the database
-        existing_company = companies_collection.find_one({
-            '$or': [
-                {'company_name': company_name},
-                {'website': website}
-            ]
-        })
-        
-        if existing_company:
-            print(f"Skipping duplicate company: {company_name}")
-            continue  # Skip to the next business if this one already exists
-
-        # Prepare the business data to be inserted
-        business_data = {
-            'company_name': company_name,
-            'website': website,
-            'address': business.get('address'),
-            'phone_number': business.get('phone_number'),
-            'search_term_used': f"{industry} in {location}",
-            'scrape_timestamp': datetime.now(),
-            'has_been_hunted': False,  # Default value
-        }
-
-        # Validate the business data
-        try:
-            validate_data(business_data, companies_schema)
-            # Insert the new company into the database
-            companies_collection.insert_one(business_data)
-            print(f"Added new company: {company_name}")
-        except ValueError as e:
-            print(f"Validation failed for {company_name or website}: {e}")
+    # Stream data from Google Maps, skipping details calls for places already stored
+    businesses = iter_businesses(industry, location, max_workers, is_known_place=dedupe_index.has_place_id)
+
+    added = 0
+    with BulkWriter(companies_collection, schema=companies_schema, on_inserted=on_inserted,
+                    **writer_options) as writer:
+        for business in businesses:
+            if limit is not None and added >= limit:
+                businesses.close()  # Stops the search; pending details lookups finish first
+                break
+
+            # Explicitly check for None to handle missing or empty company names correctly
+            company_name = business.get('company_name')
+            website = clean_website(business.get('website'))
+
+            # Correct the check to ensure valid company names are processed
+            if company_name is None or company_name.strip() == '':
+                logger.debug("Skipping entry due to missing company_name: %s", business)
+                continue  # Skip to the next business if company_name is missing
+
+            # Check if the company already exists in the database or was queued earlier in this run
+            business_data = {
+                'company_name': company_name,
+                'normalized_name': normalize_company_name(company_name),
+                'website': website,
+                'site': normalize_website(website),
+                'domain': normalize_domain(website),
+                'place_id': business.get('place_id'),
+            }
+
+            if dedupe_index.contains(business_data):
+                metrics.inc('companies_discovered_total', outcome='duplicate')
+                logger.debug("Skipping duplicate company: %s", company_name)
+                continue  # Skip to the next business if this one already exists
+
+            # Prepare the business data to be inserted
+            business_data.update({
+                'address': business.get('address'),
+                'phone_number': business.get('phone_number'),
+                'search_term_used': f"{industry} in {location}",
+                'scrape_timestamp': datetime.now(),
+                'has_been_hunted': False,  # Default value
+            })
+
+            # Validate and queue the new company; the writer inserts in batches
+            # and the unique indexes reject anything the in-memory check missed
+            if writer.insert(business_data, label=company_name):
+                dedupe_index.add(business_data)
+                added += 1
+                metrics.inc('companies_discovered_total', outcome='new')
+                logger.debug("Added new company: %s", company_name)
+
+    logger.info("Place details cache: %s", get_places_cache().stats())
+    return writer.stats
 
 # Example usage
 if __name__ == '__main__':
@@ -0,0 +1,135 @@
+from urllib3.util.retry import Retry
+from http_transport import new_session
+from cache import SQLiteCache
+from rate_limiting import TokenBucket
+from dotenv import load_dotenv
+import metrics
+import threading
+import time
+import os
+
+load_dotenv()
+
+HUNTER_API_BASE = os.getenv('HUNTER_API_BASE', 'https://api.hunter.io/v2')
+HUNTER_QPS = float(os.getenv('HUNTER_QPS', '10'))  # Hunter allows 15 requests/s on domain-search
+HUNTER_CACHE_TTL = float(os.getenv('HUNTER_CACHE_TTL_DAYS', '90')) * 86400
+HUNTER_CREDIT_RESERVE = int(os.getenv('HUNTER_CREDIT_RESERVE', '0'))  # Credits to leave unspent
+HUNTER_TIMEOUT = 30
+
+
+class HunterQuotaExceeded(Exception):
+    """Raised before a request that would spend credits the account no longer has."""
+
+
+class HunterClient:
+    """
+    Hunter.io API client with a domain-search cache, retries, rate limiting and credit tracking.
+
+    - Responses are cached on disk per domain, so re-runs do not pay again.
+    - One keep-alive session from http_transport is shared; the API key travels in the X-API-KEY header.
+    - 429 and 5xx responses are retried with exponential backoff, honouring Retry-After.
+    - Requests are spaced by a token bucket, which is slowed down when the
+      X-RateLimit-* response headers show the window is nearly used up.
+    - The remaining search credits are read from /account on first use and
+      counted down; HunterQuotaExceeded is raised instead of overspending.
+    """
+
+    def __init__(self, api_key, base_url=HUNTER_API_BASE, qps=HUNTER_QPS,
+                 credit_reserve=HUNTER_CREDIT_RESERVE, cache=None):
+        self.base_url = base_url.rstrip('/')
+        self.qps = qps
+        self.credit_reserve = credit_reserve
+        self.cache = cache if cache is not None else SQLiteCache('hunter_domain_search', ttl=HUNTER_CACHE_TTL)
+        self.limiter = TokenBucket(self.qps)
+        self.remaining_credits = None
+        self.stats = {'requests': 0, 'cached': 0, 'credits_spent': 0}
+        self._credits_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        retry = Retry(total=5, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=('GET',), respect_retry_after_header=True, raise_on_status=False)
+        self.session = new_session(max_retries=retry, pool_connections=4, pool_maxsize=32)
+        self.session.headers['X-API-KEY'] = api_key or ''
+
+    def _get(self, path, params=None):
+        self.limiter.acquire()
+        with metrics.timer('http_request_seconds', api='hunter', endpoint=path):
+            response = self.session.get(f'{self.base_url}/{path}', params=params, timeout=HUNTER_TIMEOUT)
+        metrics.inc('http_requests_total', api='hunter', endpoint=path, status=response.status_code)
+        self._count('requests')
+        self._apply_rate_limit_headers(response.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def _count(self, key):
+        # Worker threads share the client
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _apply_rate_limit_headers(self, headers):
+        """Waits out the window if it is spent; otherwise paces the remaining requests across it."""
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = float(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        # Reset is either seconds until reset or an epoch timestamp
+        wait = reset - time.time() if reset > 1e9 else reset
+        if wait <= 0:
+            return
+        if remaining <= 0:
+            time.sleep(wait)
+        else:
+            self.limiter.set_rate(min(self.qps, remaining / wait))
+
+    def refresh_credits(self):
+        """Reads the remaining domain-search credits from the account endpoint."""
+        searches = self._get('account')['data']['requests']['searches']
+        with self._credits_lock:
+            self.remaining_credits = searches['available'] - searches['used']
+        return self.remaining_credits
+
+    def _reserve_credit(self):
+        """
+        Takes a credit before the request, so parallel workers cannot all pass
+        the check on the last credit above the reserve.
+        """
+        if self.remaining_credits is None:
+            self.refresh_credits()
+        with self._credits_lock:
+            if self.remaining_credits - self.credit_reserve <= 0:
+                raise HunterQuotaExceeded(
+                    f"Hunter.io credits exhausted ({self.remaining_credits} left, reserve {self.credit_reserve})."
+                )
+            self.remaining_credits -= 1
+
+    def _release_credit(self):
+        """Gives back a credit reserved for a search that was not charged."""
+        with self._credits_lock:
+            self.remaining_credits += 1
+
+    def domain_search(self, domain):
+        """
+        Returns the 'data' object of a domain search, from the cache when fresh.
+
+        :raises HunterQuotaExceeded: If the search would exceed the remaining credits.
+        :raises requests.exceptions.RequestException: If the request fails after retries.
+        """
+        cached = self.cache.get(domain)
+        if cached is not None:
+            self._count('cached')
+            return cached
+
+        self._reserve_credit()
+        try:
+            data = self._get('domain-search', {'domain': domain})['data']
+        except Exception:
+            self._release_credit()
+            raise
+        # Hunter only charges searches that return at least one email
+        if data.get('emails'):
+            self._count('credits_spent')
+        else:
+            self._release_credit()
+        self.cache.set(domain, data)
+        return data
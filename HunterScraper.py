@@ -1,59 +1,97 @@
 import requests
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from MongoConnection import get_mongo_collection
-from validators import validate_data, companies_schema, people_schema
+from validators import companies_schema, people_schema
+from bulk_writer import BulkWriter
+from HunterClient import HunterClient, HunterQuotaExceeded
+from pymongo import ReturnDocument
+from dedupe import domain_filter
+from checkpoints import PartitionedScan
+from normalizers import normalize_domain
 from WebsiteScraper import clean_email, validate_email
 from dotenv import load_dotenv
+import threading
+import socket
 import os
+import logging
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 # Set Hunter.io API key
 HUNTER_API_KEY =  os.getenv('HUNTER_API_KEY')
 
+# Parallel Hunter stage settings
+HUNTER_WORKERS = int(os.getenv('HUNTER_WORKERS', '4'))
+HUNT_LEASE_SECONDS = int(os.getenv('HUNT_LEASE_SECONDS', '1800'))  # A claim older than this is considered abandoned
+
+# Companies the Hunter stage still has to process
+UNHUNTED_QUERY = {'has_been_hunted': False, 'website': {'$type': 'string', '$nin': ['', 'N/A']}}
+
+# The only company fields the Hunter stage reads
+HUNTER_FIELDS = ['company_name', 'search_term_used', 'website', 'domain',
+                 'other_emails', 'linkedin_url', 'linkedin_description']
+
+_hunter_client = None
+
+def get_hunter_client():
+    """Returns the shared HunterClient, creating it on first use."""
+    global _hunter_client
+    if _hunter_client is None:
+        _hunter_client = HunterClient(HUNTER_API_KEY)
+    return _hunter_client
+
 def scrape_hunter_data(domain):
-    """Scrape company data and employee information from Hunter.io using the domain."""
-    headers = {
-        'Authorization': f'Bearer {HUNTER_API_KEY}'
-    }
+    """
+    Scrape company data and employee information from Hunter.io using the domain.
+
+    HunterQuotaExceeded is not caught, so a run stops before the credits run out.
+    """
     try:
-        response = requests.get(f'https://api.hunter.io/v2/domain-search?domain={domain}&api_key={HUNTER_API_KEY}')
-        response.raise_for_status()
-        data = response.json()
-        return data['data']
-    except requests.exceptions.RequestException as e:
-        print(f"Error accessing Hunter.io API: {e}")
+        return get_hunter_client().domain_search(domain)
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        logger.warning("Error accessing Hunter.io API: %s", e)
         return None
 
 
+# Registrable domain -> company document (or None), kept for the rest of the run
+_company_by_domain = {}
+
+def find_company_by_domain(domain):
+    """Look up a company by exact registrable domain, caching the result for the rest of the run."""
+    domain = normalize_domain(domain)
+    if domain is None:
+        return None
+    if domain not in _company_by_domain:
+        companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+        _company_by_domain[domain] = companies_collection.find_one(domain_filter(domain))
+    return _company_by_domain[domain]
+
 def get_company_name_by_email_domain(email_domain):
     """Retrieve the company name from the companies collection based on the email domain."""
-    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
-    company = companies_collection.find_one({'website': {'$regex': email_domain, '$options': 'i'}})
-    return company
+    return find_company_by_domain(email_domain)
 
-def update_company_emails(company, email):
+def update_company_emails(company, email, companies_writer):
     """Add email to the company's 'other_emails' list if it doesn't already exist."""
-    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
     if 'other_emails' not in company:
         company['other_emails'] = []
 
     if email not in company['other_emails']:
         company['other_emails'].append(email)
-        companies_collection.update_one(
+        companies_writer.update(
             {'_id': company['_id']},
-            {'$set': {'other_emails': company['other_emails'], 'scrape_timestamp': datetime.now(timezone.utc)}}
+            {'$addToSet': {'other_emails': email}, '$set': {'scrape_timestamp': datetime.now(timezone.utc)}},
+            validate=False,  # A partial update; the email was validated by the caller
+            label=company.get('company_name', 'Unknown')
         )
-        print(f"Added email {email} to company {company.get('company_name', 'Unknown')}.")
+        logger.debug("Added email %s to company %s.", email, company.get('company_name', 'Unknown'))
 
 
-def update_company_info(company_data, domain):
+def update_company_info(company_data, company, domain, companies_writer):
     """Update company information in the database with data from Hunter.io."""
-    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
-    company = companies_collection.find_one({'website': {'$regex': domain, '$options': 'i'}})
-    
     if not company:
-        print(f"No matching company found for domain: {domain}")
+        logger.info("No matching company found for domain: %s", domain)
         return
     
     # Ensure required fields are included
@@ -65,35 +103,38 @@ def update_company_info(company_data, domain):
         'search_term_used': search_term_used,  # Required field
         'linkedin_url': company_data.get('linkedin', company.get('linkedin_url', '')),
         'linkedin_description': company_data.get('description', company.get('linkedin_description', '')),
-        'other_emails': [email['value'] for email in company_data.get('emails', []) if email['type'] == 'generic'],
         'scrape_timestamp': datetime.now(timezone.utc),
         'has_been_hunted': True  # Set to True after processing
     }
-    
-    try:
-        validate_data(updated_data, companies_schema)
-        companies_collection.update_one(
-            {'_id': company['_id']},
-            {'$set': updated_data}
-        )
-        print(f"Updated company information for {domain}.")
-    except ValueError as e:
-        print(f"Validation failed for {domain}: {e}")
+    update = {'$set': updated_data}
 
-def update_people_info(employees):
-    """Add or update people information in the database with data from Hunter.io."""
-    people_collection = get_mongo_collection('TestingDatabase', 'people')
-    
+    # Added to the list rather than replacing it, so emails the website stage
+    # saved for the same company are kept whichever write lands last
+    generic_emails = [email['value'].lower() for email in company_data.get('emails', [])
+                      if email['type'] == 'generic' and validate_email(email['value'].lower())]
+    if generic_emails:
+        update['$addToSet'] = {'other_emails': {'$each': generic_emails}}
+
+    if companies_writer.update({'_id': company['_id']}, update, label=domain):
+        logger.debug("Updated company information for %s.", domain)
+
+def update_people_info(employees, domain_company, domain, companies_writer, people_writer):
+    """
+    Add or update people information in the database with data from Hunter.io.
+
+    :param domain_company: The company already resolved for the searched domain; only
+        emails on other domains need a lookup.
+    """
     for employee in employees:
         email = employee.get('value', '').lower()
 
         # Validate the email
         if not validate_email(email):
-            print(f"Skipping invalid email: {email}")
+            logger.debug("Skipping invalid email: %s", email)
             continue
         
-        email_domain = email.split('@')[-1]
-        company = get_company_name_by_email_domain(email_domain)
+        email_domain = normalize_domain(email.split('@')[-1])
+        company = domain_company if email_domain == domain else get_company_name_by_email_domain(email_domain)
         company_name = company.get('company_name') if company else 'Unknown Company'
         
         # Process valid personal emails with first name
@@ -111,32 +152,157 @@ def update_people_info(employees):
                 'has_been_hunted': True
             }
             
-            try:
-                validate_data(person_data, people_schema)
-                people_collection.update_one(
-                    {'email': person_data['email']},
-                    {'$set': person_data},
-                    upsert=True  # Insert if not found, update if found
-                )
-                print(f"Updated person information for {person_data['first_name']} {person_data['last_name']}.")
-            except ValueError as e:
-                print(f"Validation failed for person {person_data.get('first_name', '')}: {e}")
+            # Insert if not found, update if found
+            if people_writer.update({'email': person_data['email']}, {'$set': person_data}, upsert=True,
+                                    label=f"person {person_data['first_name']}"):
+                logger.debug("Updated person information for %s %s.", person_data['first_name'], person_data['last_name'])
         else:
             # If the email is valid but lacks a name, add it to the company's other_emails
             if company and validate_email(email):
-                update_company_emails(company, email)
+                update_company_emails(company, email, companies_writer)
+
+def open_writers():
+    """
+    Returns (companies_writer, people_writer) for a Hunter run.
+
+    The companies writer is ordered because update_company_info and later
+    update_company_emails calls target the same document.
+    """
+    companies_writer = BulkWriter(get_mongo_collection('TestingDatabase', 'companies'),
+                                  schema=companies_schema, ordered=True)
+    people_writer = BulkWriter(get_mongo_collection('TestingDatabase', 'people'), schema=people_schema)
+    return companies_writer, people_writer
 
-def hunter_scraper(domain):
-    """Main function to perform scraping from Hunter.io and update databases."""
-    print(f"Scraping data for domain: {domain}")
+def hunter_scraper(domain, companies_writer=None, people_writer=None, company=None):
+    """
+    Main function to perform scraping from Hunter.io and update databases.
+
+    Pass the writers from open_writers() to batch writes across domains; when
+    omitted, writers are opened for this domain and flushed before returning.
+    The company is resolved once per domain; pass it in if the caller already has it.
+    """
+    domain = normalize_domain(domain) or domain
+    logger.debug("Scraping data for domain: %s", domain)
     hunter_data = scrape_hunter_data(domain)
     
     if not hunter_data:
-        print(f"Failed to retrieve data for {domain}.")
+        logger.info("Failed to retrieve data for %s.", domain)
         return
-    
-    update_company_info(hunter_data, domain)
-    update_people_info(hunter_data.get('emails', []))
+
+    if company is None:
+        company = find_company_by_domain(domain)
+
+    owns_writers = companies_writer is None
+    if owns_writers:
+        companies_writer, people_writer = open_writers()
+
+    update_company_info(hunter_data, company, domain, companies_writer)
+    update_people_info(hunter_data.get('emails', []), company, domain, companies_writer, people_writer)
+
+    if owns_writers:
+        companies_writer.close()
+        people_writer.close()
+
+def claim_company_to_hunt(companies_collection, worker_id, lease_seconds=HUNT_LEASE_SECONDS, company_id=None,
+                          projection=None):
+    """
+    Atomically claim one company that has not been hunted yet.
+
+    The claim is a lease: a company claimed by a worker that died becomes
+    claimable again once the lease expires, while live claims are never
+    handed out twice, even across overlapping runs.
+
+    :param company_id: Claim this specific company instead of any unhunted one.
+    :param projection: Fields to return; the whole document by default.
+    :return: The claimed company document, or None if there is nothing left to claim.
+    """
+    now = datetime.now(timezone.utc)
+    query = {} if company_id is None else {'_id': company_id}
+    return companies_collection.find_one_and_update(
+        {
+            **query,
+            **UNHUNTED_QUERY,
+            '$or': [
+                {'hunt_claimed_at': {'$exists': False}},
+                {'hunt_claimed_at': {'$lt': now - timedelta(seconds=lease_seconds)}},
+            ],
+        },
+        {'$set': {'hunt_claimed_at': now, 'hunt_claimed_by': worker_id}},
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+
+def hunt_claimed_company(company, companies_collection, companies_writer, people_writer):
+    """
+    Hunt a company claimed with claim_company_to_hunt and mark it as hunted.
+
+    :raises HunterQuotaExceeded: After releasing the claim, if the credits have run out.
+    """
+    domain = company.get('domain') or normalize_domain(company.get('website'))
+    if domain:
+        _company_by_domain.setdefault(domain, company)
+        try:
+            hunter_scraper(domain, companies_writer, people_writer, company=company)
+        except HunterQuotaExceeded:
+            # Release the claim so the company is picked up once credits are available
+            companies_collection.update_one({'_id': company['_id']},
+                                            {'$unset': {'hunt_claimed_at': '', 'hunt_claimed_by': ''}})
+            raise
+
+    # Update the has_been_hunted flag along with required fields
+    companies_writer.update(
+        {'_id': company['_id']},
+        {'$set': {
+            'has_been_hunted': True,
+            'company_name': company.get('company_name', 'Unknown Company'),
+            'search_term_used': company.get('search_term_used', 'Unknown Search Term')
+        }},
+        validate=False
+    )
+    logger.debug("Updated Hunter status for company: %s", company.get('company_name', 'Unknown Company'))
+
+def run_hunter_stage(workers=HUNTER_WORKERS, limit=None):
+    """
+    Hunt every company not yet hunted, processing domains on parallel workers.
+
+    Candidates come from a PartitionedScan over UNHUNTED_QUERY that reads only
+    their _ids; each one is then claimed with claim_company_to_hunt, so
+    parallel workers and overlapping runs never hunt the same domain twice.
+    The stage stops early when the Hunter.io credits run out, and a later run
+    resumes each partition from its checkpoint.
+
+    :param workers: Number of domains processed concurrently.
+    :param limit: Maximum number of companies to hunt.
+    :return: Dict with the number of companies hunted.
+    """
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    companies_collection.create_index('has_been_hunted')
+    companies_writer, people_writer = open_writers()
+    run_id = f'{socket.gethostname()}:{os.getpid()}'
+    stats = {'hunted': 0}
+    stats_lock = threading.Lock()
+
+    def hunt(candidate):
+        company = claim_company_to_hunt(companies_collection, run_id, company_id=candidate['_id'],
+                                        projection=HUNTER_FIELDS)
+        if company is None:  # Hunted or claimed by another worker since the scan read it
+            return
+        try:
+            hunt_claimed_company(company, companies_collection, companies_writer, people_writer)
+        except HunterQuotaExceeded as e:
+            logger.warning("Stopping HunterScraper: %s", e)
+            return False
+        with stats_lock:
+            stats['hunted'] += 1
+
+    scan = PartitionedScan(companies_collection, 'hunter_scraper', UNHUNTED_QUERY, projection={'_id': 1},
+                           before_save=lambda: (people_writer.flush(), companies_writer.flush()))
+    try:
+        scan.run(hunt, workers=workers, limit=limit)
+    finally:
+        companies_writer.close()
+        people_writer.close()
+    return {'hunted': stats['hunted']}
 
 # Example usage
 if __name__ == '__main__':
@@ -0,0 +1,247 @@
+"""
+Stream companies or people out of Mongo as CSV, JSON lines or Parquet lead lists.
+
+Usage:
+    python LeadExport.py companies leads.csv [--filter JSON] [--fields a,b,c] [--limit N]
+    python LeadExport.py people people.parquet --join-companies [--join-fields website,phone_number]
+
+The format follows the file extension (.csv, .jsonl, .parquet) unless --format
+is given; '-' writes CSV or JSON lines to stdout. --filter is a Mongo query in
+extended JSON, e.g. '{"email": {"$ne": null}}'.
+
+Documents are read through a projected, batched cursor and written one chunk
+at a time, so memory stays constant whatever the collection size. With
+--join-companies, each chunk of people looks up its companies with one $in
+query on the registrable domain of their email.
+"""
+from MongoConnection import get_mongo_collection
+from validators import companies_schema, people_schema
+from normalizers import normalize_domain
+from bson import json_util
+from datetime import datetime
+import argparse
+import metrics
+import json
+import csv
+import sys
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+DEFAULT_FIELDS = {
+    'companies': ['company_name', 'domain', 'website', 'email', 'other_emails', 'phone_number', 'address',
+                  'search_term_used', 'linkedin_url', 'linkedin_employees', 'year_founded', 'scrape_timestamp'],
+    'people': ['first_name', 'last_name', 'position', 'email', 'company_name', 'linkedin_profile',
+               'scrape_timestamp'],
+}
+DEFAULT_JOIN_FIELDS = ['domain', 'website', 'phone_number', 'address', 'linkedin_url', 'linkedin_employees']
+SCHEMAS = {'companies': companies_schema, 'people': people_schema}
+FORMATS = ('csv', 'jsonl', 'parquet')
+LIST_SEPARATOR = ';'  # Lists are joined into one CSV cell
+
+
+def iter_chunks(collection, query, fields, batch_size=EXPORT_BATCH_SIZE, limit=None):
+    """Yields lists of at most batch_size projected documents, in _id order."""
+    projection = {field: 1 for field in fields}
+    if '_id' not in fields:
+        projection['_id'] = 0
+    cursor = collection.find(query, projection, batch_size=batch_size).sort('_id', 1).limit(limit or 0)
+    try:
+        chunk = []
+        for document in cursor:
+            chunk.append(document)
+            if len(chunk) >= batch_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        cursor.close()
+
+
+def join_companies(people, companies_collection, join_fields):
+    """Adds company_<field> columns to each person, matched on the registrable domain of their email."""
+    domains = set()
+    for person in people:
+        person['_domain'] = normalize_domain((person.get('email') or '').rpartition('@')[2])
+        domains.add(person['_domain'])
+    domains.discard(None)
+
+    companies = {}
+    if domains:
+        projection = {'_id': 0, 'domain': 1, **{field: 1 for field in join_fields}}
+        # $type lets the planner use the partial domain_lookup index, see dedupe.domain_filter
+        for company in companies_collection.find({'domain': {'$in': list(domains), '$type': 'string'}}, projection):
+            companies.setdefault(company['domain'], company)
+
+    for person in people:
+        company = companies.get(person.pop('_domain'), {})
+        for field in join_fields:
+            person[f'company_{field}'] = company.get(field)
+    return people
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)  # ObjectId and anything else exotic
+
+
+class CsvChunkWriter:
+    def __init__(self, f, columns):
+        self.writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            self.writer.writerow({
+                key: LIST_SEPARATOR.join(map(str, value)) if isinstance(value, list) else value
+                for key, value in ((key, _plain(value)) for key, value in row.items())
+            })
+
+    def close(self):
+        pass
+
+
+class JsonLinesChunkWriter:
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+
+    def write(self, rows):
+        self.f.writelines(json.dumps({key: _plain(row.get(key)) for key in self.columns}, ensure_ascii=False) + '\n'
+                          for row in rows)
+
+    def close(self):
+        pass
+
+
+def arrow_type(rule):
+    """Maps a validators schema rule to a pyarrow type; unknown fields are strings."""
+    kind = (rule or {}).get('type')
+    if kind == 'datetime':
+        return pa.timestamp('us')
+    if kind == 'boolean':
+        return pa.bool_()
+    if kind == 'integer':
+        return pa.int64()
+    if kind == 'list':
+        return pa.list_(pa.string())
+    return pa.string()
+
+
+class ParquetChunkWriter:
+    """Writes each chunk as a row group, with column types taken from the collection's schema."""
+
+    def __init__(self, path, columns, schema):
+        self.columns = columns
+        self.schema = pa.schema([
+            (column, arrow_type(schema.get(column) or schema.get(column[len('company_'):]
+                                                                 if column.startswith('company_') else None)))
+            for column in columns
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def _value(self, value, field_type):
+        if value is None:
+            return None
+        if pa.types.is_timestamp(field_type) or pa.types.is_boolean(field_type) or pa.types.is_integer(field_type):
+            return value
+        if pa.types.is_list(field_type):
+            return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+        return value if isinstance(value, str) else str(_plain(value))
+
+    def write(self, rows):
+        arrays = {field.name: [self._value(row.get(field.name), field.type) for row in rows] for field in self.schema}
+        self.writer.write_table(pa.Table.from_pydict(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def export_collection(collection_name, path, fmt=None, query=None, fields=None, limit=None,
+                      batch_size=EXPORT_BATCH_SIZE, join=False, join_fields=None):
+    """
+    Streams a collection to a CSV, JSON lines or Parquet file.
+
+    :param collection_name: 'companies' or 'people'.
+    :param path: Output file, or '-' for stdout (CSV and JSON lines only).
+    :param fmt: 'csv', 'jsonl' or 'parquet'; defaults to the path's extension.
+    :param query: Mongo filter.
+    :param fields: Fields to export; defaults to DEFAULT_FIELDS for the collection.
+    :param join: Add company columns to people, matched by email domain.
+    :return: Dict with the number of rows and chunks written.
+    """
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower() or 'csv'
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(FORMATS)}.")
+    if fmt == 'parquet' and pa is None:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+    if fmt == 'parquet' and path == '-':
+        raise ValueError("Parquet cannot be written to stdout.")
+
+    fields = list(fields or DEFAULT_FIELDS[collection_name])
+    join_fields = list(join_fields or DEFAULT_JOIN_FIELDS) if join else []
+    read_fields = fields + (['email'] if join and 'email' not in fields else [])
+    columns = fields + [f'company_{field}' for field in join_fields]
+    collection = get_mongo_collection('TestingDatabase', collection_name)
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies') if join else None
+
+    f = None
+    if fmt == 'parquet':
+        writer = ParquetChunkWriter(path, columns, SCHEMAS[collection_name])
+    else:
+        f = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        writer = (CsvChunkWriter if fmt == 'csv' else JsonLinesChunkWriter)(f, columns)
+
+    stats = {'rows': 0, 'chunks': 0}
+    try:
+        for chunk in iter_chunks(collection, query or {}, read_fields, batch_size, limit):
+            if join:
+                join_companies(chunk, companies_collection, join_fields)
+            writer.write(chunk)
+            stats['rows'] += len(chunk)
+            stats['chunks'] += 1
+            metrics.inc('export_rows_total', len(chunk), collection=collection_name, format=fmt)
+    finally:
+        writer.close()
+        if f is not None and f is not sys.stdout:
+            f.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collection', choices=sorted(DEFAULT_FIELDS))
+    parser.add_argument('path', help="Output file, or '-' for stdout")
+    parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+    parser.add_argument('--filter', default='{}', help='Mongo query as extended JSON')
+    parser.add_argument('--fields', help='Comma-separated fields to export')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE, help='Documents per cursor batch and written chunk')
+    parser.add_argument('--join-companies', action='store_true', help='Add company columns to people by email domain')
+    parser.add_argument('--join-fields', help='Comma-separated company fields to join')
+    args = parser.parse_args()
+
+    if args.join_companies and args.collection != 'people':
+        parser.error('--join-companies only applies to people')
+    stats = export_collection(
+        args.collection, args.path, args.format, json_util.loads(args.filter),
+        args.fields.split(',') if args.fields else None, args.limit, args.batch_size,
+        args.join_companies, args.join_fields.split(',') if args.join_fields else None,
+    )
+    print(f"Exported {stats['rows']} {args.collection} in {stats['chunks']} chunks to {args.path}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,121 +1,323 @@
 from linkedin_api import Linkedin
-from datetime import datetime, timezone
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from MongoConnection import get_mongo_collection
-from validators import validate_data, companies_schema, people_schema
+from validators import companies_schema
+from bulk_writer import BulkWriter
+from rate_limiting import TokenBucket
+from cache import SQLiteCache
+from normalizers import normalize_company_name, normalize_domain
+from dotenv import load_dotenv
+import threading
+import metrics
+import time
+import os
+import logging
 
+logger = logging.getLogger(__name__)
 
-# Authenticate using LinkedIn credentials
-linkedin = Linkedin('user', 'pasword')
+load_dotenv()
 
-def normalize_url(url):
-    """Remove the scheme (http or https) and www from the URL for comparison."""
-    if url.startswith('http://'):
-        url = url[len('http://'):]
-    elif url.startswith('https://'):
-        url = url[len('https://'):]
-    
-    if url.startswith('www.'):
-        url = url[len('www.'):]
-    
-    return url
+LINKEDIN_USERNAME = os.getenv('LINKEDIN_USERNAME')
+LINKEDIN_PASSWORD = os.getenv('LINKEDIN_PASSWORD')
 
-def scrape_linkedin(company_name, company_website):
+# LinkedIn throttles sessions hard, so every API call goes through one slow bucket
+LINKEDIN_QPS = float(os.getenv('LINKEDIN_QPS', '0.5'))
+LINKEDIN_WORKERS = int(os.getenv('LINKEDIN_WORKERS', '4'))
+LINKEDIN_MIN_QPS = 0.05  # Floor the rate is halved down to after failed calls
+LINKEDIN_RECOVERY_SECONDS = 60  # A halved rate doubles again after this long without a failed call
+LINKEDIN_MAX_CONSECUTIVE_ERRORS = 5  # The stage stops after this many failed calls in a row
+linkedin_limiter = TokenBucket(LINKEDIN_QPS, capacity=1)
+
+# Full company profiles are cached on disk by urn_id
+LINKEDIN_CACHE_TTL = float(os.getenv('LINKEDIN_CACHE_TTL_DAYS', '30')) * 86400
+
+# Search hits are scored on their name before any profile is fetched
+LINKEDIN_MIN_NAME_SCORE = 0.5
+LINKEDIN_MAX_PROFILES = 3  # Profiles fetched per company, best candidates first
+GENERIC_NAME_TOKENS = {'the', 'and', 'inc', 'ltd', 'llc', 'corp', 'co', 'company', 'limited', 'incorporated'}
+
+
+class LinkedInThrottled(Exception):
+    """Raised when LinkedIn keeps failing calls, which usually means the session is being throttled."""
+
+
+class LinkedInLookupFailed(Exception):
+    """Raised when a search or profile call failed, so it is unknown whether the company has a page."""
+
+
+_linkedin = None
+_linkedin_cache = None
+_linkedin_lock = threading.Lock()
+_consecutive_errors = 0
+_last_rate_change = time.monotonic()
+
+def get_linkedin_client():
+    """Returns the shared LinkedIn session, logging in on first use."""
+    global _linkedin
+    with _linkedin_lock:
+        if _linkedin is None:
+            _linkedin = Linkedin(LINKEDIN_USERNAME, LINKEDIN_PASSWORD)
+        return _linkedin
+
+def get_linkedin_cache():
+    """Returns the on-disk company profile cache, opening it on first use."""
+    global _linkedin_cache
+    with _linkedin_lock:
+        if _linkedin_cache is None:
+            _linkedin_cache = SQLiteCache('linkedin_company', ttl=LINKEDIN_CACHE_TTL)
+        return _linkedin_cache
+
+def _call(endpoint, function, *args, **kwargs):
+    """
+    Calls the LinkedIn API under the shared rate limit.
+
+    A failed call halves the rate; once LINKEDIN_RECOVERY_SECONDS pass without
+    another failure it doubles again, back up to LINKEDIN_QPS. After
+    LINKEDIN_MAX_CONSECUTIVE_ERRORS failures in a row, LinkedInThrottled is
+    raised so the run stops before the session is banned.
+    """
+    global _consecutive_errors, _last_rate_change
+    linkedin_limiter.acquire()
     try:
-        # Search for the company using its name
-        normalized_website = normalize_url(company_website)
-
-        results = linkedin.search_companies(keywords=[company_name])
-        
-        for result in results:
-            
-            # Fetch the company data
-            company_data = linkedin.get_company(result['urn_id'])
-            
-            # Check if the company website matches
-            linkedin_website = company_data.get('companyPageUrl', '').split('//')[-1]
-            linkedin_website = normalize_url(linkedin_website)
-            if normalized_website in linkedin_website:
-                # Extract relevant data for each company and save to the database
-                company_info = {
-                    'name':company_data['name'],
-                    'website_domain':company_data['companyPageUrl'].split('//')[-1],
-                    'linkedin_id':company_data['entityUrn'].split(':')[-1],
-                    'linkedin_profile_url':company_data['companyPageUrl'],
-                    'year_founded':company_data.get('yearFounded', None),
-                    'logo_url':company_data.get('logo', None),
-                    'short_description':company_data.get('tagline', None),
-                    'long_description':company_data.get('description', None),
-                    'linkedin_description':company_data.get('specialities', None),
-                    'linkedin_specialities':company_data.get('specialities', []),
-                    'linkedin_industries':company_data.get('industries', []),
-                    'linkedin_employees': company_data.get('size')      
-                }
-                
-                return company_info
+        with metrics.timer('http_request_seconds', api='linkedin', endpoint=endpoint):
+            result = function(*args, **kwargs)
     except Exception as e:
-        print(f"Error scraping LinkedIn for {company_name}: {e}")
+        metrics.inc('http_requests_total', api='linkedin', endpoint=endpoint, status='error')
+        with _linkedin_lock:
+            _consecutive_errors += 1
+            errors = _consecutive_errors
+            linkedin_limiter.set_rate(max(LINKEDIN_MIN_QPS, linkedin_limiter.rate / 2))
+            _last_rate_change = time.monotonic()
+        if errors >= LINKEDIN_MAX_CONSECUTIVE_ERRORS:
+            raise LinkedInThrottled(f"{errors} LinkedIn calls failed in a row, last: {e}") from e
+        raise
+    metrics.inc('http_requests_total', api='linkedin', endpoint=endpoint, status='ok')
+    with _linkedin_lock:
+        _consecutive_errors = 0
+        now = time.monotonic()
+        if linkedin_limiter.rate < LINKEDIN_QPS and now - _last_rate_change >= LINKEDIN_RECOVERY_SECONDS:
+            linkedin_limiter.set_rate(min(LINKEDIN_QPS, linkedin_limiter.rate * 2))
+            _last_rate_change = now
+    return result
+
+def search_companies(keywords):
+    return _call('search_companies', get_linkedin_client().search_companies, keywords=keywords)
+
+def get_company(urn_id):
+    """Returns the full company profile for a urn_id, from the on-disk cache when fresh."""
+    company_data = get_linkedin_cache().get(urn_id)
+    if company_data is not None:
+        return company_data
+    company_data = _call('get_company', get_linkedin_client().get_company, urn_id)
+    if company_data:  # Empty responses are errors or throttling, so they are not cached
+        get_linkedin_cache().set(urn_id, company_data)
+    return company_data
+
+def _name_tokens(name):
+    normalized = normalize_company_name(name) or ''
+    return [token for token in normalized.split() if token not in GENERIC_NAME_TOKENS]
+
+def candidate_score(result, company_name, domain=None, location=None):
+    """
+    Scores a search hit against the company using only the fields the search returns.
+
+    The score is the token overlap (Jaccard) of the two names. A name matching
+    the domain's first label ('ABC Roofing' for abcroofing.ca) scores 1, and a
+    location found in the hit's subline adds 0.2.
+    """
+    tokens = _name_tokens(result.get('name'))
+    wanted = set(_name_tokens(company_name))
+    if not tokens or not wanted:
+        return 0.0
+    score = len(wanted.intersection(tokens)) / len(wanted.union(tokens))
+    if domain and ''.join(tokens) == domain.split('.')[0].replace('-', ''):
+        score = 1.0
+    if location and location.casefold() in (result.get('subline') or '').casefold():
+        score += 0.2
+    return score
+
+def _logo_url(company_data):
+    image = (company_data.get('logo') or {}).get('image', {}).get('com.linkedin.common.VectorImage', {})
+    artifacts = image.get('artifacts') or []
+    if not image.get('rootUrl') or not artifacts:
         return None
+    return image['rootUrl'] + artifacts[-1]['fileIdentifyingUrlPathSegment']
+
+def _employee_range(company_data):
+    staff_range = company_data.get('staffCountRange') or {}
+    if staff_range.get('start') is not None:
+        end = staff_range.get('end')
+        return f"{staff_range['start']}-{end}" if end else f"{staff_range['start']}+"
+    staff_count = company_data.get('staffCount')
+    return str(staff_count) if staff_count is not None else None
+
+def company_info_from_profile(company_data):
+    """Maps a get_company profile onto the companies collection fields."""
+    universal_name = company_data.get('universalName')
+    founded = (company_data.get('foundedOn') or {}).get('year')
+    industries = [industry.get('localizedName') for industry in company_data.get('companyIndustries', [])
+                  if industry.get('localizedName')]
+    return {
+        'linkedin_id': (company_data.get('entityUrn') or '').split(':')[-1] or None,
+        'linkedin_url': f'https://www.linkedin.com/company/{universal_name}/' if universal_name else None,
+        'year_founded': str(founded) if founded else None,
+        'logo_url': _logo_url(company_data),
+        'short_description': company_data.get('tagline'),
+        'linkedin_description': company_data.get('description'),
+        'linkedin_specialities': company_data.get('specialities', []),
+        'linkedin_industries': industries,
+        'linkedin_employees': _employee_range(company_data),
+    }
+
+def scrape_linkedin(company_name, company_website, location=None):
+    """
+    Find the LinkedIn page of a company and return its details.
 
+    Search hits are ranked with candidate_score and only the best
+    LINKEDIN_MAX_PROFILES above LINKEDIN_MIN_NAME_SCORE have their full profile
+    fetched. A profile matches when its website has the company's registrable domain.
+
+    :return: Dict of companies collection fields, or None if no page matched.
+    :raises LinkedInLookupFailed: If the search, or a profile that might have matched, could not be fetched.
+    """
+    domain = normalize_domain(company_website)
+    if domain is None:
+        return None
+    try:
+        results = search_companies([company_name])
+    except LinkedInThrottled:
+        raise  # Stops the run, see _call
+    except Exception as e:
+        logger.warning("Error searching LinkedIn for %s: %s", company_name, e)
+        raise LinkedInLookupFailed(company_name) from e
+
+    scored = sorted(((candidate_score(result, company_name, domain, location), result) for result in results),
+                    key=lambda pair: pair[0], reverse=True)
+    candidates = [result for score, result in scored if score >= LINKEDIN_MIN_NAME_SCORE][:LINKEDIN_MAX_PROFILES]
+    metrics.inc('linkedin_candidates_total', len(results) - len(candidates), outcome='filtered')
+
+    failed = False
+    for result in candidates:
+        try:
+            company_data = get_company(result['urn_id'])
+        except LinkedInThrottled:
+            raise
+        except Exception as e:
+            logger.warning("Error fetching LinkedIn company %s: %s", result.get('urn_id'), e)
+            failed = True
+            continue
+        metrics.inc('linkedin_candidates_total', outcome='fetched')
+        if normalize_domain(company_data.get('companyPageUrl')) == domain:
+            return company_info_from_profile(company_data)
+    if failed:
+        raise LinkedInLookupFailed(company_name)
+    return None
+
+def scrape_linkedin__companies_by_keywords(keywords, industry=None, headcount=None, location=None, limit=None):
+    """
+    Search LinkedIn for companies by keywords and return the details of each hit.
+
+    The hits are mapped with company_info_from_profile, so they have the
+    companies collection's field names. The search endpoint has no industry,
+    headcount or location filters: industry and location are added to the
+    keywords, and headcount is accepted for existing callers but ignored.
+
+    :param limit: Maximum number of hits to fetch profiles for.
+    """
+    keywords = ' '.join(part for part in (keywords, industry, location) if part)
+    results = search_companies(keywords)[:limit]
+    return [company_info_from_profile(get_company(result['urn_id'])) for result in results]
+
+def _city(address):
+    # 'Street, City, Province Postal, Country' -> 'City'
+    parts = [part.strip() for part in (address or '').split(',')]
+    return parts[1] if len(parts) >= 3 else None
+
+def enrich_company(company, writer):
+    """
+    Looks up one company on LinkedIn and queues the update. Returns True if a page matched.
+
+    A company whose lookup failed is left unstamped, so the next run checks it again.
+    """
+    try:
+        linkedin_data = scrape_linkedin(company['company_name'], company.get('domain') or company.get('website'),
+                                        _city(company.get('address')))
+    except LinkedInLookupFailed:
+        metrics.inc('linkedin_lookup_failures_total')
+        return False
+    update = {
+        'company_name': company['company_name'],  # Required fields
+        'search_term_used': company.get('search_term_used', 'Unknown Search Term'),
+        'linkedin_checked_at': datetime.now(),
+    }
+    if linkedin_data:
+        update.update({key: value for key, value in linkedin_data.items() if value not in (None, '', [])})
+        logger.debug("Updated LinkedIn info for %s", company['company_name'])
+    else:
+        logger.debug("No LinkedIn data found for %s", company['company_name'])
+    # A partial update: scrape_timestamp and the other required fields are already stored
+    writer.update({'_id': company['_id']}, {'$set': update}, validate=False, label=company['company_name'])
+    return bool(linkedin_data)
+
+def _enrich_worker(cursor, cursor_lock, writer, stop, stats, stats_lock):
+    while not stop.is_set():
+        with cursor_lock:
+            company = next(cursor, None)
+        if company is None:
+            return
+        try:
+            matched = enrich_company(company, writer)
+        except LinkedInThrottled as e:
+            logger.warning("Stopping LinkedIn enrichment: %s", e)
+            stop.set()
+            return
+        with stats_lock:
+            stats['checked'] += 1
+            stats['matched'] += matched
+
+def unchecked_companies_query(max_age_days=None):
+    """Filter selecting companies with a website never checked on LinkedIn, or checked more than max_age_days ago."""
+    checked = {'$exists': False}
+    if max_age_days is not None:
+        checked = {'$not': {'$gte': datetime.now() - timedelta(days=max_age_days)}}
+    return {'website': {'$type': 'string', '$nin': ['', 'N/A']}, 'linkedin_checked_at': checked}
+
+def update_linkedin_info(workers=LINKEDIN_WORKERS, max_age_days=None, limit=None):
+    """
+    Enrich companies that have a website with their LinkedIn details.
+
+    Companies are processed on parallel workers, but every LinkedIn call shares
+    linkedin_limiter, so the request rate stays at LINKEDIN_QPS however many
+    workers run. Each checked company gets linkedin_checked_at, so re-runs skip it.
+
+    :param max_age_days: Re-check companies checked longer ago than this; None only checks new ones.
+    :param limit: Maximum number of companies to check.
+    :return: Dict with the number of companies checked and matched.
+    """
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    query = unchecked_companies_query(max_age_days)
+    projection = {'company_name': 1, 'search_term_used': 1, 'website': 1, 'domain': 1, 'address': 1}
+    cursor = companies_collection.find(query, projection, no_cursor_timeout=True).limit(limit or 0)
+
+    writer = BulkWriter(companies_collection, schema=companies_schema)
+    stats = {'checked': 0, 'matched': 0}
+    stop = threading.Event()
+    cursor_lock, stats_lock = threading.Lock(), threading.Lock()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_enrich_worker, cursor, cursor_lock, writer, stop, stats, stats_lock)
+                       for _ in range(workers)]
+            for future in futures:
+                future.result()
+    finally:
+        cursor.close()
+        writer.close()
+    logger.info("LinkedIn profile cache: %s", get_linkedin_cache().stats())
+    return stats
 
 
-def scrape_linkedin__companies_by_keywords(keywords,industry,headcount,location):
-
-    results = linkedin.search_companies(keywords,industry,headcount,location)
-        
-    companyList = []
-    # Extract relevant data for each company and save to the database
-    for result in results:
-        
-        company_data = linkedin.get_company(result['urn_id'])
-                
-                # Extract desired information
-        company_info = {
-                'name':company_data['name'],
-                'website_domain':company_data['companyPageUrl'].split('//')[-1],
-                'linkedin_id':company_data['entityUrn'].split(':')[-1],
-                'linkedin_profile_url':company_data['companyPageUrl'],
-                'year_founded':company_data.get('yearFounded', None),
-                'logo_url':company_data.get('logo', None),
-                'short_description':company_data.get('tagline', None),
-                'long_description':company_data.get('description', None),
-                'linkedin_description':company_data.get('specialities', None),
-                'linkedin_specialities':company_data.get('specialities', []),
-                'linkedin_industries':company_data.get('industries', []),
-                'linkedin_employees': company_data.get('size') 
-                }
-        companyList.append(company_info)
-    
-    return companyList
-
-def update_linkedin_info():
-    companies = Company.objects.filter(linkedin_profile_url__isnull=True, website_domain__isnull=False)
-    print(f"Number of companies to update: {companies.count()}")
-
-    for company in companies:
-        print(f"Checking LinkedIn info for {company.name}")
-        linkedin_data = scrape_linkedin(company.name, company.website_domain)
-        print(linkedin_data)
-        if linkedin_data:
-            company.linkedin_id = linkedin_data.get('linkedin_id')
-            company.linkedin_profile_url = linkedin_data.get('linkedin_profile_url')
-            company.year_founded = linkedin_data.get('year_founded')
-            company.logo_url = linkedin_data.get('logo_url')
-            company.short_description = linkedin_data.get('short_description')
-            company.long_description = linkedin_data.get('long_description')
-            company.linkedin_description = linkedin_data.get('linkedin_description')
-            company.linkedin_specialities = linkedin_data.get('linkedin_specialities')
-            company.linkedin_industries = linkedin_data.get('linkedin_industries')
-            company.linkedin_employees = linkedin_data.get('linkedin_employees')
-            company.save()
-
-            print(f"Updated LinkedIn info for {company.name}")
-        else:
-            print(f"No LinkedIn data found for {company.name}")
-
-
-
-          
 if __name__ == '__main__':
-           
-    update_linkedin_info()   
-        
\ No newline at end of file
+    from logging_config import configure_logging
+    configure_logging()
+    print(update_linkedin_info())
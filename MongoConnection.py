@@ -1,28 +1,161 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from pymongo import monitoring
 from dotenv import load_dotenv
+import metrics
+import threading
 import os
+import logging
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-def get_mongo_client():
+# Pool settings, tunable from the environment (.env)
+MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '100'))
+MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', '300000'))
+
+# Process-wide client registry, keyed by URI. Guarded by _registry_lock and
+# reset in forked children (MongoClient instances must not cross a fork).
+_clients = {}
+_registry_lock = threading.Lock()
+_registry_pid = os.getpid()
+
+connection_stats = {
+    'clients_created': 0,     # MongoClient instances (i.e. pools) built
+    'clients_reused': 0,      # get_mongo_client calls served from the registry
+    'connections_opened': 0,  # sockets opened by the driver across all pools
+    'connections_closed': 0,
+    'checkouts': 0,           # connections handed out of a pool
+}
+
+
+class _PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts driver-level connection events into connection_stats."""
+
+    def _incr(self, key):
+        with _registry_lock:
+            connection_stats[key] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._incr('connections_opened')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._incr('connections_closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        self._incr('checkouts')
+
+    def connection_checked_in(self, event):
+        pass
+
+
+class _CommandMetricsListener(monitoring.CommandListener):
+    """Records the latency of every Mongo command, labelled by command name."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.observe('mongo_command_seconds', event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        metrics.observe('mongo_command_seconds', event.duration_micros / 1e6, command=event.command_name)
+        metrics.inc('mongo_command_failures_total', command=event.command_name)
+
+
+def _reset_after_fork():
+    """Drop clients inherited from the parent; the child builds its own lazily."""
+    global _registry_lock, _registry_pid
+    _registry_lock = threading.Lock()
+    _clients.clear()
+    _registry_pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_mongo_client(uri=None):
     """
-    Establishes a connection to the MongoDB cloud database and returns the client.
+    Returns the shared MongoClient for the given URI, creating it on first use.
+
+    The client is built with connect=False, so no network traffic happens until
+    the first operation. All callers in the process share its connection pool.
+
+    :param uri: Connection string. Defaults to the MONGODB_URI environment variable.
+    :return: MongoClient, or None if the client could not be created.
     """
-    try:
-        
-        uri = os.getenv('MONGODB_URI')
-        client = MongoClient(uri, server_api=ServerApi('1'))
-        print("Connected to MongoDB successfully.")
+    uri = uri or os.getenv('MONGODB_URI')
+    if os.getpid() != _registry_pid:
+        _reset_after_fork()
+
+    with _registry_lock:
+        client = _clients.get(uri)
+        if client is not None:
+            connection_stats['clients_reused'] += 1
+            return client
+
+        try:
+            client = MongoClient(
+                uri,
+                server_api=ServerApi('1'),
+                maxPoolSize=MAX_POOL_SIZE,
+                minPoolSize=MIN_POOL_SIZE,
+                maxIdleTimeMS=MAX_IDLE_TIME_MS,
+                connect=False,
+                event_listeners=[_PoolStatsListener(), _CommandMetricsListener()],
+            )
+        except Exception as e:
+            logger.error("Error connecting to MongoDB: %s", e)
+            return None
+
+        _clients[uri] = client
+        connection_stats['clients_created'] += 1
         return client
-    except Exception as e:
-        print(f"Error connecting to MongoDB: {e}")
-        return None
+
+def set_mongo_client(client, uri=None):
+    """
+    Registers a ready-made client as the shared client for a URI.
+
+    Lets benchmarks and local runs substitute e.g. a mongomock client before
+    any scraper module asks for a collection.
+
+    :param client: A MongoClient-compatible object.
+    :param uri: The URI it stands in for. Defaults to the MONGODB_URI environment variable.
+    """
+    uri = uri or os.getenv('MONGODB_URI')
+    if os.getpid() != _registry_pid:
+        _reset_after_fork()
+    with _registry_lock:
+        _clients[uri] = client
 
 def get_mongo_collection(database_name, collection_name):
     """
-    Returns a MongoDB collection object.
-    
+    Returns a MongoDB collection object backed by the shared client.
+
     :param database_name: Name of the database.
     :param collection_name: Name of the collection.
     :return: MongoDB collection object.
@@ -34,14 +167,25 @@ def get_mongo_collection(database_name, collection_name):
         return collection
     else:
         raise ConnectionError("Could not connect to MongoDB.")
-    
+
+def get_connection_stats():
+    """Returns a copy of the registry and connection pool counters."""
+    with _registry_lock:
+        return dict(connection_stats)
+
+def close_mongo_clients():
+    """Closes every pooled client. Call once at the end of a run."""
+    with _registry_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    # Closed outside the lock: close() fires pool events whose listener takes it
+    for client in clients:
+        client.close()
+
 def test_url():
     try:
-        uri = os.getenv('MONGODB_URI')
-        # Replace with your correct connection string
-        client = MongoClient(uri)
+        client = get_mongo_client()
         client.admin.command('ping')  # Simple command to check connection
         print("Connected to MongoDB successfully.")
     except Exception as e:
         print(f"Failed to connect: {e}")
-
@@ -0,0 +1,563 @@
+"""
+Outreach campaigns: render a template for verified contacts and send it through a Mongo-backed queue.
+
+Usage:
+    python Outreach.py enqueue templates/intro.txt --campaign NAME [--audience people|companies] [--statuses valid,catch_all] [--limit N]
+    python Outreach.py send [--workers N] [--max-messages N]     Claim and send queued messages until none are left
+    python Outreach.py status [--campaign NAME]                   Count messages by status
+    python Outreach.py retry [--campaign NAME]                    Put dead messages back to pending
+
+A template is a text file whose first line is 'Subject: ...', followed by a
+blank line and the body; $name, $first_name, $company_name, $website and the
+other contact fields are substituted. Contacts missing a field the template
+uses are skipped.
+
+Each message is stored once per campaign and recipient: its _id is an
+idempotency key derived from both, so enqueueing a campaign twice queues
+nothing new. Workers claim messages like SearchJobs claims jobs, with a lease,
+and send them over a small pool of persistent SMTP connections. Each mail
+provider (taken from the MX host found by EmailVerifier) has its own rate
+limit. Temporary failures are retried with backoff; rejected recipients are
+suppressed so no campaign writes to them again.
+"""
+from MongoConnection import get_mongo_collection
+from LeadExport import iter_chunks
+from rate_limiting import TokenBucket
+from normalizers import normalize_domain
+from logging_config import configure_logging
+from pymongo import ReturnDocument, UpdateOne, ASCENDING
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import formatdate
+from string import Template
+from dotenv import load_dotenv
+import argparse
+import hashlib
+import smtplib
+import threading
+import socket
+import queue
+import metrics
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+OUTREACH_SMTP_HOST = os.getenv('OUTREACH_SMTP_HOST', 'localhost')
+OUTREACH_SMTP_PORT = int(os.getenv('OUTREACH_SMTP_PORT', '587'))
+OUTREACH_SMTP_USERNAME = os.getenv('OUTREACH_SMTP_USERNAME')
+OUTREACH_SMTP_PASSWORD = os.getenv('OUTREACH_SMTP_PASSWORD')
+OUTREACH_SMTP_STARTTLS = os.getenv('OUTREACH_SMTP_STARTTLS', '1') != '0'
+OUTREACH_FROM = os.getenv('OUTREACH_FROM', f'outreach@{socket.getfqdn()}')
+OUTREACH_UNSUBSCRIBE = os.getenv('OUTREACH_UNSUBSCRIBE')  # mailto: or https: link for List-Unsubscribe
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '15'))
+
+OUTREACH_WORKERS = int(os.getenv('OUTREACH_WORKERS', '8'))  # Also the number of pooled SMTP connections
+OUTREACH_MESSAGES_PER_CONNECTION = 100  # Relays often cap messages per session, so connections are renewed
+OUTREACH_IDLE_CHECK_SECONDS = 30  # A connection idle longer than this is checked with NOOP before use
+
+# Messages per second by provider, e.g. 'google.com=1,outlook.com=1,default=5'
+OUTREACH_PROVIDER_RATES = dict(
+    (item.split('=')[0].strip(), float(item.split('=')[1]))
+    for item in os.getenv('OUTREACH_PROVIDER_RATES', 'google.com=1,outlook.com=1,yahoodns.net=0.5,default=5').split(',')
+    if '=' in item
+)
+OUTREACH_MIN_RATE = 0.05  # Floor the provider rate is halved down to when it answers 421
+
+MESSAGE_LEASE_SECONDS = int(os.getenv('OUTREACH_LEASE_SECONDS', '300'))
+MAX_ATTEMPTS = int(os.getenv('OUTREACH_MAX_ATTEMPTS', '4'))
+RETRY_BACKOFF_SECONDS = 300  # Doubled after every failed attempt
+
+CONTACT_FIELDS = {
+    'people': ['first_name', 'last_name', 'position', 'email', 'company_name'],
+    'companies': ['company_name', 'email', 'website', 'address', 'phone_number'],
+}
+
+
+class PermanentFailure(Exception):
+    """Raised when the relay rejects a message for good; it is not retried."""
+
+
+class LeaseLost(Exception):
+    """Raised before sending a message whose lease another worker has taken over."""
+
+
+def get_messages_collection():
+    messages_collection = get_mongo_collection('TestingDatabase', 'outreach_messages')
+    messages_collection.create_index([('status', ASCENDING), ('available_at', ASCENDING)], name='claim_lookup')
+    messages_collection.create_index([('campaign', ASCENDING), ('status', ASCENDING)], name='campaign_status')
+    return messages_collection
+
+
+def get_suppressions_collection():
+    """Addresses that must never be written to again (_id is the address)."""
+    return get_mongo_collection('TestingDatabase', 'outreach_suppressions')
+
+
+def idempotency_key(campaign, email):
+    return hashlib.sha256(f'{campaign}\n{email.lower()}'.encode('utf-8')).hexdigest()[:32]
+
+
+def read_template(path):
+    """Reads a template file into (subject Template, body Template)."""
+    with open(path, encoding='utf-8') as f:
+        header, _, body = f.read().partition('\n\n')
+    if not header.lower().startswith('subject:'):
+        raise ValueError(f"{path} must start with a 'Subject:' line followed by a blank line.")
+    return Template(header[len('subject:'):].strip()), Template(body)
+
+
+def render(template, contact):
+    """
+    Renders (subject, body) for a contact.
+
+    :return: (subject, body), or None if the contact lacks a field the template uses.
+    """
+    subject, body = template
+    context = {key: str(value) for key, value in contact.items() if value not in (None, '')}
+    name = context.get('first_name') or context.get('company_name')
+    if name:
+        context.setdefault('name', name)
+    try:
+        return subject.substitute(context), body.substitute(context)
+    except KeyError:
+        return None
+
+
+def provider_for(email, mx_host=None):
+    """Rate limit group of an address: the registrable domain of its mail server, else of the address."""
+    return normalize_domain(mx_host) or normalize_domain(email.rpartition('@')[2]) or 'default'
+
+
+def enqueue(template_path, campaign, audience='people', statuses=('valid',), query=None, limit=None):
+    """
+    Renders the template for every eligible contact and queues the messages.
+
+    Contacts are eligible when their address has an email_verifications status
+    in `statuses` (None accepts unverified addresses too) and is not suppressed.
+
+    :return: Dict counting queued, already queued, unverified, suppressed and incomplete contacts.
+    """
+    template = read_template(template_path)
+    messages_collection = get_messages_collection()
+    verifications_collection = get_mongo_collection('TestingDatabase', 'email_verifications')
+    suppressions_collection = get_suppressions_collection()
+    contacts = get_mongo_collection('TestingDatabase', audience)
+    stats = {'queued': 0, 'already_queued': 0, 'unverified': 0, 'suppressed': 0, 'incomplete': 0}
+    now = datetime.now(timezone.utc)
+
+    base_query = {'email': {'$type': 'string', '$ne': ''}, **(query or {})}
+    for chunk in iter_chunks(contacts, base_query, CONTACT_FIELDS[audience], limit=limit):
+        emails = list({contact['email'].lower() for contact in chunk})
+        # One lookup per chunk for verification results and suppressions
+        verifications = {document['_id']: document for document in verifications_collection.find(
+            {'_id': {'$in': emails}}, {'status': 1, 'mx_host': 1})}
+        suppressed = {document['_id'] for document in suppressions_collection.find(
+            {'_id': {'$in': emails}}, {'_id': 1})}
+
+        operations = {}
+        for contact in chunk:
+            email = contact['email'].lower()
+            verification = verifications.get(email, {})
+            if email in suppressed:
+                stats['suppressed'] += 1
+                continue
+            if statuses is not None and verification.get('status') not in statuses:
+                stats['unverified'] += 1
+                continue
+            rendered = render(template, contact)
+            if rendered is None:
+                stats['incomplete'] += 1
+                continue
+            key = idempotency_key(campaign, email)
+            operations[key] = {
+                '_id': key,
+                'campaign': campaign,
+                'to': email,
+                'subject': rendered[0],
+                'body': rendered[1],
+                'provider': provider_for(email, verification.get('mx_host')),
+                'status': 'pending',
+                'attempts': 0,
+                'available_at': now,
+                'created_at': now,
+            }
+        if not operations:
+            continue
+        # $setOnInsert leaves messages queued by an earlier run untouched, whatever their status
+        result = messages_collection.bulk_write(
+            [UpdateOne({'_id': key}, {'$setOnInsert': document}, upsert=True) for key, document in operations.items()],
+            ordered=False)
+        stats['queued'] += result.upserted_count
+        stats['already_queued'] += len(operations) - result.upserted_count
+    metrics.inc('outreach_queued_total', stats['queued'], campaign=campaign)
+    return stats
+
+
+class SmtpPool:
+    """
+    Fixed-size pool of persistent SMTP connections to the outgoing relay.
+
+    Connections are opened on demand, reused across messages, renewed after
+    OUTREACH_MESSAGES_PER_CONNECTION messages, and dropped when the server
+    disconnects. Safe to share between threads.
+    """
+
+    def __init__(self, size=OUTREACH_WORKERS, host=OUTREACH_SMTP_HOST, port=OUTREACH_SMTP_PORT,
+                 username=OUTREACH_SMTP_USERNAME, password=OUTREACH_SMTP_PASSWORD, starttls=OUTREACH_SMTP_STARTTLS):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.stats = {'connections_opened': 0, 'messages': 0}
+        self._idle = queue.LifoQueue()  # Most recently used first, so spare connections can time out
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        connection.ehlo()
+        if self.starttls and connection.has_extn('starttls'):
+            connection.starttls()
+            connection.ehlo()
+        if self.username:
+            connection.login(self.username, self.password)
+        with self._lock:
+            self.stats['connections_opened'] += 1
+        metrics.inc('smtp_connections_opened_total')
+        return {'smtp': connection, 'sent': 0, 'used_at': time.monotonic()}
+
+    def _checkout(self):
+        self._slots.acquire()
+        try:
+            entry = self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+        if time.monotonic() - entry['used_at'] > OUTREACH_IDLE_CHECK_SECONDS:
+            try:
+                if entry['smtp'].noop()[0] == 250:
+                    return entry
+            except smtplib.SMTPException:
+                pass
+            self._discard(entry)
+            return self._connect()
+        return entry
+
+    def _discard(self, entry):
+        try:
+            entry['smtp'].quit()
+        except (smtplib.SMTPException, OSError):
+            entry['smtp'].close()
+
+    def send(self, message):
+        """
+        Sends one message, reconnecting once if a pooled connection turns out to be dead.
+
+        Raises the smtplib exceptions of the final attempt.
+        """
+        for attempt in range(2):
+            try:
+                entry = self._checkout()
+            except BaseException:
+                self._slots.release()
+                raise
+            try:
+                entry['smtp'].send_message(message)
+            except smtplib.SMTPServerDisconnected:
+                entry['smtp'].close()
+                self._slots.release()
+                if attempt:
+                    raise
+                continue
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+                self._checkin(entry)  # A rejected message leaves the session usable, see _checkin
+                raise
+            except BaseException:
+                self._discard(entry)
+                self._slots.release()
+                raise
+            entry['sent'] += 1
+            with self._lock:
+                self.stats['messages'] += 1
+            self._checkin(entry)
+            return
+
+    def _checkin(self, entry):
+        try:
+            if entry['sent'] >= OUTREACH_MESSAGES_PER_CONNECTION:
+                self._discard(entry)
+            else:
+                try:
+                    entry['smtp'].rset()
+                except smtplib.SMTPException:
+                    self._discard(entry)
+                    return
+                entry['used_at'] = time.monotonic()
+                self._idle.put(entry)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class ProviderLimits:
+    """One TokenBucket per mail provider, created on first use from OUTREACH_PROVIDER_RATES."""
+
+    def __init__(self, rates=None):
+        self.rates = rates or OUTREACH_PROVIDER_RATES
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, provider):
+        with self._lock:
+            if provider not in self._buckets:
+                rate = self.rates.get(provider, self.rates.get('default', 5.0))
+                self._buckets[provider] = TokenBucket(rate, capacity=1)
+            return self._buckets[provider]
+
+    def slow_down(self, provider):
+        """Halves a provider's rate after it answered 421 (too many messages)."""
+        bucket = self.bucket(provider)
+        bucket.set_rate(max(OUTREACH_MIN_RATE, bucket.rate / 2))
+
+
+def claim_message(messages_collection, worker_id, lease_seconds=MESSAGE_LEASE_SECONDS):
+    """
+    Atomically claims the oldest available message: pending, due for retry, or with an expired lease.
+
+    A message whose lease expired after its last allowed attempt is marked
+    dead instead, so a message that keeps stalling its worker is not resent forever.
+
+    :return: The claimed message document, or None if no message is available.
+    """
+    now = datetime.now(timezone.utc)
+    messages_collection.update_many(
+        {'status': 'sending', 'lease_expires_at': {'$lt': now}, 'attempts': {'$gte': MAX_ATTEMPTS}},
+        {'$set': {'status': 'dead', 'finished_at': now, 'error': 'Lease expired on the last attempt'},
+         '$unset': {'lease_expires_at': ''}}
+    )
+    return messages_collection.find_one_and_update(
+        {'$or': [
+            {'status': {'$in': ['pending', 'failed']}, 'available_at': {'$lte': now}},
+            {'status': 'sending', 'lease_expires_at': {'$lt': now}, 'attempts': {'$lt': MAX_ATTEMPTS}},
+        ]},
+        {
+            '$set': {'status': 'sending', 'worker': worker_id, 'started_at': now,
+                     'lease_expires_at': now + timedelta(seconds=lease_seconds)},
+            '$inc': {'attempts': 1},
+        },
+        sort=[('available_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _owned(message, worker_id):
+    # Only the worker holding the lease may update the message
+    return {'_id': message['_id'], 'status': 'sending', 'worker': worker_id}
+
+
+def renew_message_lease(messages_collection, message, worker_id, lease_seconds=MESSAGE_LEASE_SECONDS):
+    """Extends the lease. Returns False if the message was taken over by another worker."""
+    expires = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    result = messages_collection.update_one(_owned(message, worker_id), {'$set': {'lease_expires_at': expires}})
+    return result.matched_count == 1
+
+
+def complete_message(messages_collection, message, worker_id):
+    messages_collection.update_one(_owned(message, worker_id), {
+        '$set': {'status': 'sent', 'sent_at': datetime.now(timezone.utc)},
+        '$unset': {'lease_expires_at': '', 'error': ''},
+    })
+
+
+def fail_message(messages_collection, message, worker_id, error, permanent=False):
+    """
+    Marks a message rejected when the failure is permanent, otherwise schedules
+    a retry with exponential backoff, or marks it dead after MAX_ATTEMPTS.
+    """
+    now = datetime.now(timezone.utc)
+    if permanent:
+        update = {'status': 'rejected', 'finished_at': now, 'error': error}
+    elif message['attempts'] >= MAX_ATTEMPTS:
+        update = {'status': 'dead', 'finished_at': now, 'error': error}
+    else:
+        delay = RETRY_BACKOFF_SECONDS * 2 ** (message['attempts'] - 1)
+        update = {'status': 'failed', 'available_at': now + timedelta(seconds=delay), 'error': error}
+    messages_collection.update_one(_owned(message, worker_id), {'$set': update, '$unset': {'lease_expires_at': ''}})
+
+
+def suppress(email, reason):
+    get_suppressions_collection().update_one(
+        {'_id': email}, {'$setOnInsert': {'reason': reason, 'created_at': datetime.now(timezone.utc)}}, upsert=True)
+
+
+def build_message(message):
+    email = EmailMessage()
+    email['From'] = OUTREACH_FROM
+    email['To'] = message['to']
+    email['Subject'] = message['subject']
+    email['Date'] = formatdate(localtime=True)
+    # Deterministic, so a resend after a lost acknowledgement can be recognised as the same message
+    email['Message-ID'] = f"<{message['_id']}@{OUTREACH_FROM.rpartition('@')[2]}>"
+    if OUTREACH_UNSUBSCRIBE:
+        email['List-Unsubscribe'] = f'<{OUTREACH_UNSUBSCRIBE}>'
+    email.set_content(message['body'])
+    return email
+
+
+def send_message(pool, limits, message, renew_lease=None):
+    """
+    Sends one queued message under its provider's rate limit.
+
+    Raises PermanentFailure for rejections that retrying will not fix, and
+    smtplib or socket errors for temporary ones.
+
+    :param renew_lease: Optional callable run once the provider's token is in
+        hand; it returns False if the lease was lost while waiting for the token,
+        in which case LeaseLost is raised instead of sending.
+    """
+    limits.bucket(message['provider']).acquire()
+    if renew_lease is not None and not renew_lease():
+        raise LeaseLost(f"Lease on {message['_id']} expired while waiting for the {message['provider']} rate limit")
+    try:
+        with metrics.timer('smtp_send_seconds'):
+            pool.send(build_message(message))
+    except smtplib.SMTPRecipientsRefused as e:
+        code, reply = next(iter(e.recipients.values()))
+        if code >= 500:
+            suppress(message['to'], f'{code} {reply!r}')
+            raise PermanentFailure(f'{code} {reply!r}') from e
+        if code == 421:
+            limits.slow_down(message['provider'])
+        raise
+    except (smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+        if e.smtp_code >= 500:
+            raise PermanentFailure(f'{e.smtp_code} {e.smtp_error!r}') from e
+        if e.smtp_code == 421:
+            limits.slow_down(message['provider'])
+        raise
+
+
+def _send_worker(messages_collection, pool, limits, worker_id, max_messages, counter, stats, stats_lock):
+    while True:
+        with stats_lock:
+            if max_messages is not None and counter['claimed'] >= max_messages:
+                return
+            counter['claimed'] += 1
+        message = claim_message(messages_collection, worker_id)
+        if message is None:
+            return
+        try:
+            send_message(pool, limits, message,
+                         renew_lease=lambda: renew_message_lease(messages_collection, message, worker_id))
+            complete_message(messages_collection, message, worker_id)
+            outcome = 'sent'
+        except LeaseLost as e:
+            # Another worker owns the message now and sends it
+            logger.warning("[%s] %s", worker_id, e)
+            outcome = 'lost'
+        except PermanentFailure as e:
+            logger.info("[%s] Not sending to %s: %s", worker_id, message['to'], e)
+            fail_message(messages_collection, message, worker_id, str(e), permanent=True)
+            outcome = 'rejected'
+        except (smtplib.SMTPException, OSError) as e:
+            logger.warning("[%s] Failed to send to %s: %s", worker_id, message['to'], e)
+            fail_message(messages_collection, message, worker_id, str(e))
+            outcome = 'failed'
+        metrics.inc('outreach_messages_total', outcome=outcome, provider=message['provider'])
+        with stats_lock:
+            stats[outcome] += 1
+
+
+def send(workers=OUTREACH_WORKERS, max_messages=None, pool=None):
+    """
+    Claims and sends queued messages on `workers` threads until none are available.
+
+    :param max_messages: Stop after claiming this many messages.
+    :param pool: SmtpPool to send through; one with a connection per worker by default.
+    :return: Dict counting sent, rejected and failed messages, messages whose lease
+        another worker took over, and SMTP connections opened.
+    """
+    messages_collection = get_messages_collection()
+    pool = pool or SmtpPool(size=workers)
+    limits = ProviderLimits()
+    host = f'{socket.gethostname()}:{os.getpid()}'
+    stats = {'sent': 0, 'rejected': 0, 'failed': 0, 'lost': 0}
+    counter = {'claimed': 0}
+    stats_lock = threading.Lock()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_send_worker, messages_collection, pool, limits, f'{host}:{i}',
+                                       max_messages, counter, stats, stats_lock) for i in range(workers)]
+            for future in futures:
+                future.result()
+    finally:
+        pool.close()
+    stats['connections_opened'] = pool.stats['connections_opened']
+    return stats
+
+
+def message_status(campaign=None):
+    """Returns message counts by status."""
+    match = {'campaign': campaign} if campaign else {}
+    pipeline = [{'$match': match}, {'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
+    return {row['_id']: row['count'] for row in get_messages_collection().aggregate(pipeline)}
+
+
+def retry_dead_messages(campaign=None):
+    """Re-queues messages that ran out of attempts; rejected ones stay rejected."""
+    query = {'status': 'dead', **({'campaign': campaign} if campaign else {})}
+    result = get_messages_collection().update_many(query, {
+        '$set': {'status': 'pending', 'attempts': 0, 'available_at': datetime.now(timezone.utc)},
+        '$unset': {'error': ''},
+    })
+    return result.modified_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    queue_parser = commands.add_parser('enqueue', help='Render a template for verified contacts and queue it')
+    queue_parser.add_argument('template')
+    queue_parser.add_argument('--campaign', required=True)
+    queue_parser.add_argument('--audience', choices=sorted(CONTACT_FIELDS), default='people')
+    queue_parser.add_argument('--statuses', default='valid',
+                              help="Comma-separated verification statuses to accept, or 'any' to include unverified addresses")
+    queue_parser.add_argument('--limit', type=int, default=None)
+
+    send_parser = commands.add_parser('send', help='Send queued messages')
+    send_parser.add_argument('--workers', type=int, default=OUTREACH_WORKERS, help='Sending threads and pooled SMTP connections')
+    send_parser.add_argument('--max-messages', type=int, default=None)
+
+    status = commands.add_parser('status', help='Count messages by status')
+    status.add_argument('--campaign')
+
+    retry = commands.add_parser('retry', help='Put dead messages back to pending')
+    retry.add_argument('--campaign')
+
+    args = parser.parse_args()
+    configure_logging()
+    if args.command == 'enqueue':
+        statuses = None if args.statuses == 'any' else tuple(args.statuses.split(','))
+        print(enqueue(args.template, args.campaign, args.audience, statuses, limit=args.limit))
+    elif args.command == 'send':
+        print(send(args.workers, args.max_messages))
+    elif args.command == 'status':
+        print(message_status(args.campaign))
+    elif args.command == 'retry':
+        print(f"Re-queued {retry_dead_messages(args.campaign)} dead messages.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+from GoogleMapsScraper import collect_and_save_data
+from WebsiteScraper import fetch_website, process_page, save_failed_fetch
+from HunterScraper import claim_company_to_hunt, hunt_claimed_company, open_writers
+from HunterClient import HunterQuotaExceeded
+from MongoConnection import get_mongo_collection
+from bulk_writer import BulkWriter
+from validators import companies_schema
+import threading
+import socket
+import queue
+import time
+import os
+import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stage sizes for the streaming pipeline
+WEBSITE_WORKERS = int(os.getenv('PIPELINE_WEBSITE_WORKERS', '32'))
+HUNTER_WORKERS = int(os.getenv('PIPELINE_HUNTER_WORKERS', '4'))
+QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '200'))
+
+# Discovery flushes inserts in small batches so companies reach the next stages quickly
+STREAM_BATCH_SIZE = 20
+STREAM_FLUSH_INTERVAL = 2.0
+
+
+class Stage:
+    """
+    A pool of worker threads consuming a bounded queue.
+
+    put() blocks while the queue is full, which pushes back on the producer.
+    If the handler raises one of `stop_on`, the stage stops processing and
+    drains the rest of its queue so producers never block on it.
+    """
+
+    def __init__(self, name, handler, workers, queue_size=QUEUE_SIZE, stop_on=()):
+        self.name = name
+        self.handler = handler
+        self.stop_on = stop_on
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = {'processed': 0, 'failed': 0, 'dropped': 0, 'busy_seconds': 0.0}
+        self._stopped = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'{name}-{i}', daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def close(self):
+        """Signals the end of input and waits for the workers to finish."""
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self._stopped.is_set():
+                self._count('dropped')
+                continue
+            start = time.monotonic()
+            try:
+                self.handler(item)
+                self._count('processed')
+                metrics.inc('stage_items_total', stage=self.name, outcome='ok')
+            except self.stop_on as e:
+                logger.warning("Stopping %s stage: %s", self.name, e)
+                self._stopped.set()
+            except Exception as e:
+                logger.warning("%s stage failed on %s: %s", self.name, item.get('company_name', item.get('_id')), e)
+                self._count('failed')
+                metrics.inc('stage_items_total', stage=self.name, outcome='error')
+            elapsed = time.monotonic() - start
+            self._count('busy_seconds', elapsed)
+            metrics.observe('stage_item_seconds', elapsed, stage=self.name)
+
+
+def run_pipeline(industry_location_sets, website_workers=WEBSITE_WORKERS,
+                 hunter_workers=HUNTER_WORKERS, queue_size=QUEUE_SIZE, limit=None):
+    """
+    Discover, scrape and hunt companies as a streaming producer/consumer pipeline.
+
+    Google Maps discovery runs on the calling thread. Each newly inserted company
+    goes into the website and Hunter stages' bounded queues as soon as its
+    insert batch is written, so all three stages overlap and a run takes about
+    as long as its slowest stage.
+
+    :param limit: Stop discovery once this many new companies were found.
+    :return: Dict of per-stage stats and the total elapsed seconds.
+    """
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    website_writer = BulkWriter(companies_collection, schema=companies_schema)
+    hunter_companies_writer, hunter_people_writer = open_writers()
+    run_id = f'{socket.gethostname()}:{os.getpid()}:pipeline'
+
+    def scrape_company_website(company):
+        page = fetch_website(company.get('website', 'N/A'))
+        if page is None:
+            save_failed_fetch(website_writer, company)
+        else:
+            process_page(website_writer, company, page)
+
+    def hunt_company(company):
+        # Claim it like the batch Hunter stage does, so overlapping runs never hunt it twice
+        claimed = claim_company_to_hunt(companies_collection, run_id, company_id=company['_id'])
+        if claimed is not None:
+            hunt_claimed_company(claimed, companies_collection, hunter_companies_writer, hunter_people_writer)
+
+    website_stage = Stage('website', scrape_company_website, website_workers, queue_size).start()
+    hunter_stage = Stage('hunter', hunt_company, hunter_workers, queue_size,
+                         stop_on=(HunterQuotaExceeded,)).start()
+
+    def fan_out(companies):
+        for company in companies:
+            website_stage.put(company)
+            hunter_stage.put(company)
+
+    start = time.monotonic()
+    discovery_stats = {'queries': 0, 'inserted': 0}
+    try:
+        for industry, location in industry_location_sets:
+            remaining = None if limit is None else limit - discovery_stats['inserted']
+            if remaining is not None and remaining <= 0:
+                break
+            logger.info("Running GoogleMapsScraper for %s in %s...", industry, location)
+            writer_stats = collect_and_save_data(industry, location, on_inserted=fan_out, limit=remaining,
+                                                 batch_size=STREAM_BATCH_SIZE,
+                                                 flush_interval=STREAM_FLUSH_INTERVAL)
+            discovery_stats['queries'] += 1
+            discovery_stats['inserted'] += writer_stats['inserted']
+    finally:
+        website_stage.close()
+        hunter_stage.close()
+        website_writer.close()
+        hunter_companies_writer.close()
+        hunter_people_writer.close()
+
+    return {
+        'discovery': discovery_stats,
+        'website': website_stage.stats,
+        'hunter': hunter_stage.stats,
+        'elapsed_seconds': round(time.monotonic() - start, 1),
+    }
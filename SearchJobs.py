@@ -0,0 +1,255 @@
+"""
+Search campaigns as a Mongo-backed job queue that any number of workers can share.
+
+Usage:
+    python SearchJobs.py load jobs.json [--campaign NAME]   Add (industry, location) jobs from a JSON/JSONL/CSV file
+    python SearchJobs.py work [--processes N] [--max-jobs N] Claim and run jobs until none are left
+    python SearchJobs.py status [--campaign NAME]           Count jobs by status
+    python SearchJobs.py retry [--campaign NAME]            Put dead jobs back to pending
+
+Workers claim a job with an atomic find_one_and_update that sets a lease.
+While a job runs, a heartbeat extends the lease. A job whose worker crashed
+becomes claimable again once the lease expires. Failed jobs, and jobs whose
+lease expired, are retried up to MAX_ATTEMPTS, then marked dead.
+
+The project's Places quota (PLACES_QPS) is shared: on every claim and
+heartbeat a worker sets its rate to PLACES_QPS divided by the number of jobs
+currently holding a lease, on any host.
+"""
+from MongoConnection import get_mongo_collection
+from logging_config import configure_logging
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta, timezone
+from multiprocessing import Process
+import argparse
+import threading
+import socket
+import json
+import logging
+import csv
+import os
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+JOB_HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 3
+MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+RETRY_BACKOFF_SECONDS = 60  # Doubled after every failed attempt
+
+
+def get_jobs_collection():
+    jobs_collection = get_mongo_collection('TestingDatabase', 'search_jobs')
+    jobs_collection.create_index([('campaign', ASCENDING), ('industry', ASCENDING), ('location', ASCENDING)],
+                                 unique=True, name='campaign_query_unique')
+    jobs_collection.create_index([('status', ASCENDING), ('available_at', ASCENDING)], name='claim_lookup')
+    return jobs_collection
+
+
+def read_job_file(path):
+    """Reads (industry, location) pairs from a JSON list, JSON lines or CSV file with those columns."""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        elif path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = json.load(f)
+    return [(row['industry'].strip(), row['location'].strip()) for row in rows]
+
+
+def add_jobs(pairs, campaign='default'):
+    """
+    Adds search jobs; pairs already in the campaign are left untouched.
+
+    :return: Number of new jobs.
+    """
+    jobs_collection = get_jobs_collection()
+    now = datetime.now(timezone.utc)
+    added = 0
+    for industry, location in pairs:
+        try:
+            jobs_collection.insert_one({
+                'campaign': campaign,
+                'industry': industry,
+                'location': location,
+                'status': 'pending',
+                'attempts': 0,
+                'available_at': now,
+                'created_at': now,
+            })
+            added += 1
+        except DuplicateKeyError:
+            pass
+    return added
+
+
+def claim_job(jobs_collection, worker_id, lease_seconds=JOB_LEASE_SECONDS):
+    """
+    Atomically claims the oldest available job: pending, due for retry, or with an expired lease.
+
+    A job whose lease expired after its last allowed attempt is marked dead
+    instead, so a job that keeps crashing its worker is not retried forever.
+
+    :return: The claimed job document, or None if no job is available.
+    """
+    now = datetime.now(timezone.utc)
+    jobs_collection.update_many(
+        {'status': 'running', 'lease_expires_at': {'$lt': now}, 'attempts': {'$gte': MAX_ATTEMPTS}},
+        {'$set': {'status': 'dead', 'finished_at': now, 'error': 'Lease expired on the last attempt'},
+         '$unset': {'lease_expires_at': ''}}
+    )
+    return jobs_collection.find_one_and_update(
+        {'$or': [
+            {'status': {'$in': ['pending', 'failed']}, 'available_at': {'$lte': now}},
+            {'status': 'running', 'lease_expires_at': {'$lt': now}, 'attempts': {'$lt': MAX_ATTEMPTS}},
+        ]},
+        {
+            '$set': {'status': 'running', 'worker': worker_id, 'started_at': now,
+                     'lease_expires_at': now + timedelta(seconds=lease_seconds)},
+            '$inc': {'attempts': 1},
+        },
+        sort=[('available_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _owned(job, worker_id):
+    # Only the worker holding the lease may update the job
+    return {'_id': job['_id'], 'status': 'running', 'worker': worker_id}
+
+
+def renew_lease(jobs_collection, job, worker_id, lease_seconds=JOB_LEASE_SECONDS):
+    """Extends the lease. Returns False if the job was taken over by another worker."""
+    expires = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    result = jobs_collection.update_one(_owned(job, worker_id), {'$set': {'lease_expires_at': expires}})
+    return result.matched_count == 1
+
+
+def complete_job(jobs_collection, job, worker_id, result=None):
+    jobs_collection.update_one(_owned(job, worker_id), {
+        '$set': {'status': 'done', 'finished_at': datetime.now(timezone.utc), 'result': result},
+        '$unset': {'lease_expires_at': '', 'error': ''},
+    })
+
+
+def fail_job(jobs_collection, job, worker_id, error):
+    """Schedules a retry with exponential backoff, or marks the job dead after MAX_ATTEMPTS."""
+    now = datetime.now(timezone.utc)
+    if job['attempts'] >= MAX_ATTEMPTS:
+        update = {'status': 'dead', 'finished_at': now, 'error': error}
+    else:
+        delay = RETRY_BACKOFF_SECONDS * 2 ** (job['attempts'] - 1)
+        update = {'status': 'failed', 'available_at': now + timedelta(seconds=delay), 'error': error}
+    jobs_collection.update_one(_owned(job, worker_id), {'$set': update, '$unset': {'lease_expires_at': ''}})
+
+
+def share_places_quota(jobs_collection):
+    """Sets this process's Places rate to an equal share of PLACES_QPS among the running jobs."""
+    from GoogleMapsScraper import places_limiter, PLACES_QPS
+
+    running = jobs_collection.count_documents({'status': 'running',
+                                               'lease_expires_at': {'$gt': datetime.now(timezone.utc)}})
+    places_limiter.set_rate(PLACES_QPS / max(running, 1))
+
+
+def _heartbeat(jobs_collection, job, worker_id, done):
+    while not done.wait(JOB_HEARTBEAT_SECONDS):
+        if not renew_lease(jobs_collection, job, worker_id):
+            logger.warning("Lost the lease on %s in %s.", job['industry'], job['location'])
+            return
+        share_places_quota(jobs_collection)
+
+
+def work(max_jobs=None, worker_id=None):
+    """
+    Claims and runs search jobs until none are available or max_jobs have run.
+
+    :return: Number of jobs this worker ran.
+    """
+    # Imported here so loading or inspecting jobs does not need Maps credentials
+    from GoogleMapsScraper import collect_and_save_data, reset_dedupe_index
+
+    jobs_collection = get_jobs_collection()
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    ran = 0
+    while max_jobs is None or ran < max_jobs:
+        job = claim_job(jobs_collection, worker_id)
+        if job is None:
+            break
+        logger.info("[%s] Running %s in %s (attempt %d)", worker_id, job['industry'], job['location'], job['attempts'])
+        share_places_quota(jobs_collection)
+        # Other workers stored companies since the last job; skip their places too
+        reset_dedupe_index()
+
+        done = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(jobs_collection, job, worker_id, done), daemon=True)
+        heartbeat.start()
+        try:
+            stats = collect_and_save_data(job['industry'], job['location'])
+            complete_job(jobs_collection, job, worker_id, stats)
+        except Exception as e:
+            logger.warning("[%s] Failed %s in %s: %s", worker_id, job['industry'], job['location'], e)
+            fail_job(jobs_collection, job, worker_id, str(e))
+        finally:
+            done.set()
+            heartbeat.join()
+        ran += 1
+    return ran
+
+
+def job_status(campaign=None):
+    """Returns job counts by status."""
+    match = {'campaign': campaign} if campaign else {}
+    pipeline = [{'$match': match}, {'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
+    return {row['_id']: row['count'] for row in get_jobs_collection().aggregate(pipeline)}
+
+
+def retry_dead_jobs(campaign=None):
+    query = {'status': 'dead', **({'campaign': campaign} if campaign else {})}
+    result = get_jobs_collection().update_many(query, {
+        '$set': {'status': 'pending', 'attempts': 0, 'available_at': datetime.now(timezone.utc)},
+        '$unset': {'error': ''},
+    })
+    return result.modified_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help='Add jobs from a file')
+    load.add_argument('path')
+    load.add_argument('--campaign', default='default')
+
+    run = commands.add_parser('work', help='Claim and run jobs')
+    run.add_argument('--processes', type=int, default=1, help='Local worker processes to start')
+    run.add_argument('--max-jobs', type=int, default=None, help='Stop each worker after this many jobs')
+
+    status = commands.add_parser('status', help='Count jobs by status')
+    status.add_argument('--campaign')
+
+    retry = commands.add_parser('retry', help='Put dead jobs back to pending')
+    retry.add_argument('--campaign')
+
+    args = parser.parse_args()
+    configure_logging()
+    if args.command == 'load':
+        print(f"Added {add_jobs(read_job_file(args.path), args.campaign)} jobs to campaign '{args.campaign}'.")
+    elif args.command == 'work':
+        if args.processes == 1:
+            print(f"Ran {work(args.max_jobs)} jobs.")
+        else:
+            processes = [Process(target=work, args=(args.max_jobs,)) for _ in range(args.processes)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+    elif args.command == 'status':
+        print(job_status(args.campaign))
+    elif args.command == 'retry':
+        print(f"Re-queued {retry_dead_jobs(args.campaign)} dead jobs.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,103 +1,295 @@
 import requests
-from bs4 import BeautifulSoup
 import re
-from validate_email_address import validate_email
 from MongoConnection import get_mongo_collection
-from validators import validate_data, companies_schema
-from datetime import datetime
+from validators import companies_schema
+from bulk_writer import BulkWriter
+from email_extraction import extract_emails, EMAIL_PATTERN, VALID_EMAIL_PATTERN
+from datetime import datetime, timedelta
+from checkpoints import PartitionedScan
+from crawl_frontier import CrawlFrontier, CRAWL_MAX_PAGES, CRAWL_MAX_BYTES
+import http_transport
+import metrics
+import hashlib
+import time
+import os
 import sys
+import logging
+
+logger = logging.getLogger(__name__)
 
 # Set UTF-8 encoding for output to handle Unicode characters correctly
 sys.stdout.reconfigure(encoding='utf-8')
 
+# Companies whose website was checked more recently than this are skipped
+DEFAULT_MAX_AGE_DAYS = float(os.getenv('WEBSITE_MAX_AGE_DAYS', '30'))
+DEFAULT_WORKERS = int(os.getenv('WEBSITE_WORKERS', '8'))
+
+# The only company fields the website stage reads
+WEBSITE_FIELDS = ['company_name', 'search_term_used', 'website',
+                  'website_etag', 'website_last_modified', 'website_content_hash']
+
 
 def clean_email(email):
     email = re.split(r'[^\w\.-]+', email)[0].lower()
     return email
 
 def validate_email(email):
-    """Validate email using a more flexible regex pattern."""
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return bool(re.match(email_pattern, email))
+    """Syntax check only; EmailVerifier.py checks whether the address actually exists."""
+    return bool(VALID_EMAIL_PATTERN.match(email))
 
 def extract_emails_from_text(text):
     """Extract all email addresses from the given text using regex."""
-    email_pattern = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    return re.findall(email_pattern, text)
+    return EMAIL_PATTERN.findall(text)
 
-def scrape_website(website):
-    try:
-        if website == 'N/A':
-            raise ValueError('Invalid URL: N/A')
+def extract_emails_from_html(html):
+    """Extract, clean and validate the email addresses found in an HTML page (str or bytes)."""
+    emails = extract_emails(html)
+    metrics.observe('emails_per_page', len(emails), buckets=metrics.COUNT_BUCKETS)
+    return emails
 
-        response = requests.get(website, timeout=30, verify=False)
-        response.raise_for_status()  # Raises HTTPError for bad responses (4xx, 5xx)
+def record_fetch(stage, status_code, nbytes, seconds):
+    """Counts one fetched page, its size and latency under the given stage label."""
+    metrics.inc('http_requests_total', api='website', stage=stage, status=status_code)
+    metrics.observe('http_fetch_seconds', seconds, api='website', stage=stage)
+    metrics.inc('pages_fetched_total', stage=stage)
+    metrics.inc('bytes_fetched_total', nbytes, stage=stage)
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Extract emails from mailto links
-        mailto_links = soup.select('a[href^=mailto]')
-        emails = [clean_email(link.get('href').replace('mailto:', '')) for link in mailto_links]
+def fetch_website(website, etag=None, last_modified=None):
+    """
+    GET a page, conditionally when validators from a previous scrape are known.
 
-        # Extract emails from text
-        page_text = soup.get_text()
-        emails += extract_emails_from_text(page_text)
-        
-        # Remove duplicates and invalid entries
-        emails = list(set(emails))
-        emails = [email for email in emails if '@' in email and validate_email(email)]
+    The page comes through http_transport: non-text content types are skipped
+    and at most HTTP_MAX_BYTES of the body are read.
 
-        return emails
+    :return: (status_code, html, headers), or None if the site could not be read.
+    """
+    try:
+        if not website or website == 'N/A':
+            raise ValueError('Invalid URL: N/A')
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        start = time.perf_counter()
+        page = http_transport.fetch(website, headers=headers)
+        if page is None:  # Not an HTML or text page
+            return None
+        record_fetch('website', page.status_code, page.nbytes, time.perf_counter() - start)
+        if page.status_code >= 400:
+            return None
+        return page.status_code, page.text, page.headers
     except requests.exceptions.Timeout:
-        print(f"Timeout occurred while scraping {website}. Skipping this site.")
-        return []
+        metrics.inc('http_fetch_errors_total', stage='website', reason='timeout')
+        logger.debug("Timeout occurred while scraping %s. Skipping this site.", website)
+        return None
+    except requests.exceptions.SSLError:
+        metrics.inc('http_fetch_errors_total', stage='website', reason='tls')
+        return None
     except requests.exceptions.RequestException:
-        return []
+        metrics.inc('http_fetch_errors_total', stage='website', reason='connection')
+        return None
     except ValueError:
+        return None
+    except Exception:
+        return None
+
+def scrape_website(website):
+    page = fetch_website(website)
+    if page is None:
         return []
+    try:
+        return extract_emails_from_html(page[1])
     except Exception:
         return []
 
-def update_company_info():
+def stale_companies_query(max_age_days=None):
+    """Filter selecting companies never scraped or last scraped more than max_age_days ago."""
+    if max_age_days is None:
+        return {}
+    cutoff = datetime.now() - timedelta(days=max_age_days)
+    return {'$or': [
+        {'website_checked_at': {'$exists': False}},
+        {'website_checked_at': {'$lt': cutoff}},
+    ]}
+
+def build_page_state(page):
+    """Returns the cache validators and check time to store for a fetched page."""
+    status_code, html, headers = page
+    if status_code == 304:
+        return {'website_checked_at': datetime.now()}
+    return {
+        'website_etag': headers.get('ETag'),
+        'website_last_modified': headers.get('Last-Modified'),
+        'website_content_hash': hashlib.sha256(html.encode('utf-8', 'replace')).hexdigest(),
+        'website_checked_at': datetime.now(),
+        'website_failures': 0,
+    }
+
+def page_unchanged(company, page, page_state, force=False):
+    """True if the server answered 304 or the page hashes the same as last time."""
+    if force:
+        return False
+    return page[0] == 304 or page_state.get('website_content_hash') == company.get('website_content_hash')
+
+def crawl_contact_pages(website, homepage_html, max_pages=CRAWL_MAX_PAGES, max_bytes=CRAWL_MAX_BYTES):
+    """
+    Visit the site's most contact-like pages until an email is found or the budget runs out.
+
+    Candidates come from the landing page's links and the sitemap, ranked by
+    how likely they are to hold contact details.
+
+    :param website: URL of the landing page.
+    :param homepage_html: Landing page HTML, already fetched; counts against the budget.
+    :return: Emails from the first page that had any, or an empty list.
+    """
+    frontier = CrawlFrontier(website, max_pages, max_bytes)
+    frontier.record(len(homepage_html.encode('utf-8', 'replace')))
+    frontier.add_links(homepage_html, website)
+
+    if not frontier.exhausted:
+        sitemap = fetch_website(frontier.sitemap_url)
+        if sitemap is not None:
+            frontier.record(len(sitemap[1].encode('utf-8', 'replace')), page=False)
+            frontier.add_sitemap(sitemap[1])
+
+    while True:
+        url = frontier.pop()
+        if url is None:
+            return []
+        page = fetch_website(url)
+        if page is None:
+            frontier.record(0)
+            continue
+        html = page[1]
+        frontier.record(len(html.encode('utf-8', 'replace')))
+        try:
+            emails = extract_emails_from_html(html)
+        except Exception:
+            emails = []
+        if emails:
+            return emails
+        frontier.add_links(html, url)
+
+def process_page(writer, company, page, force=False):
+    """
+    Parse a fetched landing page and save the result, skipping unchanged pages.
+
+    If the landing page has no email, the site's contact-like pages are crawled
+    within the per-domain budget.
+
+    :param writer: BulkWriter for the companies collection.
+    :param page: (status_code, html, headers) as returned by fetch_website.
+    :param force: Re-parse even if the server says or the hash shows nothing changed.
+    :return: The list of emails found, or None if parsing was skipped.
+    """
+    page_state = build_page_state(page)
+    if page_unchanged(company, page, page_state, force):
+        writer.update({'_id': company['_id']}, {'$set': page_state}, validate=False)
+        return None
+
+    html = page[1]
+    try:
+        emails = extract_emails_from_html(html)
+    except Exception:
+        emails = []
+    if not emails:
+        emails = crawl_contact_pages(company.get('website'), html)
+    save_scraped_emails(writer, company, emails, page_state)
+    return emails
+
+def save_scraped_emails(writer, company, emails, page_state=None):
+    """Queue the emails scraped for a company, and the page's cache validators, on the companies BulkWriter."""
+    company_email = emails[0] if emails else 'N/A'
+    other_emails = emails[1:] if len(emails) > 1 else []
+
+    logger.debug("Scraped for %s: Email=%s", company.get('company_name', 'Unknown'), company_email)
+
+    if company_email != 'N/A':
+        # Prepare updated company data
+        updated_data = {
+            'email': company_email,
+            'scrape_timestamp': datetime.now(),  # Overwrite with the latest scrape time
+            'company_name': company.get('company_name', 'Unknown'),  # Ensure required fields are included
+            'search_term_used': company.get('search_term_used', 'Unknown'),  # Ensure required fields are included
+            **(page_state or {})
+        }
+
+        update = {'$set': updated_data}
+        if other_emails:
+            # Added to the list rather than replacing it, so the Hunter stage's
+            # emails for the same company survive whichever write lands last
+            update['$addToSet'] = {'other_emails': {'$each': other_emails}}
+
+        # Validate the updated data and queue a $set to overwrite scrape_timestamp
+        if writer.update({'_id': company['_id']}, update,
+                         label=company.get('company_name', 'Unknown')):
+            logger.debug("Updated %s: Email=%s", company.get('company_name', 'Unknown'), company_email)
+    else:
+        if page_state:
+            writer.update({'_id': company['_id']}, {'$set': page_state}, validate=False)
+        logger.debug("No valid email found for %s", company.get('company_name', 'Unknown'))
+
+def save_failed_fetch(writer, company):
+    """
+    Records a website that could not be read, or a company without one.
+
+    website_checked_at is set so incremental runs skip the company until it is
+    stale again, instead of waiting out the same dead site on every run.
+    """
+    writer.update({'_id': company['_id']},
+                  {'$set': {'website_checked_at': datetime.now()}, '$inc': {'website_failures': 1}},
+                  validate=False, label=company.get('company_name', 'Unknown'))
+    logger.debug("Could not read the website of %s", company.get('company_name', 'Unknown'))
+
+def scrape_company(writer, company, force=False):
+    """Fetch one company's website and queue the result on the companies BulkWriter."""
+    etag = None if force else company.get('website_etag')
+    last_modified = None if force else company.get('website_last_modified')
+    page = fetch_website(company.get('website', 'N/A'), etag, last_modified)
+    if page is None:
+        save_failed_fetch(writer, company)
+    else:
+        process_page(writer, company, page, force)
+
+def website_scan(companies_collection, writer, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """The partitioned scan over stale companies shared by the sync and async website stages."""
+    # Buffered writes are flushed before each checkpoint so it never runs ahead of the data
+    return PartitionedScan(companies_collection, 'website_scraper', stale_companies_query(max_age_days),
+                           projection=WEBSITE_FIELDS, before_save=writer.flush)
+
+def update_company_info(max_age_days=DEFAULT_MAX_AGE_DAYS, force=False, limit=None, workers=DEFAULT_WORKERS):
+    """
+    Scrape company websites and update the companies collection.
+
+    Only companies whose website data is older than max_age_days are selected,
+    requests are conditional on the stored ETag/Last-Modified, and unchanged
+    pages are not re-parsed. The selection is split into _id ranges that
+    worker threads, or other processes running the stage, claim one at a time;
+    each range is checkpointed so a killed run resumes where it stopped.
+
+    :param max_age_days: Re-scrape companies checked longer ago than this; None selects all.
+    :param force: Ignore stored validators and content hashes and re-parse every page.
+    :param limit: Maximum number of companies to scrape.
+    :param workers: Number of threads fetching websites.
+    :return: The writer's stats, plus 'scraped', the number of companies processed.
+    """
     # Connect to the 'companies' collection in MongoDB
     companies_collection = get_mongo_collection('TestingDatabase', 'companies')
-    
-    # Fetch companies from MongoDB
-    companies = companies_collection.find()  # Fetch all companies
-    
-    for company in companies:
-        emails = scrape_website(company.get('website', 'N/A'))
-        company_email = emails[0] if emails else 'N/A'
-        other_emails = emails[1:] if len(emails) > 1 else []
-
-        print(f"Scraped for {company.get('company_name', 'Unknown')}: Email={company_email}")
-        
-        if company_email != 'N/A':
-            # Prepare updated company data
-            updated_data = {
-                'email': company_email,
-                'other_emails': other_emails,
-                'scrape_timestamp': datetime.now(),  # Overwrite with the latest scrape time
-                'company_name': company.get('company_name', 'Unknown'),  # Ensure required fields are included
-                'search_term_used': company.get('search_term_used', 'Unknown')  # Ensure required fields are included
-            }
-            
-            # Validate the updated data
-            try:
-                validate_data(updated_data, companies_schema)
-
-                # Update MongoDB document with $set to overwrite scrape_timestamp
-                companies_collection.update_one(
-                    {'_id': company['_id']}, 
-                    {'$set': updated_data}
-                )
-                print(f"Updated {company.get('company_name', 'Unknown')}: Email={company_email}")
-            except ValueError as e:
-                print(f"Validation failed for {company.get('company_name', 'Unknown')}: {e}")
-        else:
-            print(f"No valid email found for {company.get('company_name', 'Unknown')}")
+    writer = BulkWriter(companies_collection, schema=companies_schema)
+    scan = website_scan(companies_collection, writer, max_age_days)
+
+    try:
+        scraped = scan.run(lambda company: scrape_company(writer, company, force), workers=workers, limit=limit)
+    finally:
+        writer.close()
+    return {**writer.stats, 'scraped': scraped}
 
 if __name__ == '__main__':
+    from logging_config import configure_logging
+    configure_logging()
     print("Start scraping websites...")
     update_company_info()
     print("Finished updating company info.")
\ No newline at end of file
@@ -0,0 +1,262 @@
+"""
+Offline end-to-end benchmark of discovery, website scraping and Hunter enrichment.
+
+Usage:
+    python -m benchmarks.end_to_end [--companies N] [--output PATH] [--baseline PATH]
+                                    [--mongo-uri mongodb://127.0.0.1:27017] [--sync-website]
+
+Every external service is replaced by a local stand-in:
+- stubs.places serves the Places text search and details.
+- stubs.websites serves a generated website for every business. It is used
+  as an HTTP proxy, so the scrapers fetch the real-looking URLs from Places.
+- stubs.hunter serves domain-search.
+- Mongo is mongomock, or a local mongod given with --mongo-uri. Its
+  TestingDatabase is dropped first. mongomock runs in-process, so the Mongo
+  share of each stage is only realistic against a real mongod.
+
+The three stages run one after another: collect_and_save_data over enough
+queries to find --companies businesses, then update_company_info, then
+run_hunter_stage. Each stage reports:
+- throughput
+- latency percentiles, estimated from the metrics histograms
+- request counters
+- peak traced Python memory and the process max RSS
+
+The results are written as JSON. Pass an earlier results file as --baseline
+to print the throughput change per stage.
+"""
+from urllib.parse import urlsplit
+from datetime import datetime
+import subprocess
+import tracemalloc
+import argparse
+import tempfile
+import json
+import math
+import time
+import gc
+import os
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+BENCH_INDUSTRY = 'roofing'
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def bucket_percentile(histogram, q):
+    """Estimates a quantile from a metrics.snapshot() histogram by interpolating within its bucket."""
+    target = q * histogram['count']
+    seen, lower = 0, 0.0
+    for bound, count in histogram['buckets'].items():
+        if count and seen + count >= target:
+            if bound == '+Inf':
+                return lower
+            return lower + (float(bound) - lower) * (target - seen) / count
+        seen += count
+        if bound != '+Inf':
+            lower = float(bound)
+    return lower
+
+
+def _series_name(entry):
+    labels = ','.join(f'{key}={value}' for key, value in sorted(entry['labels'].items()))
+    return f"{entry['name']}{{{labels}}}" if labels else entry['name']
+
+
+def summarize_metrics(snapshot):
+    latency = {
+        _series_name(entry): {
+            'count': entry['count'],
+            'mean_ms': round(entry['mean'] * 1000, 3),
+            **{f'p{int(q * 100)}_ms': round(bucket_percentile(entry, q) * 1000, 3) for q in PERCENTILES},
+        }
+        for entry in snapshot['histograms'] if entry['name'].endswith('_seconds')
+    }
+    counters = {_series_name(entry): entry['value'] for entry in snapshot['counters']}
+    return latency, counters
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KiB on Linux
+
+
+def run_stage(name, function, count_items, trace_memory):
+    """Runs one stage and returns its measurements."""
+    import metrics
+
+    gc.collect()
+    metrics.reset()
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    items = count_items(result)
+    latency, counters = summarize_metrics(metrics.snapshot())
+    stage = {
+        'items': items,
+        'seconds': round(elapsed, 3),
+        'items_per_second': round(items / elapsed, 2) if elapsed else None,
+        'latency': latency,
+        'counters': counters,
+        'peak_traced_mb': round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if trace_memory else None,
+        'max_rss_mb': max_rss_mb(),
+        'result': result,
+    }
+    print(f"{name:<10} {items:>8} items {elapsed:>9.2f}s {stage['items_per_second'] or 0:>10.1f}/s"
+          f"  peak {stage['peak_traced_mb']} MB traced, {stage['max_rss_mb']} MB RSS")
+    return stage
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nThroughput vs {baseline_path} (commit {baseline.get('commit')}):")
+    for name, stage in results['stages'].items():
+        before = baseline.get('stages', {}).get(name, {}).get('items_per_second')
+        after = stage['items_per_second']
+        if before and after:
+            print(f"  {name:<10} {before:>10.1f}/s -> {after:>10.1f}/s  ({(after - before) / before:+.1%})")
+
+
+def setup_mongo(mongo_uri, parser):
+    from MongoConnection import get_mongo_client, set_mongo_client
+
+    if mongo_uri:
+        host = urlsplit(mongo_uri).hostname
+        if host not in ('127.0.0.1', 'localhost', '::1'):
+            parser.error('--mongo-uri must point at a local mongod; its TestingDatabase is dropped')
+        os.environ['MONGODB_URI'] = mongo_uri
+        get_mongo_client().drop_database('TestingDatabase')
+        return 'mongod'
+    try:
+        import mongomock
+    except ImportError:
+        parser.error('install mongomock or pass --mongo-uri for a local mongod')
+    set_mongo_client(mongomock.MongoClient())
+    return 'mongomock'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=1000, help='Businesses the Places stub returns')
+    parser.add_argument('--mongo-uri', help='Local mongod to use instead of mongomock')
+    parser.add_argument('--sync-website', action='store_true', help='Benchmark WebsiteScraper instead of AsyncWebsiteScraper')
+    parser.add_argument('--website-concurrency', type=int, default=100)
+    parser.add_argument('--hunter-workers', type=int, default=None,
+                        help='Default 4 on mongod, 1 on mongomock, which is not thread-safe')
+    parser.add_argument('--api-latency', type=float, default=0.01, help='Seconds added to every Places and Hunter response')
+    parser.add_argument('--site-latency', type=float, default=0.02, help='Seconds added to every website response')
+    parser.add_argument('--page-kb', type=int, default=24, help='Approximate size of each website page')
+    parser.add_argument('--token-delay', type=float, default=0.1, help='Seconds before a Places page token is valid')
+    parser.add_argument('--qps', type=float, default=1000, help='Places and Hunter rate limits')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='Skip peak memory tracing, which slows the run')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='Results file (default benchmark_results/end_to_end_<companies>.json)')
+    parser.add_argument('--baseline', help='Earlier results file to compare throughput against')
+    args = parser.parse_args()
+
+    from stubs.places import start_places_stub, RESULTS_PER_QUERY
+    from stubs.websites import start_website_stub
+    from stubs.hunter import start_hunter_stub
+
+    places_server, places_state, places_url = start_places_stub(
+        businesses=args.companies, token_delay=args.token_delay, latency=args.api_latency)
+    website_server, website_state, proxy_url = start_website_stub(latency=args.site_latency, page_kb=args.page_kb)
+    hunter_server, hunter_state, hunter_url = start_hunter_stub(
+        credits=args.companies * 2, qps=int(args.qps), latency=args.api_latency)
+    cache_dir = tempfile.TemporaryDirectory()
+
+    # The scraper modules read these at import time
+    os.environ.update({
+        'SCRAPER_CACHE_DIR': cache_dir.name,
+        'GOOGLE_MAPS_API_KEY': 'AIzaOfflineBenchmarkKey',
+        'GOOGLE_MAPS_BASE_URL': places_url,
+        'PLACES_QPS': str(args.qps),
+        'HUNTER_API_BASE': hunter_url,
+        'HUNTER_API_KEY': 'offline-benchmark',
+        'HUNTER_QPS': str(args.qps),
+        'HTTP_PROXY': proxy_url, 'http_proxy': proxy_url,
+        'NO_PROXY': '127.0.0.1,localhost', 'no_proxy': '127.0.0.1,localhost',
+    })
+
+    from logging_config import configure_logging
+    configure_logging(args.log_level)
+    mongo = setup_mongo(args.mongo_uri, parser)
+
+    import GoogleMapsScraper
+    import WebsiteScraper
+    import AsyncWebsiteScraper
+    from HunterScraper import run_hunter_stage
+
+    GoogleMapsScraper.PAGE_TOKEN_INITIAL_WAIT = args.token_delay
+    queries = math.ceil(args.companies / RESULTS_PER_QUERY)
+
+    def discover():
+        totals = {}
+        for number in range(queries):
+            stats = GoogleMapsScraper.collect_and_save_data(BENCH_INDUSTRY, f'Zone {number}')
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def scrape_websites():
+        if args.sync_website:
+            return WebsiteScraper.update_company_info(workers=1 if mongo == 'mongomock' else WebsiteScraper.DEFAULT_WORKERS)
+        return AsyncWebsiteScraper.update_company_info(concurrency=args.website_concurrency)
+
+    if args.hunter_workers is None:
+        args.hunter_workers = 1 if mongo == 'mongomock' else 4
+
+    trace_memory = not args.no_tracemalloc
+    if trace_memory:
+        tracemalloc.start()
+    print(f"Benchmarking {args.companies} companies ({queries} queries) on {mongo}")
+    stages = {
+        'discovery': run_stage('discovery', discover, lambda result: result['inserted'], trace_memory),
+        'website': run_stage('website', scrape_websites, lambda result: result['scraped'], trace_memory),
+        'hunter': run_stage('hunter', lambda: run_hunter_stage(args.hunter_workers),
+                            lambda result: result['hunted'], trace_memory),
+    }
+
+    results = {
+        'benchmark': 'end_to_end',
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {**vars(args), 'mongo': mongo, 'queries': queries},
+        'stages': stages,
+        'stubs': {
+            'places_requests': places_state.requests,
+            'website_requests': website_state.requests,
+            'website_bytes': website_state.bytes_sent,
+            'hunter_requests': hunter_state.requests,
+        },
+    }
+    output = args.output or os.path.join('benchmark_results', f'end_to_end_{args.companies}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Results written to {output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+    for server in (places_server, website_server, hunter_server):
+        server.shutdown()
+    cache_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
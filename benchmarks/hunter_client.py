@@ -0,0 +1,49 @@
+"""
+Offline throughput benchmark of HunterClient against the local Hunter stub.
+
+Usage:
+    python -m benchmarks.hunter_client [--domains N] [--latency SECONDS] [--qps N]
+
+Runs every domain twice: once cold, paying a stub round trip per domain,
+and once warm, served from the domain-search cache.
+"""
+import argparse
+import tempfile
+import time
+import os
+from cache import SQLiteCache
+from HunterClient import HunterClient
+from stubs.hunter import start_hunter_stub
+
+
+def timed_pass(client, domains):
+    start = time.perf_counter()
+    for domain in domains:
+        client.domain_search(domain)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--domains', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--qps', type=float, default=50)
+    args = parser.parse_args()
+
+    server, state, base_url = start_hunter_stub(credits=args.domains * 2, qps=int(args.qps), latency=args.latency)
+    domains = [f'roofing{i}.ca' for i in range(args.domains)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = SQLiteCache('hunter_bench', ttl=3600, path=os.path.join(cache_dir, 'hunter.sqlite'))
+        client = HunterClient('bench', base_url=base_url, qps=args.qps, cache=cache)
+        cold = timed_pass(client, domains)
+        warm = timed_pass(client, domains)
+        cache.close()
+    server.shutdown()
+
+    print(f'cold  {args.domains / cold:>10.1f} domains/s')
+    print(f'warm  {args.domains / warm:>10.1f} domains/s')
+    print(f'stub requests {state.requests}, credits used {state.used}, client stats {client.stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Documents-per-second benchmark of company validation.
+
+Usage:
+    python -m benchmarks.validation [--records N] [--invalid-ratio R]
+
+Compares the original per-call Validator construction, the cached Cerberus
+validator, and the compiled fast path with validate_many, on a generated
+fixture of company records.
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+from cerberus import Validator
+import validators
+from validators import companies_schema, get_validator, validate_many
+
+
+def generate_companies(count, invalid_ratio, seed=42):
+    rng = random.Random(seed)
+    companies = []
+    for i in range(count):
+        company = {
+            'company_name': f'Roofing Company {i}',
+            'normalized_name': f'roofing company {i}',
+            'website': f'https://roofing{i}.ca',
+            'domain': f'roofing{i}.ca',
+            'address': f'{rng.randint(1, 999)} Main St, Oakville ON',
+            'phone_number': f'(905) 555-{rng.randint(0, 9999):04d}',
+            'email': f'info@roofing{i}.ca',
+            'other_emails': [f'sales@roofing{i}.ca'] if rng.random() < 0.3 else [],
+            'search_term_used': 'roofing in Oakville Ontario',
+            'scrape_timestamp': datetime.now(),
+            'has_been_hunted': False,
+        }
+        if rng.random() < invalid_ratio:
+            company['email'] = 'not-an-email'
+        companies.append(company)
+    return companies
+
+
+def legacy_validate_many(companies):
+    """The original validate_data: a new Validator for every document."""
+    failures = 0
+    for company in companies:
+        v = Validator(companies_schema, allow_unknown=False)
+        if not v.validate(company):
+            failures += 1
+    return failures
+
+
+def cached_validate_many(companies):
+    failures = 0
+    v = get_validator(companies_schema)
+    for company in companies:
+        if not v.validate(company):
+            failures += 1
+    return failures
+
+
+def fast_validate_many(companies):
+    return len(validate_many(companies, companies_schema)[1])
+
+
+def run(label, function, companies):
+    start = time.perf_counter()
+    failures = function(companies)
+    elapsed = time.perf_counter() - start
+    print(f'{label:<18} {len(companies) / elapsed:>12.0f} docs/s  ({failures} invalid)')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--invalid-ratio', type=float, default=0.01)
+    args = parser.parse_args()
+
+    companies = generate_companies(args.records, args.invalid_ratio)
+    results = [
+        run('per-call Validator', legacy_validate_many, companies),
+        run('cached Validator', cached_validate_many, companies),
+        run('fast path (batch)', fast_validate_many, companies),
+    ]
+    validators.FAST_PATH_ENABLED = False
+    results.append(run('batch, no fast path', fast_validate_many, companies))
+    if len(set(results)) != 1:
+        print(f'MISMATCH in invalid counts: {results}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from bson import ObjectId
+from validators import validate_data
+import metrics
+import threading
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', '500'))
+BULK_FLUSH_INTERVAL = float(os.getenv('BULK_FLUSH_INTERVAL', '5'))
+
+
+class BulkWriter:
+    """
+    Buffers inserts, updates and deletes for one collection and sends them as bulk_write batches.
+
+    A batch is sent when it reaches batch_size operations, when an operation is
+    added more than flush_interval seconds after the last flush, and on close().
+    If a schema is given, documents are checked with validators.validate_data
+    before they are buffered; invalid ones are reported and dropped.
+
+    Usable as a context manager, which closes (and so flushes) the writer on exit.
+    """
+
+    def __init__(self, collection, schema=None, batch_size=BULK_BATCH_SIZE,
+                 flush_interval=BULK_FLUSH_INTERVAL, ordered=False, on_inserted=None):
+        """
+        :param collection: The pymongo collection to write to.
+        :param schema: Optional validators schema to check documents against.
+        :param batch_size: Number of buffered operations that triggers a flush.
+        :param flush_interval: Maximum age in seconds of a buffered batch.
+        :param ordered: Send batches as ordered bulk writes. Use when several
+            operations in a batch target the same document and must apply in order.
+        :param on_inserted: Optional callable receiving, after each flush, the list
+            of inserted documents that were written successfully.
+        """
+        self.collection = collection
+        self.schema = schema
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ordered = ordered
+        self.on_inserted = on_inserted
+        self.errors = []
+        self.stats = {'inserted': 0, 'matched': 0, 'modified': 0, 'upserted': 0, 'deleted': 0,
+                      'failed': 0, 'invalid': 0, 'batches': 0}
+        self._ops = []
+        self._labels = []
+        self._inserts = []  # The inserted document for each buffered op, or None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _validate(self, document, label):
+        if self.schema is None:
+            return True
+        try:
+            validate_data(document, self.schema)
+            return True
+        except ValueError as e:
+            with self._lock:
+                self.stats['invalid'] += 1
+            metrics.inc('validation_failures_total', collection=self.collection.name)
+            logger.warning("Validation failed for %s: %s", label, e)
+            return False
+
+    def _add(self, op, label, document=None):
+        with self._lock:
+            self._ops.append(op)
+            self._labels.append(label)
+            self._inserts.append(document)
+            due = (len(self._ops) >= self.batch_size
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def insert(self, document, label=None):
+        """Queues an insert. Returns False if the document failed validation."""
+        label = label or document.get('company_name') or document.get('email')
+        if not self._validate(document, label):
+            return False
+        if self.on_inserted is not None:
+            # Assign the _id now so callers can refer to the document once it is written
+            document.setdefault('_id', ObjectId())
+        self._add(InsertOne(document), label, document)
+        return True
+
+    def update(self, filter, update, upsert=False, validate=True, label=None):
+        """
+        Queues an update_one. The update's $set document is validated unless validate is False.
+
+        Returns False if the $set document failed validation.
+        """
+        label = label or str(filter)
+        if validate and '$set' in update and not self._validate(update['$set'], label):
+            return False
+        self._add(UpdateOne(filter, update, upsert=upsert), label)
+        return True
+
+    def delete(self, filter, label=None):
+        """Queues a delete_one."""
+        self._add(DeleteOne(filter), label or str(filter))
+
+    def flush(self):
+        """Sends the buffered operations. Per-document failures are collected in self.errors."""
+        with self._flush_lock:
+            with self._lock:
+                ops, labels, inserts = self._ops, self._labels, self._inserts
+                self._ops, self._labels, self._inserts = [], [], []
+                self._last_flush = time.monotonic()
+            while ops:
+                ops, labels, inserts = self._send(ops, labels, inserts)
+
+    def _send(self, ops, labels, inserts):
+        """
+        Sends one batch and records its results.
+
+        :return: The (ops, labels, inserts) an ordered batch did not run because
+            it stopped at its first error; they are sent again by flush().
+        """
+        try:
+            result = self.collection.bulk_write(ops, ordered=self.ordered)
+            details = result.bulk_api_result
+            write_errors = []
+        except BulkWriteError as e:
+            details = e.details
+            write_errors = details.get('writeErrors', [])
+        except PyMongoError as e:
+            # The whole batch failed, e.g. the connection dropped
+            details = {}
+            write_errors = [{'index': i, 'code': None, 'errmsg': str(e)} for i in range(len(ops))]
+
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['inserted'] += details.get('nInserted', 0)
+            self.stats['matched'] += details.get('nMatched', 0)
+            self.stats['modified'] += details.get('nModified', 0)
+            self.stats['upserted'] += details.get('nUpserted', 0)
+            self.stats['deleted'] += details.get('nRemoved', 0)
+            self.stats['failed'] += len(write_errors)
+            if write_errors:
+                metrics.inc('write_failures_total', len(write_errors), collection=self.collection.name)
+            for error in write_errors:
+                label = labels[error['index']]
+                self.errors.append({'label': label, 'code': error.get('code'), 'errmsg': error.get('errmsg')})
+                logger.warning("Write failed for %s: %s", label, error.get('errmsg'))
+
+        failed = {error['index'] for error in write_errors}
+        # An ordered batch stops at its first error; the operations after it never ran
+        stop = min(failed) + 1 if failed and self.ordered and len(failed) < len(ops) else len(ops)
+        if self.on_inserted is not None:
+            inserted = [document for index, document in enumerate(inserts[:stop])
+                        if document is not None and index not in failed]
+            if inserted:
+                self.on_inserted(inserted)
+        return ops[stop:], labels[stop:], inserts[stop:]
+
+    def close(self):
+        """Flushes any remaining operations."""
+        self.flush()
@@ -0,0 +1,96 @@
+import metrics
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DIR = os.getenv('SCRAPER_CACHE_DIR', '.cache')
+
+
+class SQLiteCache:
+    """
+    Small on-disk key/value cache for API responses, backed by SQLite.
+
+    Entries expire after `ttl` seconds. When more than `max_entries` are
+    stored, the least recently used ones are evicted. Values must be JSON
+    serializable. Safe to share between threads; each process should open its
+    own instance.
+    """
+
+    def __init__(self, name, ttl, max_entries=100000, path=None):
+        """
+        :param name: Cache name; also the default file name under SCRAPER_CACHE_DIR.
+        :param ttl: Seconds an entry stays fresh.
+        :param max_entries: Size cap enforced by LRU eviction.
+        :param path: Explicit database path, overriding the default location.
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path or os.path.join(CACHE_DIR, f'{name}.sqlite')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+        self._db.commit()
+
+    def get(self, key):
+        """Returns the cached value, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT value, stored_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                metrics.inc('cache_lookups_total', cache=self.name, result='miss')
+                return None
+            self._db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            self.hits += 1
+            metrics.inc('cache_lookups_total', cache=self.name, result='hit')
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, default=str), now, now)
+            )
+            self._writes_since_evict += 1
+            # Eviction scans the table, so only run it every so often
+            if self._writes_since_evict >= max(1, self.max_entries // 100):
+                self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        self._writes_since_evict = 0
+        self._db.execute('DELETE FROM entries WHERE stored_at < ?', (now - self.ttl,))
+        count = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at LIMIT ?)',
+                (count - self.max_entries,)
+            )
+
+    def stats(self):
+        """Returns hit/miss counts and the hit rate since the cache was opened."""
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,399 @@
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure
+import threading
+import socket
+import time
+import os
+import logging
+from MongoConnection import get_mongo_collection
+
+logger = logging.getLogger(__name__)
+
+SCAN_PARTITIONS = int(os.getenv('SCAN_PARTITIONS', '32'))
+SCAN_BATCH_SIZE = int(os.getenv('SCAN_BATCH_SIZE', '500'))
+SCAN_LEASE_SECONDS = int(os.getenv('SCAN_LEASE_SECONDS', '600'))  # A partition not checkpointed for this long is reclaimed
+
+
+class ScanCheckpoint:
+    """
+    Tracks how far an _id-ordered scan has got so a killed run can resume.
+
+    Documents may finish out of order (e.g. in the concurrent crawler), so the
+    saved position is the low watermark: the highest _id such that it and every
+    _id started before it have finished.
+    """
+
+    def __init__(self, name, save_every=50, save_interval=10.0, before_save=None, lease_seconds=None):
+        """
+        :param name: Unique name of the scan, used as the checkpoint document _id.
+        :param save_every: Persist after this many watermark advances.
+        :param save_interval: Persist at least this often, in seconds.
+        :param before_save: Optional callable run before persisting, e.g. a BulkWriter's
+            flush, so the checkpoint never gets ahead of buffered writes.
+        :param lease_seconds: If set, every save also extends the document's
+            lease_expires_at by this much; used by ScanPartition.
+        """
+        self.name = name
+        self.before_save = before_save
+        self.lease_seconds = lease_seconds
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self.collection = get_mongo_collection('TestingDatabase', 'scrape_checkpoints')
+        self._in_flight = OrderedDict()
+        self._watermark = None
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Returns the _id to resume after, or None to start from the beginning."""
+        checkpoint = self.collection.find_one({'_id': self.name})
+        self._watermark = checkpoint.get('last_id') if checkpoint else None
+        return self._watermark
+
+    def resume_filter(self, query=None):
+        """Adds the resume position to a find() filter."""
+        query = dict(query or {})
+        last_id = self.load()
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        return query
+
+    def start(self, _id):
+        with self._lock:
+            self._in_flight[_id] = False
+
+    def done(self, _id):
+        with self._lock:
+            self._in_flight[_id] = True
+            while self._in_flight and next(iter(self._in_flight.values())):
+                self._watermark, _ = self._in_flight.popitem(last=False)
+                self._unsaved += 1
+            due = (self._unsaved >= self.save_every
+                   or time.monotonic() - self._last_save >= self.save_interval)
+        if due:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            if self._watermark is None or self._unsaved == 0:
+                return
+            last_id = self._watermark
+            self._unsaved = 0
+            self._last_save = time.monotonic()
+        if self.before_save is not None:
+            self.before_save()
+        update = {'last_id': last_id, 'updated_at': datetime.now()}
+        if self.lease_seconds is not None:
+            update['lease_expires_at'] = datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)
+        self.collection.update_one({'_id': self.name}, {'$set': update}, upsert=True)
+
+    def finish(self):
+        """Saves the final position and marks the scan done, keeping the document."""
+        self.save()
+        if self.before_save is not None:
+            self.before_save()
+        self.collection.update_one({'_id': self.name}, {'$set': {'done': True, 'updated_at': datetime.now()},
+                                                        '$unset': {'lease_expires_at': '', 'claimed_by': ''}})
+
+    def clear(self):
+        """Removes the checkpoint once the scan has completed."""
+        with self._lock:
+            self._in_flight.clear()
+            self._watermark = None
+            self._unsaved = 0
+        self.collection.delete_one({'_id': self.name})
+
+
+class ScanPartition:
+    """
+    One _id range of a PartitionedScan, held by one worker at a time.
+
+    Its progress is a ScanCheckpoint stored on the partition document, so a
+    reclaimed partition resumes after the last document its previous holder finished.
+    """
+
+    def __init__(self, scan, document):
+        self.scan = scan
+        self.name = document['_id']
+        self.min_id = document.get('min_id')
+        self.max_id = document.get('max_id')  # None for the last partition, which stays open-ended
+        self.checkpoint = ScanCheckpoint(self.name, before_save=scan.before_save, lease_seconds=scan.lease_seconds)
+        self._pending = 0
+        self._exhausted = False
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def _id_range(self, after):
+        bounds = {}
+        if after is not None:
+            bounds['$gt'] = after
+        elif self.min_id is not None:
+            bounds['$gte'] = self.min_id
+        if self.max_id is not None:
+            bounds['$lt'] = self.max_id
+        return bounds
+
+    def documents(self):
+        """
+        Yields the partition's matching documents in _id order, resuming after its checkpoint.
+
+        Every document is marked started as it is yielded; call done() once it
+        is processed. Pages of batch_size are fetched with short queries, so no
+        cursor stays open while documents are processed and none can time out.
+        """
+        after = self.checkpoint.load()
+        while True:
+            id_range = self._id_range(after)
+            query = {**self.scan.query, '_id': id_range} if id_range else dict(self.scan.query)
+            page = list(self.scan.collection.find(query, self.scan.projection)
+                        .sort('_id', ASCENDING).limit(self.scan.batch_size))
+            for document in page:
+                with self._lock:
+                    self._pending += 1
+                self.checkpoint.start(document['_id'])
+                yield document
+            if len(page) < self.scan.batch_size:
+                break
+            after = page[-1]['_id']
+        with self._lock:
+            self._exhausted = True
+            finished = self._pending == 0
+        if finished:
+            self._finish()
+
+    def done(self, _id):
+        self.checkpoint.done(_id)
+        with self._lock:
+            self._pending -= 1
+            finished = self._exhausted and self._pending == 0
+        if finished:
+            self._finish()
+
+    def _finish(self):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        self.checkpoint.finish()
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def release(self):
+        """Saves progress and hands the partition back so another worker can continue it."""
+        if self._finished:
+            return
+        self.checkpoint.save()
+        self.scan.checkpoints.update_one({'_id': self.name, 'done': False},
+                                         {'$unset': {'lease_expires_at': '', 'claimed_by': ''}})
+
+
+class PartitionedScan:
+    """
+    A resumable scan of the documents matching a query, split into _id ranges.
+
+    The ranges are planned once with $bucketAuto and stored in
+    scrape_checkpoints, next to one checkpoint per range. Workers claim ranges
+    with a lease, like SearchJobs claims jobs, so threads of one run and
+    separate processes can share a scan. Each range is read with a projection
+    in pages of batch_size. A restarted run skips finished ranges and resumes
+    the others from their checkpoints. clear() removes the plan once every range is done.
+    """
+
+    def __init__(self, collection, name, query=None, projection=None, partitions=SCAN_PARTITIONS,
+                 batch_size=SCAN_BATCH_SIZE, lease_seconds=SCAN_LEASE_SECONDS, before_save=None):
+        """
+        :param collection: The collection to scan.
+        :param name: Unique name of the scan; runs with the same name share its plan and progress.
+        :param query: Filter selecting the documents; must not constrain _id.
+        :param projection: Fields the stage needs; _id is always included.
+        :param partitions: Number of ranges to plan.
+        :param batch_size: Documents per page query.
+        :param lease_seconds: How long a claimed range may go without a checkpoint before it can be reclaimed.
+        :param before_save: Passed to each range's ScanCheckpoint, e.g. a BulkWriter's flush.
+        """
+        self.collection = collection
+        self.name = name
+        self.query = dict(query or {})
+        self.projection = projection
+        self.partitions = partitions
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.before_save = before_save
+        self.checkpoints = get_mongo_collection('TestingDatabase', 'scrape_checkpoints')
+        self._claimed = []
+        self._claimed_lock = threading.Lock()
+
+    @property
+    def plan_id(self):
+        return f'{self.name}:plan'
+
+    def plan(self):
+        """
+        Splits the matching _ids into ranges, unless a plan for this scan already exists.
+
+        If another process is planning the same scan, waits for its plan. A plan
+        left unfinished for longer than lease_seconds is discarded and redone.
+        """
+        self.checkpoints.create_index([('scan', ASCENDING), ('done', ASCENDING), ('index', ASCENDING)],
+                                      name='scan_partition_claim')
+        while True:
+            try:
+                self.checkpoints.insert_one({'_id': self.plan_id, 'status': 'planning', 'created_at': datetime.now()})
+                break
+            except DuplicateKeyError:
+                plan = self.checkpoints.find_one({'_id': self.plan_id})
+                if plan is None:
+                    continue
+                if plan.get('status') == 'ready':
+                    return plan['partitions']
+                if (datetime.now() - plan['created_at']).total_seconds() > self.lease_seconds:
+                    self.checkpoints.delete_many({'scan': self.name})
+                    self.checkpoints.delete_one({'_id': self.plan_id, 'status': 'planning'})
+                else:
+                    time.sleep(1)
+
+        # Each range ends where the next starts; the first and last are left open for documents added later
+        starts = self._range_starts() or [None]
+        starts[0] = None
+        documents = [{
+            '_id': f'{self.name}:{index}',
+            'scan': self.name,
+            'index': index,
+            'min_id': start,
+            'max_id': starts[index + 1] if index + 1 < len(starts) else None,
+            'done': False,
+        } for index, start in enumerate(starts)]
+        self.checkpoints.insert_many(documents)
+        self.checkpoints.update_one({'_id': self.plan_id}, {'$set': {'status': 'ready', 'partitions': len(documents)}})
+        logger.info("Planned scan %s in %d partitions", self.name, len(documents))
+        return len(documents)
+
+    def _range_starts(self):
+        """The first _id of each range, from one $bucketAuto pass over the matching _ids."""
+        pipeline = [
+            {'$match': self.query},
+            {'$project': {'_id': 1}},
+            {'$bucketAuto': {'groupBy': '$_id', 'buckets': self.partitions}},
+        ]
+        try:
+            return [bucket['_id']['min'] for bucket in self.collection.aggregate(pipeline, allowDiskUse=True)]
+        except (NotImplementedError, OperationFailure) as e:
+            # mongomock, and servers that refuse the stage, get sampled boundaries instead
+            logger.debug("Planning %s without $bucketAuto: %s", self.name, e)
+        step = -(-self.collection.count_documents(self.query) // self.partitions)
+        starts = []
+        for index in range(self.partitions):
+            boundary = next(iter(self.collection.find(self.query, {'_id': 1})
+                                 .sort('_id', ASCENDING).skip(index * step).limit(1)), None)
+            if boundary is None:
+                break
+            starts.append(boundary['_id'])
+        return starts
+
+    def claim(self, worker_id=None):
+        """
+        Atomically claims the first range that is not done and not leased to a live worker.
+
+        :return: A ScanPartition, or None when every range is done or taken.
+        """
+        now = datetime.now(timezone.utc)
+        document = self.checkpoints.find_one_and_update(
+            {'scan': self.name, 'done': False, '$or': [
+                {'lease_expires_at': {'$exists': False}},
+                {'lease_expires_at': {'$lt': now}},
+            ]},
+            {'$set': {'claimed_by': worker_id or f'{socket.gethostname()}:{os.getpid()}',
+                      'lease_expires_at': now + timedelta(seconds=self.lease_seconds)}},
+            sort=[('index', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        if document is None:
+            return None
+        partition = ScanPartition(self, document)
+        with self._claimed_lock:
+            self._claimed.append(partition)
+        return partition
+
+    def release(self):
+        """Hands back every range this instance claimed but did not finish, e.g. after a limit or an error."""
+        with self._claimed_lock:
+            claimed, self._claimed = self._claimed, []
+        for partition in claimed:
+            partition.release()
+
+    def finished(self):
+        return self.checkpoints.count_documents({'scan': self.name, 'done': False}) == 0
+
+    def clear(self):
+        """Removes the plan and every range's checkpoint."""
+        self.checkpoints.delete_many({'scan': self.name})
+        self.checkpoints.delete_one({'_id': self.plan_id})
+
+    def close(self):
+        """Releases unfinished ranges, and clears the scan if every range is done."""
+        self.release()
+        if self.finished():
+            self.clear()
+
+    def _worker(self, process, worker_id, counter, limit, stop):
+        while not stop.is_set():
+            partition = self.claim(worker_id)
+            if partition is None:
+                return
+            for document in partition.documents():
+                with counter['lock']:
+                    if limit is not None and counter['processed'] >= limit:
+                        stop.set()
+                    if stop.is_set():
+                        break
+                    counter['processed'] += 1
+                try:
+                    processed = process(document) is not False
+                except Exception:
+                    # Stop the other workers too; run() re-raises once they have finished
+                    with counter['lock']:
+                        counter['processed'] -= 1
+                    stop.set()
+                    raise
+                if not processed:
+                    # Not processed; left before the checkpoint so a later run picks it up
+                    with counter['lock']:
+                        counter['processed'] -= 1
+                    stop.set()
+                    break
+                partition.done(document['_id'])
+
+    def run(self, process, workers=1, limit=None, stop=None):
+        """
+        Plans the scan if needed, then calls process(document) for each document on `workers` threads.
+
+        Every thread claims ranges until none are left, so several processes
+        running the same scan split the work between them.
+
+        :param process: Called with each document. Returning False means the
+            document could not be processed; it is not checkpointed and the scan stops.
+        :param limit: Maximum number of documents to process in this call.
+        :param stop: Optional threading.Event; setting it stops the workers after their current document.
+        :return: Number of documents processed.
+        :raises Exception: Whatever process() raised; the other workers are stopped
+            first and the unfinished ranges released.
+        """
+        self.plan()
+        stop = stop or threading.Event()
+        counter = {'processed': 0, 'lock': threading.Lock()}
+        run_id = f'{socket.gethostname()}:{os.getpid()}'
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(self._worker, process, f'{run_id}:{i}', counter, limit, stop)
+                           for i in range(workers)]
+                for future in futures:
+                    future.result()
+        finally:
+            self.close()
+        return counter['processed']
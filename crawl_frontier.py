@@ -0,0 +1,121 @@
+from urllib.parse import urljoin, urlsplit, urldefrag
+import heapq
+import re
+import os
+
+# Per-domain crawl budget, counting the landing page
+CRAWL_MAX_PAGES = int(os.getenv('CRAWL_MAX_PAGES', '6'))
+CRAWL_MAX_BYTES = int(os.getenv('CRAWL_MAX_BYTES', str(2 * 1024 * 1024)))
+
+# Words in a link's path or anchor text that suggest the page holds contact details
+CONTACT_HINTS = {
+    'contact': 10,
+    'impressum': 8,
+    'about': 6,
+    'team': 5,
+    'staff': 4,
+    'people': 4,
+    'location': 3,
+    'support': 3,
+    'quote': 2,
+    'estimate': 2,
+}
+
+SKIP_EXTENSIONS = (
+    '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.pdf', '.zip',
+    '.mp3', '.mp4', '.mov', '.css', '.js', '.xml', '.json', '.doc', '.docx',
+)
+
+LINK_PATTERN = re.compile(r'<a\s[^>]*?href\s*=\s*["\']([^"\']+)["\'][^>]*>(.*?)</a>', re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+SITEMAP_LOC_PATTERN = re.compile(r'<loc>\s*([^<\s]+)\s*</loc>', re.IGNORECASE)
+
+
+def _host(url):
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def score_link(url, anchor_text=''):
+    """Scores how likely a link is to lead to contact information; 0 means not at all."""
+    path = urlsplit(url).path.lower()
+    text = anchor_text.lower()
+    score = 0
+    for hint, weight in CONTACT_HINTS.items():
+        if hint in path:
+            score += weight
+        if hint in text:
+            score += weight
+    if score:
+        # Prefer shallow pages such as /contact over /blog/2019/contact-our-team
+        score -= path.rstrip('/').count('/') - 1
+    return max(score, 0)
+
+
+class CrawlFrontier:
+    """
+    Ranked, budgeted queue of same-site pages to visit for a single company.
+
+    Links are ranked by score_link and only links with a positive score are
+    kept. The crawl ends when the queue is empty or the page or byte budget
+    is spent.
+    """
+
+    def __init__(self, start_url, max_pages=CRAWL_MAX_PAGES, max_bytes=CRAWL_MAX_BYTES):
+        self.start_url = start_url
+        self.host = _host(start_url)
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.pages_fetched = 0
+        self.bytes_fetched = 0
+        self._seen = {urldefrag(start_url)[0].rstrip('/')}
+        self._heap = []
+        self._order = 0
+
+    @property
+    def sitemap_url(self):
+        return urljoin(self.start_url, '/sitemap.xml')
+
+    @property
+    def exhausted(self):
+        return self.pages_fetched >= self.max_pages or self.bytes_fetched >= self.max_bytes
+
+    def push(self, url, score):
+        url = urldefrag(url)[0]
+        key = url.rstrip('/')
+        if score <= 0 or key in self._seen:
+            return
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or _host(url) != self.host:
+            return
+        if parts.path.lower().endswith(SKIP_EXTENSIONS):
+            return
+        self._seen.add(key)
+        heapq.heappush(self._heap, (-score, self._order, url))
+        self._order += 1
+
+    def add_links(self, html, base_url):
+        """Queues the ranked same-site links found in a page."""
+        for href, anchor in LINK_PATTERN.findall(html):
+            href = href.strip()
+            if href.startswith(('mailto:', 'tel:', 'javascript:')):
+                continue
+            url = urljoin(base_url, href)
+            self.push(url, score_link(url, TAG_PATTERN.sub(' ', anchor)))
+
+    def add_sitemap(self, xml):
+        """Queues the ranked page URLs listed in a sitemap."""
+        for url in SITEMAP_LOC_PATTERN.findall(xml):
+            self.push(url, score_link(url))
+
+    def record(self, nbytes, page=True):
+        """Charges a fetch against the budget; sitemaps count bytes but not pages."""
+        self.bytes_fetched += nbytes
+        if page:
+            self.pages_fetched += 1
+
+    def pop(self):
+        """Returns the next best URL, or None when the queue or budget is exhausted."""
+        if self.exhausted or not self._heap:
+            return None
+        return heapq.heappop(self._heap)[2]
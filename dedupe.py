@@ -0,0 +1,99 @@
+from hashlib import blake2b
+from pymongo.errors import OperationFailure
+from normalizers import normalize_company_name, normalize_website
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Keys the dedupe index and the unique indexes are built on
+DEDUPE_FIELDS = ('normalized_name', 'site', 'place_id')
+
+
+def _key(value):
+    """64-bit digest of a key; far smaller in memory than the string itself."""
+    return int.from_bytes(blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def company_keys(company):
+    """Returns the (normalized_name, site, place_id) dedupe keys of a company document."""
+    return (
+        company.get('normalized_name') or normalize_company_name(company.get('company_name')),
+        company.get('site') or normalize_website(company.get('website')),
+        company.get('place_id'),
+    )
+
+
+class CompanyDedupeIndex:
+    """
+    In-memory set of the normalized names, site keys and Google place_ids already stored.
+
+    Loaded once with a single projected scan of the companies collection, then
+    kept up to date as companies are queued for insert, so each duplicate check
+    is a constant-time set lookup instead of a database query.
+    """
+
+    def __init__(self):
+        self.names = set()
+        self.sites = set()
+        self.place_ids = set()
+
+    @classmethod
+    def load(cls, companies_collection, batch_size=5000):
+        index = cls()
+        projection = {'_id': 0, 'company_name': 1, 'website': 1, **{field: 1 for field in DEDUPE_FIELDS}}
+        for company in companies_collection.find({}, projection, batch_size=batch_size):
+            index.add(company)
+        logger.info("Loaded dedupe index: %d names, %d sites, %d place_ids.",
+                    len(index.names), len(index.sites), len(index.place_ids))
+        return index
+
+    def add(self, company):
+        name, site, place_id = company_keys(company)
+        if name:
+            self.names.add(_key(name))
+        if site:
+            self.sites.add(_key(site))
+        if place_id:
+            self.place_ids.add(_key(place_id))
+
+    def contains(self, company):
+        """True if any of the company's keys is already known."""
+        name, site, place_id = company_keys(company)
+        return bool(
+            (place_id and _key(place_id) in self.place_ids)
+            or (name and _key(name) in self.names)
+            or (site and _key(site) in self.sites)
+        )
+
+    def has_place_id(self, place_id):
+        return bool(place_id) and _key(place_id) in self.place_ids
+
+
+def domain_filter(domain):
+    """
+    Exact-match filter on the companies' registrable domain.
+
+    The $type clause lets the planner use the partial domain index, which only
+    covers documents whose domain is a string.
+    """
+    return {'domain': {'$eq': domain, '$type': 'string'}}
+
+
+def ensure_company_indexes(companies_collection):
+    """
+    Creates unique indexes on the normalized dedupe keys as a backstop for the in-memory check.
+
+    Only documents that have the key are indexed. If existing data already
+    holds duplicates, a non-unique index is created instead and a warning is
+    printed.
+    """
+    # The registrable domain is shared by a company's sites, so it is only a lookup key
+    companies_collection.create_index('domain', name='domain_lookup',
+                                      partialFilterExpression={'domain': {'$type': 'string'}})
+    for field in DEDUPE_FIELDS:
+        partial = {'partialFilterExpression': {field: {'$type': 'string'}}}
+        try:
+            companies_collection.create_index(field, unique=True, name=f'{field}_unique', **partial)
+        except OperationFailure as e:
+            logger.warning("Could not create unique index on %s, existing duplicates? %s", field, e)
+            companies_collection.create_index(field, name=f'{field}_lookup', **partial)
@@ -0,0 +1,121 @@
+import html as html_lib
+import re
+
+# All patterns are compiled once at import; extraction runs straight over the
+# raw page instead of building a parse tree.
+EMAIL_PATTERN = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+VALID_EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+# Split pattern used by find_addresses: the page is only examined around each "@"
+LOCAL_PART_PATTERN = re.compile(r'[a-zA-Z0-9._%+-]+\Z')
+DOMAIN_PART_PATTERN = re.compile(r'[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+MAX_LOCAL_PART = 64  # RFC 5321 limit; longer runs before an "@" are not addresses
+LOCAL_PART_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._%+-')
+# Inline elements render as one run of text, so an address may be split across
+# them: <span>info</span>@<span>acme.com</span>. Block elements separate text.
+INLINE_TAG_PATTERN = re.compile(r'</?(?:span|a|b|strong|em|i|u|font|small|abbr|code)\b[^>]*>', re.IGNORECASE)
+SPLIT_AT_HINT = re.compile(r'>\s*@|@\s*<')
+MAILTO_PATTERN = re.compile(r'mailto:([^"\'?>\s]+)', re.IGNORECASE)
+
+# "name [at] domain [dot] com", "name (at) domain (dot) com", "name {at} domain.com"
+OBFUSCATED_AT = r'\s*[\[\(\{]\s*at\s*[\]\)\}]\s*'
+OBFUSCATED_DOT = r'(?:\s*[\[\(\{]\s*dot\s*[\]\)\}]\s*|\.)'
+OBFUSCATED_PATTERN = re.compile(
+    r'([a-zA-Z0-9._%+-]+)' + OBFUSCATED_AT +
+    r'((?:[a-zA-Z0-9-]+' + OBFUSCATED_DOT + r')+[a-zA-Z]{2,})',
+    re.IGNORECASE
+)
+OBFUSCATED_DOT_PATTERN = re.compile(OBFUSCATED_DOT, re.IGNORECASE)
+OBFUSCATION_HINT = re.compile(r'[\[\(\{]\s*at\s*[\]\)\}]', re.IGNORECASE)
+
+# Cloudflare email obfuscation: data-cfemail="..." and /cdn-cgi/l/email-protection#...
+CLOUDFLARE_PATTERN = re.compile(r'(?:data-cfemail="|/cdn-cgi/l/email-protection#)([0-9a-fA-F]+)')
+
+# Entity-encoded "@" (&#64;, &#x40;, &commat;) must be decoded before matching
+ENCODED_AT_HINT = re.compile(r'&#0*64;|&#x0*40;|&commat;', re.IGNORECASE)
+
+# Image and asset names like logo@2x.png look like emails but are not
+ASSET_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp', '.css', '.js')
+
+
+def decode_cloudflare_email(encoded):
+    """Decodes a Cloudflare-protected email; the first byte is the XOR key."""
+    try:
+        key = int(encoded[:2], 16)
+        return ''.join(chr(int(encoded[i:i + 2], 16) ^ key) for i in range(2, len(encoded), 2))
+    except ValueError:
+        return ''
+
+
+def is_valid_email(email):
+    return (bool(VALID_EMAIL_PATTERN.match(email)) and not email.endswith(ASSET_SUFFIXES)
+            and email.index('@') <= MAX_LOCAL_PART)
+
+
+def find_addresses(text):
+    """
+    Same matches as EMAIL_PATTERN.findall, but anchored on "@" characters.
+
+    Scanning for "@" with str.find is far cheaper than trying the regex at
+    every offset of a page that contains a handful of addresses. Like
+    findall, a local part never reaches back into the previous match, so
+    'a@b.com@c.com' yields only 'a@b.com'. A local part longer than
+    MAX_LOCAL_PART is skipped rather than cut to its last characters, which
+    would make up an address that is not on the page.
+    """
+    found = []
+    previous_end = 0
+    at = text.find('@')
+    while at != -1:
+        start = max(previous_end, at - MAX_LOCAL_PART)
+        local = LOCAL_PART_PATTERN.search(text, start, at)
+        if local and local.start() == start > previous_end and text[start - 1] in LOCAL_PART_CHARS:
+            local = None  # The local part runs on past the window
+        if local:
+            domain = DOMAIN_PART_PATTERN.match(text, at + 1)
+            if domain:
+                found.append(text[local.start():domain.end()])
+                previous_end = domain.end()
+        at = text.find('@', at + 1)
+    return found
+
+
+def extract_emails(page):
+    """
+    Extract the valid email addresses in an HTML page.
+
+    Finds plain addresses in text and attributes, addresses split across
+    inline tags, mailto links, entity-encoded addresses, "[at]"/"[dot]"
+    obfuscation and Cloudflare-encoded addresses.
+
+    :param page: Page content as str, or raw bytes as received.
+    :return: Lowercased, de-duplicated list of emails in order of first appearance.
+    """
+    if isinstance(page, (bytes, bytearray)):
+        # Emails are ASCII; latin-1 maps every byte to one char without failing
+        page = page.decode('latin-1')
+
+    if ENCODED_AT_HINT.search(page):
+        page = html_lib.unescape(page)
+
+    found = find_addresses(page)
+
+    if SPLIT_AT_HINT.search(page):
+        found.extend(find_addresses(INLINE_TAG_PATTERN.sub('', page)))
+
+    if 'mailto:' in page or 'MAILTO:' in page:
+        for target in MAILTO_PATTERN.findall(page):
+            found.extend(EMAIL_PATTERN.findall(target.replace('%40', '@')))
+
+    if OBFUSCATION_HINT.search(page):
+        for user, domain in OBFUSCATED_PATTERN.findall(page):
+            found.append(user + '@' + OBFUSCATED_DOT_PATTERN.sub('.', domain))
+
+    if 'cfemail' in page or 'email-protection#' in page:
+        found.extend(decode_cloudflare_email(encoded) for encoded in CLOUDFLARE_PATTERN.findall(page))
+
+    emails = {}
+    for email in found:
+        email = email.lower()
+        if email not in emails and is_valid_email(email):
+            emails[email] = None
+    return list(emails)
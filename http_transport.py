@@ -0,0 +1,234 @@
+"""
+Shared HTTP transport for website scraping and API clients.
+
+- Sessions are pooled and kept alive; the website session is shared by every thread.
+- Host lookups made through requests/urllib3 go through a process-wide DNS cache with a TTL.
+- Page bodies are streamed: non-HTML content types are skipped before the body
+  is read, and at most HTTP_MAX_BYTES are downloaded and decoded per page.
+- TLS certificates are verified unless HTTP_VERIFY_TLS=0.
+"""
+from requests.adapters import HTTPAdapter
+from http.cookiejar import DefaultCookiePolicy
+from collections import namedtuple
+import urllib3.util.connection
+import requests
+import metrics
+import threading
+import codecs
+import socket
+import ssl
+import time
+import re
+import os
+
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '30'))
+HTTP_MAX_BYTES = int(os.getenv('HTTP_MAX_BYTES', str(512 * 1024)))  # Per page; contact details sit well within this
+HTTP_CHUNK_SIZE = 16 * 1024
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', '100'))  # Hosts with a kept-alive pool
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '32'))  # Connections kept per host
+HTTP_VERIFY_TLS = os.getenv('HTTP_VERIFY_TLS', '1') != '0'
+HTTP_CA_BUNDLE = os.getenv('HTTP_CA_BUNDLE')  # Verify against this bundle instead of certifi's
+HTTP_USER_AGENT = os.getenv('HTTP_USER_AGENT', 'Mozilla/5.0 (compatible; BusinessDataScraper/1.0)')
+DNS_CACHE_TTL = float(os.getenv('DNS_CACHE_TTL', '300'))
+DNS_CACHE_MAX_ENTRIES = 10000
+
+# Pages are parsed as text; anything else (images, PDFs, archives) is skipped unread
+TEXT_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain', 'application/xml', 'text/xml')
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+SNIFF_BYTES = 4096
+
+Page = namedtuple('Page', ['status_code', 'text', 'headers', 'nbytes', 'truncated'])
+
+
+class DnsCache:
+    """
+    Thread-safe getaddrinfo cache. Successful lookups are kept for `ttl`
+    seconds; failures are not cached, so a flaky resolver is retried.
+    """
+
+    def __init__(self, ttl=DNS_CACHE_TTL, max_entries=DNS_CACHE_MAX_ENTRIES, resolve=socket.getaddrinfo):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._resolve = resolve
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            metrics.inc('cache_lookups_total', cache='dns', result='hit')
+            return entry[1]
+        metrics.inc('cache_lookups_total', cache='dns', result='miss')
+        with metrics.timer('dns_lookup_seconds', record='A'):
+            result = self._resolve(host, port, family, type, proto, flags)
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {key: value for key, value in self._entries.items() if value[0] > now}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (now + self.ttl, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _CachingSocketModule:
+    # Stands in for the socket module inside urllib3.util.connection, so only
+    # requests' lookups are cached and the rest of the process is untouched
+    def __init__(self, cache):
+        self._cache = cache
+
+    def __getattr__(self, name):
+        return getattr(socket, name)
+
+    def getaddrinfo(self, *args, **kwargs):
+        return self._cache.getaddrinfo(*args, **kwargs)
+
+
+dns_cache = DnsCache()
+_install_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+
+
+def install_dns_cache():
+    """Routes urllib3's host lookups through dns_cache. Idempotent."""
+    with _install_lock:
+        if not isinstance(urllib3.util.connection.socket, _CachingSocketModule):
+            urllib3.util.connection.socket = _CachingSocketModule(dns_cache)
+
+
+def new_session(max_retries=0, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE):
+    """
+    Returns a keep-alive requests.Session with the shared TLS, DNS cache and pool settings.
+
+    Cookies are refused, so a session shared across sites carries no state between them.
+
+    :param max_retries: An int or urllib3 Retry for the mounted adapters.
+    """
+    install_dns_cache()
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=max_retries, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = HTTP_CA_BUNDLE or HTTP_VERIFY_TLS
+    if not HTTP_VERIFY_TLS:
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.headers['User-Agent'] = HTTP_USER_AGENT
+    return session
+
+
+def get_session():
+    """Returns the session shared by every website fetch, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = new_session()
+        return _session
+
+
+def ssl_context():
+    """SSL setting for aiohttp connectors matching new_session: a verifying context, or False when HTTP_VERIFY_TLS=0."""
+    if not HTTP_VERIFY_TLS:
+        return False
+    return ssl.create_default_context(cafile=HTTP_CA_BUNDLE)
+
+
+def content_type_allowed(content_type, allowed=TEXT_CONTENT_TYPES):
+    """True if the media type is one of `allowed`; a missing Content-Type is given the benefit of the doubt."""
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    return not media_type or media_type in allowed
+
+
+def charset_from_content_type(content_type):
+    for parameter in (content_type or '').split(';')[1:]:
+        name, _, value = parameter.partition('=')
+        if name.strip().lower() == 'charset':
+            return value.strip().strip('"\'') or None
+    return None
+
+
+def _codec(name):
+    try:
+        return codecs.lookup(name).name if name else None
+    except LookupError:
+        return None
+
+
+class BodyDecoder:
+    """
+    Decodes a streamed body chunk by chunk, up to max_bytes.
+
+    The charset comes from the Content-Type header, else from a <meta charset>
+    in the first chunk, else UTF-8. Bytes are decoded as they arrive, so only
+    the text is kept, never the raw body as well.
+    """
+
+    def __init__(self, content_type=None, max_bytes=HTTP_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.truncated = False
+        self._charset = _codec(charset_from_content_type(content_type))
+        self._decoder = None
+        self._head = b''  # Held back until SNIFF_BYTES are in, when the charset must be sniffed
+        self._parts = []
+
+    def _start(self):
+        if self._charset is None:
+            match = META_CHARSET_PATTERN.search(self._head[:SNIFF_BYTES])
+            self._charset = _codec(match.group(1).decode('ascii', 'replace')) if match else None
+        self._decoder = codecs.getincrementaldecoder(self._charset or 'utf-8')(errors='replace')
+        head, self._head = self._head, b''
+        self._parts.append(self._decoder.decode(head))
+
+    def feed(self, chunk):
+        """Decodes a chunk. Returns False once max_bytes have been read and the rest should be dropped."""
+        room = self.max_bytes - self.nbytes
+        if len(chunk) > room:
+            chunk = chunk[:room]
+            self.truncated = True
+        self.nbytes += len(chunk)
+        if self._decoder is None:
+            self._head += chunk
+            if self._charset is not None or len(self._head) >= SNIFF_BYTES:
+                self._start()
+        else:
+            self._parts.append(self._decoder.decode(chunk))
+        return not self.truncated
+
+    def text(self):
+        if self._decoder is None:
+            self._start()
+        self._parts.append(self._decoder.decode(b'', final=True))
+        return ''.join(self._parts)
+
+
+def fetch(url, headers=None, timeout=HTTP_TIMEOUT, max_bytes=HTTP_MAX_BYTES, allowed_types=TEXT_CONTENT_TYPES):
+    """
+    GETs a page through the shared session, streaming at most max_bytes of its body.
+
+    Bodies of error responses, 304s and disallowed content types are not read.
+
+    :return: Page(status_code, text, headers, nbytes, truncated), or None if the
+        content type is not one of allowed_types.
+    :raises requests.exceptions.RequestException: On connection, TLS or timeout errors.
+    """
+    with get_session().get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 or response.status_code >= 400:
+            return Page(response.status_code, '', response.headers, 0, False)
+        content_type = response.headers.get('Content-Type')
+        if not content_type_allowed(content_type, allowed_types):
+            metrics.inc('http_fetch_errors_total', stage='website', reason='content_type')
+            return None
+        decoder = BodyDecoder(content_type, max_bytes)
+        for chunk in response.iter_content(HTTP_CHUNK_SIZE):
+            if not decoder.feed(chunk):
+                metrics.inc('http_truncated_total')
+                break
+        return Page(response.status_code, decoder.text(), response.headers, decoder.nbytes, decoder.truncated)
@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+import os
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', '20'))  # Records per message per interval
+LOG_RATE_INTERVAL = float(os.getenv('LOG_RATE_INTERVAL', '10'))
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `limit` records per message template every `interval` seconds.
+
+    Records are grouped by logger and unformatted message, so 'Skipping
+    duplicate company: %s' is limited as one message whatever the company.
+    The first record after a window with suppressed records reports how many
+    were dropped. Errors are never suppressed.
+    """
+
+    def __init__(self, limit=LOG_RATE_LIMIT, interval=LOG_RATE_INTERVAL):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self._windows = {}  # key -> [window start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f'{record.msg} ({suppressed} similar messages suppressed)'
+                return True
+            window[1] += 1
+            if window[1] <= self.limit:
+                return True
+            window[2] += 1
+            return False
+
+
+def configure_logging(level=LOG_LEVEL):
+    """Sets up levelled, rate-limited logging to stderr for a run. Safe to call more than once."""
+    root = logging.getLogger()
+    if any(getattr(handler, '_scraper_handler', False) for handler in root.handlers):
+        root.setLevel(level)
+        return
+    handler = logging.StreamHandler()
+    handler._scraper_handler = True
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(name)s [%(threadName)s] %(message)s'))
+    handler.addFilter(RateLimitFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
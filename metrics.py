@@ -0,0 +1,173 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from functools import wraps
+from bisect import bisect_left
+import threading
+import json
+import time
+import os
+
+# Latency buckets in seconds, from a local Mongo round trip to a slow website
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')  # Set to 0.0.0.0 to serve on every interface
+METRICS_SNAPSHOT_PATH = os.getenv('METRICS_SNAPSHOT_PATH', 'metrics_snapshot.json')
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_buckets = {}     # name -> bucket bounds
+_started = time.time()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Adds to a counter, e.g. inc('pages_fetched_total', stage='website')."""
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Records a value in a histogram, e.g. observe('http_fetch_seconds', 0.42, stage='website')."""
+    key = (name, _labels(labels))
+    with _lock:
+        bounds = _buckets.setdefault(name, buckets)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(bounds) + 2)
+        histogram[bisect_left(bounds, value)] += 1
+        histogram[-1] += value
+
+
+@contextmanager
+def timer(name, **labels):
+    """Times the block into a latency histogram; failures are labelled outcome='error'."""
+    start = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, outcome=outcome, **labels)
+
+
+def timed(name, **labels):
+    """Decorator version of timer()."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """Returns all metrics as a JSON-serializable dict."""
+    with _lock:
+        counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(_counters.items())]
+        histograms = []
+        for (name, labels), histogram in sorted(_histograms.items()):
+            bounds = _buckets[name]
+            count = sum(histogram[:-1])
+            histograms.append({
+                'name': name,
+                'labels': dict(labels),
+                'count': count,
+                'sum': round(histogram[-1], 6),
+                'mean': round(histogram[-1] / count, 6) if count else 0,
+                'buckets': {str(bound): n for bound, n in zip(bounds + ('+Inf',), histogram[:-1])},
+            })
+    return {'uptime_seconds': round(time.time() - _started, 1), 'counters': counters, 'histograms': histograms}
+
+
+def reset():
+    """Clears all metrics, e.g. between the stages of a benchmark."""
+    global _started
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _buckets.clear()
+        _started = time.time()
+
+
+def _escape_label(value):
+    # Label values are free text such as endpoint paths and error reasons
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in items) + '}'
+
+
+def render_prometheus():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        seen = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in seen:
+                lines.append(f'# TYPE {name} counter')
+                seen.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), histogram in sorted(_histograms.items()):
+            if name not in seen:
+                lines.append(f'# TYPE {name} histogram')
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(_buckets[name] + ('+Inf',), histogram[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, {"le": bound})} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_snapshot(path=METRICS_SNAPSHOT_PATH):
+    """Writes snapshot() as JSON, atomically replacing any previous file."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body, content_type = json.dumps(snapshot()).encode(), 'application/json'
+        elif self.path.startswith('/metrics'):
+            body, content_type = render_prometheus().encode(), 'text/plain; version=0.0.4'
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serves /metrics (Prometheus text) and /metrics.json on a daemon thread. Returns the server, or None if no port is set."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
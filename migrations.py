@@ -0,0 +1,49 @@
+from MongoConnection import get_mongo_collection
+from bulk_writer import BulkWriter
+from dedupe import ensure_company_indexes
+from normalizers import normalize_company_name, normalize_domain, normalize_website
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_company_keys(batch_size=1000):
+    """
+    Writes normalized_name, the site key and the registrable domain onto every company whose stored values are missing or stale.
+
+    Safe to re-run; only documents whose keys change are updated. Documents
+    whose new key collides with an existing company under the unique indexes
+    are reported by the writer and keep their old keys. The domain has no
+    unique index and is written separately, so it is filled in regardless.
+
+    :return: The writer's stats.
+    """
+    companies_collection = get_mongo_collection('TestingDatabase', 'companies')
+    ensure_company_indexes(companies_collection)
+
+    projection = {'company_name': 1, 'website': 1, 'normalized_name': 1, 'site': 1, 'domain': 1}
+    scanned = 0
+    with BulkWriter(companies_collection, batch_size=batch_size) as writer:
+        for company in companies_collection.find({}, projection, batch_size=batch_size):
+            scanned += 1
+            keys = {
+                'normalized_name': normalize_company_name(company.get('company_name')),
+                'site': normalize_website(company.get('website')),
+            }
+            changed = {field: value for field, value in keys.items() if company.get(field) != value}
+            if changed:
+                writer.update({'_id': company['_id']}, {'$set': changed}, validate=False,
+                              label=company.get('company_name'))
+            domain = normalize_domain(company.get('website'))
+            if company.get('domain') != domain:
+                writer.update({'_id': company['_id']}, {'$set': {'domain': domain}}, validate=False,
+                              label=company.get('company_name'))
+
+    logger.info("Backfilled company keys: scanned %d, %s", scanned, writer.stats)
+    return writer.stats
+
+
+if __name__ == '__main__':
+    from logging_config import configure_logging
+    configure_logging()
+    backfill_company_keys()
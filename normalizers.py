@@ -0,0 +1,210 @@
+from urllib.parse import urlsplit
+import re
+
+NON_ALNUM_PATTERN = re.compile(r'[^0-9a-z]+')
+
+# Public suffixes with more than one label that show up in our data. Anything
+# not listed is treated as a single-label suffix (.com, .ca, .io, ...).
+MULTI_LABEL_SUFFIXES = {
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'ltd.uk', 'plc.uk', 'me.uk',
+    'com.au', 'net.au', 'org.au', 'co.nz', 'org.nz', 'co.za', 'com.br',
+    'com.mx', 'co.in', 'co.jp', 'com.cn', 'com.sg', 'com.hk',
+    'ab.ca', 'bc.ca', 'mb.ca', 'nb.ca', 'nl.ca', 'ns.ca', 'nt.ca', 'nu.ca',
+    'on.ca', 'pe.ca', 'qc.ca', 'sk.ca', 'yk.ca', 'gc.ca',
+}
+
+# Hosting services that give each customer a subdomain: 'abc.business.site' is
+# abc's own site, so the label before the suffix is never collapsed away.
+SHARED_HOSTING_SUFFIXES = {
+    'business.site', 'wixsite.com', 'squarespace.com', 'godaddysites.com', 'weebly.com', 'wordpress.com',
+    'blogspot.com', 'myshopify.com', 'square.site', 'webflow.io', 'github.io', 'netlify.app', 'vercel.app',
+    'herokuapp.com', 'carrd.co', 'mystrikingly.com', 'jimdosite.com', 'site123.me', 'yolasite.com',
+    'ueniweb.com', 'wix.com', 'editorx.io',
+}
+
+# Platforms where a business only has a page, identified by the URL path:
+# 'facebook.com/abc' is abc's page but says nothing about abc's own domain.
+PLATFORM_DOMAINS = {
+    'facebook.com', 'fb.com', 'instagram.com', 'linkedin.com', 'twitter.com', 'x.com', 'youtube.com',
+    'tiktok.com', 'pinterest.com', 'yelp.com', 'yelp.ca', 'linktr.ee', 'houzz.com', 'homestars.com',
+    'yellowpages.ca', 'yellowpages.com', 'g.page',
+}
+PLATFORM_HOSTS = {'sites.google.com', 'business.google.com', 'maps.google.com', 'goo.gl'}
+# Sub-pages of a business's platform page, dropped from the end of its path
+PLATFORM_SUBPAGES = {'about', 'home', 'info', 'reviews', 'posts', 'photos', 'videos', 'contact', 'services'}
+
+
+def normalize_company_name(name):
+    """Lowercase a company name and collapse punctuation and whitespace, e.g. 'A.B.C. Roofing ' -> 'a b c roofing'."""
+    if not isinstance(name, str):
+        return None
+    normalized = NON_ALNUM_PATTERN.sub(' ', name.casefold()).strip()
+    return normalized or None
+
+
+def normalize_host(website):
+    """Reduce a website URL or bare domain to its lowercased host without 'www.' or a port."""
+    if not isinstance(website, str) or not website.strip() or website == 'N/A':
+        return None
+    website = website.strip()
+    if '//' not in website:
+        website = '//' + website
+    try:
+        host = (urlsplit(website).hostname or '').rstrip('.')
+    except ValueError:
+        return None
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or None
+
+
+def _registrable(host):
+    labels = host.split('.')
+    if len(labels) <= 2 or labels[-1].isdigit():  # Bare domain or IP address
+        return host
+    suffix_labels = 2 if '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES else 1
+    return '.'.join(labels[-(suffix_labels + 1):])
+
+
+def _on_platform(host):
+    return host in PLATFORM_HOSTS or _registrable(host) in PLATFORM_DOMAINS
+
+
+def normalize_domain(website):
+    """
+    Reduce a website URL, host or email domain to its registrable domain.
+
+    e.g. 'https://www.Shop.ABC.com/x' -> 'abc.com', 'mail.abc.on.ca' -> 'abc.on.ca'.
+    Customer sites on shared hosting keep their own label ('abc.business.site'),
+    and pages on platforms such as Facebook have no domain of their own (None).
+    """
+    host = normalize_host(website)
+    if host is None or _on_platform(host):
+        return None
+    for suffix in SHARED_HOSTING_SUFFIXES:
+        if host.endswith('.' + suffix):
+            return host[:-len(suffix) - 1].rpartition('.')[2] + '.' + suffix
+        if host == suffix:
+            return None
+    return _registrable(host)
+
+
+def normalize_website(website):
+    """
+    Reduce a website URL to the key that identifies one business's site: its
+    full host, plus the page path on platforms where many businesses share a host.
+
+    e.g. 'https://www.shop.abc.com/x' -> 'shop.abc.com',
+    'https://facebook.com/ABC-Roofing/about' -> 'facebook.com/abc-roofing'.
+    """
+    host = normalize_host(website)
+    if host is None:
+        return None
+    if not _on_platform(host):
+        return host
+    url = website.strip() if '//' in website else '//' + website.strip()
+    try:
+        path = urlsplit(url).path
+    except ValueError:
+        return None
+    segments = [segment for segment in path.casefold().split('/') if segment]
+    while segments and segments[-1] in PLATFORM_SUBPAGES:
+        segments.pop()
+    if not segments:  # The platform's home page, not a business
+        return None
+    return host + '/' + '/'.join(segments)
+
+
+# Trailing words that only give a company's legal form, e.g. 'ABC Roofing Inc.' -> 'abc roofing'
+LEGAL_SUFFIXES = {
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd', 'limited', 'ltee',
+    'llc', 'llp', 'lp', 'pllc', 'plc', 'pc', 'ulc', 'gmbh', 'pty', 'enr', 'sa', 'srl',
+}
+NAME_FILLER_WORDS = {'the', 'and'}
+
+DEFAULT_PHONE_COUNTRY_CODE = '1'  # Numbers without a country code are North American
+PHONE_EXTENSION_PATTERN = re.compile(r'\s*(?:ext\.?|extension|x|#)\s*\d+\s*$', re.IGNORECASE)
+NON_DIGIT_PATTERN = re.compile(r'\D+')
+
+ADDRESS_ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'av': 'ave', 'road': 'rd', 'boulevard': 'blvd', 'drive': 'dr',
+    'lane': 'ln', 'court': 'ct', 'crescent': 'cres', 'place': 'pl', 'parkway': 'pkwy', 'highway': 'hwy',
+    'square': 'sq', 'terrace': 'ter', 'circle': 'cir', 'trail': 'trl', 'saint': 'st', 'mount': 'mt',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se', 'southwest': 'sw',
+}
+# 'Suite 200', 'Unit 4', '#12', and the Canadian '4-123 Main St' unit prefix
+UNIT_PATTERN = re.compile(r'(?:#|\b(?:suite|ste|unit|apt|apartment|room|rm|floor|fl)\b\.?)\s*[\w-]+', re.IGNORECASE)
+UNIT_PREFIX_PATTERN = re.compile(r'^\s*\w+\s*-\s*(?=\d)')
+POSTAL_CODE_PATTERN = re.compile(r'\b([a-z]\d[a-z]) (\d[a-z]\d)\b')
+COUNTRY_NAMES = {'canada', 'usa', 'us', 'united states', 'united states of america', 'uk', 'united kingdom'}
+
+
+def normalize_entity_name(name):
+    """
+    Reduce a company name to the words that identify the business, for entity resolution.
+
+    Initials are joined, and legal suffixes and filler words are dropped, e.g.
+    'The A.B.C. Roofing & Siding Co., Inc.' -> 'abc roofing siding'.
+    """
+    normalized = normalize_company_name(name)
+    if normalized is None:
+        return None
+    tokens, initials = [], []
+    for token in normalized.split():
+        if len(token) == 1 and token.isalpha():
+            initials.append(token)
+            continue
+        if initials:
+            tokens.append(''.join(initials))
+            initials = []
+        tokens.append(token)
+    if initials:
+        tokens.append(''.join(initials))
+
+    tokens = [token for token in tokens if token not in NAME_FILLER_WORDS]
+    while len(tokens) > 1 and tokens[-1] in LEGAL_SUFFIXES:
+        tokens.pop()
+    return ' '.join(tokens) or normalized
+
+
+def normalize_phone(phone, default_country_code=DEFAULT_PHONE_COUNTRY_CODE):
+    """
+    Reduce a phone number to E.164-like '+<country><number>' digits, dropping any extension.
+
+    e.g. '(416) 555-0199 ext. 12' -> '+14165550199'. Returns None if too few digits remain.
+    """
+    if not isinstance(phone, str):
+        return None
+    phone = PHONE_EXTENSION_PATTERN.sub('', phone).strip()
+    digits = NON_DIGIT_PATTERN.sub('', phone)
+    if phone.startswith('+'):
+        number = digits
+    elif phone.startswith('00'):
+        number = digits[2:]
+    elif default_country_code == '1' and len(digits) == 11 and digits.startswith('1'):
+        number = digits
+    else:
+        number = default_country_code + digits.lstrip('0')
+    if not 8 <= len(number) <= 15:
+        return None
+    return '+' + number
+
+
+def normalize_address(address):
+    """
+    Reduce a street address to a comparable form: units and the country are
+    dropped and street types and directions abbreviated.
+
+    e.g. 'Suite 200, 123 Main Street West, Toronto, ON M5V 2T6, Canada'
+    -> '123 main st w toronto on m5v2t6'.
+    """
+    if not isinstance(address, str) or not address.strip() or address == 'N/A':
+        return None
+    address = UNIT_PATTERN.sub(' ', UNIT_PREFIX_PATTERN.sub('', address.casefold()))
+    parts = [NON_ALNUM_PATTERN.sub(' ', part).split() for part in address.split(',')]
+    parts = [part for part in parts if part]
+    if parts and ' '.join(parts[-1]) in COUNTRY_NAMES:
+        parts.pop()
+    normalized = ' '.join(ADDRESS_ABBREVIATIONS.get(token, token) for part in parts for token in part)
+    return POSTAL_CODE_PATTERN.sub(r'\1\2', normalized) or None
@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`; acquire()
+    blocks until a token is available. A capacity of 1 gives an even spacing
+    of requests; larger capacities allow short bursts.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Sustained requests per second.
+        :param capacity: Maximum burst size. Defaults to one second's worth of tokens.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` tokens are available, then takes them."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` tokens if available without blocking. Returns whether it did."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def set_rate(self, rate):
+        """Changes the sustained rate, e.g. after reading a server's limit headers."""
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
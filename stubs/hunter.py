@@ -0,0 +1,151 @@
+"""
+Local stand-in for the Hunter.io v2 API (domain-search and account endpoints).
+
+Usage:
+    python -m stubs.hunter [--port 8765] [--latency 0.05] [--credits 1000] [--qps 15]
+
+Then point the scraper at it with HUNTER_API_BASE=http://127.0.0.1:8765/v2.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import hashlib
+import json
+import threading
+import time
+
+FIRST_NAMES = ['john', 'mary', 'ahmed', 'li', 'sofia', 'raj', 'emma', 'lucas', 'noah', 'olivia']
+LAST_NAMES = ['smith', 'chen', 'patel', 'garcia', 'brown', 'nguyen', 'wilson', 'khan']
+POSITIONS = ['Owner', 'Operations Manager', 'Estimator', 'Sales Manager', 'Office Manager']
+
+
+def fake_domain_search(domain, max_emails=10):
+    """Deterministic fake domain-search payload for a domain."""
+    seed = int(hashlib.sha1(domain.encode()).hexdigest(), 16)
+    count = seed % (max_emails + 1)
+    emails = [{'value': f'info@{domain}', 'type': 'generic', 'first_name': None, 'last_name': None}]
+    for i in range(count):
+        first = FIRST_NAMES[(seed >> i) % len(FIRST_NAMES)]
+        last = LAST_NAMES[(seed >> (i + 3)) % len(LAST_NAMES)]
+        emails.append({
+            'value': f'{first}.{last}{i}@{domain}',
+            'type': 'personal',
+            'first_name': first.title(),
+            'last_name': last.title(),
+            'position': POSITIONS[(seed >> (i + 5)) % len(POSITIONS)],
+            'linkedin': None,
+        })
+    return {
+        'domain': domain,
+        'organization': domain.split('.')[0].replace('-', ' ').title(),
+        'description': f'{domain} is a local business.',
+        'linkedin': f'https://www.linkedin.com/company/{domain.split(".")[0]}',
+        'emails': emails,
+    }
+
+
+class HunterStubState:
+    def __init__(self, credits=1000, qps=15, latency=0.0, api_key=None):
+        self.credits = credits
+        self.used = 0
+        self.qps = qps
+        self.latency = latency
+        self.api_key = api_key
+        self.window_start = time.time()
+        self.window_count = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def take_rate_slot(self):
+        """One-second fixed window. Returns (allowed, remaining, seconds_to_reset)."""
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= 1:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            self.requests += 1
+            remaining = max(0, self.qps - self.window_count)
+            return self.window_count <= self.qps, remaining, 1 - (now - self.window_start)
+
+
+def make_handler(state):
+    class HunterStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            api_key = self.headers.get('X-API-KEY') or params.get('api_key')
+            if state.api_key and api_key != state.api_key:
+                return self._send(401, {'errors': [{'id': 'authentication_failed'}]})
+
+            allowed, remaining, reset = state.take_rate_slot()
+            rate_headers = {'X-RateLimit-Limit': str(state.qps), 'X-RateLimit-Remaining': str(remaining),
+                            'X-RateLimit-Reset': f'{reset:.3f}'}
+            if not allowed:
+                return self._send(429, {'errors': [{'id': 'too_many_requests'}]},
+                                  {**rate_headers, 'Retry-After': '1'})
+            if state.latency:
+                time.sleep(state.latency)
+
+            if url.path.endswith('/account'):
+                with state.lock:
+                    searches = {'used': state.used, 'available': state.credits}
+                return self._send(200, {'data': {'requests': {'searches': searches}}}, rate_headers)
+
+            if url.path.endswith('/domain-search'):
+                domain = params.get('domain')
+                if not domain:
+                    return self._send(400, {'errors': [{'id': 'wrong_params'}]}, rate_headers)
+                with state.lock:
+                    if state.used >= state.credits:
+                        return self._send(429, {'errors': [{'id': 'usage_limit_exceeded'}]})
+                    state.used += 1
+                return self._send(200, {'data': fake_domain_search(domain), 'meta': {}}, rate_headers)
+
+            self._send(404, {'errors': [{'id': 'not_found'}]})
+
+    return HunterStubHandler
+
+
+def start_hunter_stub(port=0, **state_kwargs):
+    """
+    Starts the stub on a background thread.
+
+    :return: (server, state, base_url); call server.shutdown() to stop it.
+    """
+    state = HunterStubState(**state_kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f'http://127.0.0.1:{server.server_address[1]}/v2'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--credits', type=int, default=1000)
+    parser.add_argument('--qps', type=int, default=15)
+    args = parser.parse_args()
+
+    state = HunterStubState(credits=args.credits, qps=args.qps, latency=args.latency)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(state))
+    print(f"Hunter stub listening on http://127.0.0.1:{args.port}/v2")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
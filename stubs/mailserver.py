@@ -0,0 +1,124 @@
+"""
+Local SMTP server answering recipient checks for the stub corpus.
+
+Usage:
+    python -m stubs.mailserver [--port 2525] [--latency 0.0]
+
+Then point the verifier at it with SMTP_VERIFY_PORT=2525 (and
+DNS_NAMESERVER at stubs.nameserver, which sends every MX to 127.0.0.1).
+
+Recipients at company{N}.test are answered deterministically: N % 10 == 8
+domains are catch-all and accept anything; elsewhere info@ and the
+first.last{i}@ addresses of stubs.hunter with an even i are accepted (250),
+other local parts are rejected (550), and N % 10 == 7 domains greylist every
+recipient (450). Messages are never accepted: DATA is refused.
+"""
+from stubs.websites import HOST_PATTERN
+import argparse
+import asyncio
+import re
+import threading
+
+PERSONAL_PATTERN = re.compile(r'^[a-z]+\.[a-z]+(\d+)$')
+RCPT_PATTERN = re.compile(r'^RCPT TO:\s*<([^>]*)>', re.IGNORECASE)
+
+
+class MailStubState:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sessions = 0
+        self.open_sessions = 0
+        self.max_open_sessions = 0
+        self.rcpts = 0
+        self.lock = threading.Lock()
+
+    def rcpt_reply(self, address):
+        local, _, domain = address.lower().rpartition('@')
+        match = HOST_PATTERN.search(domain)
+        if match is None:
+            return '550 5.1.2 Domain not served here'
+        variant = int(match.group(1)) % 10
+        if variant == 7:
+            return '450 4.7.1 Greylisted, try again later'
+        if variant == 8:
+            return '250 2.1.5 OK'
+        personal = PERSONAL_PATTERN.match(local)
+        if local == 'info' or (personal and int(personal.group(1)) % 2 == 0):
+            return '250 2.1.5 OK'
+        return '550 5.1.1 User unknown'
+
+
+def make_session_handler(state):
+    async def handle(reader, writer):
+        with state.lock:
+            state.sessions += 1
+            state.open_sessions += 1
+            state.max_open_sessions = max(state.max_open_sessions, state.open_sessions)
+
+        async def reply(line):
+            if state.latency:
+                await asyncio.sleep(state.latency)
+            writer.write(line.encode() + b'\r\n')
+            await writer.drain()
+
+        try:
+            await reply('220 mail.test ESMTP stub')
+            while True:
+                line = (await reader.readline()).decode('utf-8', 'replace').strip()
+                if not line:
+                    break
+                verb = line[:4].upper()
+                if verb == 'EHLO':
+                    await reply('250-mail.test\r\n250 8BITMIME')
+                elif verb in ('HELO', 'MAIL', 'RSET', 'NOOP'):
+                    await reply('250 2.0.0 OK')
+                elif verb == 'RCPT':
+                    match = RCPT_PATTERN.match(line)
+                    with state.lock:
+                        state.rcpts += 1
+                    await reply(state.rcpt_reply(match.group(1)) if match else '501 5.5.4 Syntax error')
+                elif verb == 'QUIT':
+                    await reply('221 2.0.0 Bye')
+                    break
+                else:
+                    await reply('502 5.5.1 Command not implemented')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            with state.lock:
+                state.open_sessions -= 1
+            writer.close()
+
+    return handle
+
+
+def start_mail_stub(port=0, **state_kwargs):
+    """
+    Starts the server on its own event loop in a background thread.
+
+    :return: (loop, state, port); stop it with loop.call_soon_threadsafe(loop.stop).
+    """
+    state = MailStubState(**state_kwargs)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(make_session_handler(state), '127.0.0.1', port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop, state, server.sockets[0].getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every reply')
+    args = parser.parse_args()
+
+    async def serve():
+        server = await asyncio.start_server(make_session_handler(MailStubState(args.latency)), '127.0.0.1', args.port)
+        print(f"Mail stub listening on smtp://127.0.0.1:{args.port}")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Local DNS server answering MX and A queries for the stub corpus.
+
+Usage:
+    python -m stubs.nameserver [--port 5353] [--mx-hosts 4]
+
+Then point the verifier at it with DNS_NAMESERVER=127.0.0.1:5353.
+
+Domain company{N}.test (see stubs.websites) has one MX record,
+mx{N % mx_hosts}.mail.test, so several domains share each mail server as they
+do at real hosting providers. Every *.mail.test host resolves to 127.0.0.1,
+where stubs.mailserver listens. Domains with N % 25 == 24 do not exist (NXDOMAIN).
+Only UDP and only the question's own records are supported.
+"""
+from socketserver import BaseRequestHandler, ThreadingUDPServer
+import argparse
+import re
+import struct
+import threading
+
+DOMAIN_PATTERN = re.compile(r'^company(\d+)\.test$')
+MAIL_HOST_PATTERN = re.compile(r'^mx\d+\.mail\.test$')
+TYPE_A, TYPE_MX, CLASS_IN = 1, 15, 1
+NOERROR, NXDOMAIN = 0, 3
+TTL = 300
+
+
+def mail_host(index, mx_hosts=4):
+    return f'mx{index % mx_hosts}.mail.test'
+
+
+def encode_name(name):
+    return b''.join(bytes([len(label)]) + label.encode('ascii') for label in name.split('.') if label) + b'\0'
+
+
+def parse_question(packet):
+    """Returns (query id, name, qtype, end offset of the question)."""
+    query_id = struct.unpack('!H', packet[:2])[0]
+    labels, offset = [], 12
+    while packet[offset]:
+        length = packet[offset]
+        labels.append(packet[offset + 1:offset + 1 + length].decode('ascii', 'replace'))
+        offset += 1 + length
+    qtype, _ = struct.unpack('!HH', packet[offset + 1:offset + 5])
+    return query_id, '.'.join(labels).lower(), qtype, offset + 5
+
+
+class DnsStubState:
+    def __init__(self, mx_hosts=4, mail_ip='127.0.0.1'):
+        self.mx_hosts = mx_hosts
+        self.mail_ip = mail_ip
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    def answer(self, name, qtype):
+        """Returns (rcode, [(rtype, rdata)])."""
+        match = DOMAIN_PATTERN.match(name)
+        if match:
+            index = int(match.group(1))
+            if index % 25 == 24:
+                return NXDOMAIN, []
+            if qtype == TYPE_MX:
+                return NOERROR, [(TYPE_MX, struct.pack('!H', 10) + encode_name(mail_host(index, self.mx_hosts)))]
+            return NOERROR, []
+        if MAIL_HOST_PATTERN.match(name):
+            if qtype == TYPE_A:
+                return NOERROR, [(TYPE_A, bytes(int(part) for part in self.mail_ip.split('.')))]
+            return NOERROR, []
+        return NXDOMAIN, []
+
+
+def make_handler(state):
+    class DnsStubHandler(BaseRequestHandler):
+        def handle(self):
+            packet, sock = self.request
+            try:
+                query_id, name, qtype, end = parse_question(packet)
+            except (IndexError, struct.error):
+                return
+            with state.lock:
+                state.queries += 1
+            rcode, records = state.answer(name, qtype)
+            header = struct.pack('!HHHHHH', query_id, 0x8180 | rcode, 1, len(records), 0, 0)
+            answers = b''.join(
+                struct.pack('!HHHIH', 0xC00C, rtype, CLASS_IN, TTL, len(rdata)) + rdata  # 0xC00C points at the question name
+                for rtype, rdata in records
+            )
+            sock.sendto(header + packet[12:end] + answers, self.client_address)
+
+    return DnsStubHandler
+
+
+def start_dns_stub(port=0, **state_kwargs):
+    """
+    Starts the server on a background thread.
+
+    :return: (server, state, nameserver) where nameserver is 'host:port' for DNS_NAMESERVER.
+    """
+    state = DnsStubState(**state_kwargs)
+    server = ThreadingUDPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f'127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=5353)
+    parser.add_argument('--mx-hosts', type=int, default=4, help='Number of mail servers the domains share')
+    args = parser.parse_args()
+
+    server = ThreadingUDPServer(('127.0.0.1', args.port), make_handler(DnsStubState(mx_hosts=args.mx_hosts)))
+    print(f"DNS stub listening on udp://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
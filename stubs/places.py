@@ -0,0 +1,175 @@
+"""
+Local stand-in for the Google Places web service (text search and place details).
+
+Usage:
+    python -m stubs.places [--port 8766] [--businesses 1000] [--token-delay 0.2] [--latency 0.0]
+
+Then point the scraper at it with GOOGLE_MAPS_BASE_URL=http://127.0.0.1:8766 and
+any key starting with 'AIza'.
+
+The stub holds a fixed, numbered set of businesses. A text search ending in a
+number N (e.g. 'roofing in Zone 3') returns businesses N*60 to N*60+59, in
+pages of 20 like the real API. A next_page_token answers INVALID_REQUEST until
+token_delay seconds after it was issued, as the real one does.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import json
+import re
+import threading
+import time
+
+RESULTS_PER_QUERY = 60
+RESULTS_PER_PAGE = 20
+QUERY_NUMBER_PATTERN = re.compile(r'(\d+)\s*$')
+
+NAME_PREFIXES = ['Summit', 'Maple', 'Northern', 'Lakeshore', 'Premier', 'Royal', 'True North', 'Citywide']
+NAME_SUFFIXES = ['Roofing', 'Roofing Ltd.', 'Roofers Inc.', 'Roof Repair', 'Exteriors', 'Contracting']
+STREETS = ['King St', 'Queen St', 'Yonge St', 'Dundas St', 'Bloor St', 'Main St']
+
+
+def business_host(index):
+    """Website host of business `index`; served by stubs.websites."""
+    return f'company{index}.test'
+
+
+def fake_business(index, website_rate=0.9):
+    """Deterministic Places data for business `index`. About 1 - website_rate of them have no website."""
+    details = {
+        'place_id': f'bench-{index}',
+        'name': f'{NAME_PREFIXES[index % len(NAME_PREFIXES)]} {NAME_SUFFIXES[index % len(NAME_SUFFIXES)]} {index}',
+        'formatted_address': f'{index % 900 + 1} {STREETS[index % len(STREETS)]}, Benchville, ON',
+        'formatted_phone_number': f'(905) {index // 10000 % 1000:03d}-{index % 10000:04d}',
+    }
+    if (index * 7919) % 100 < website_rate * 100:
+        # Tracking parameters, as Maps often returns them
+        details['website'] = f'http://www.{business_host(index)}/?utm_source=google&utm_medium=maps'
+    return details
+
+
+class PlacesStubState:
+    def __init__(self, businesses=1000, token_delay=0.2, latency=0.0, duplicate_rate=0.05, website_rate=0.9):
+        """
+        :param businesses: Number of businesses the stub knows.
+        :param token_delay: Seconds before a next_page_token becomes valid.
+        :param latency: Seconds added to every response.
+        :param duplicate_rate: Share of each query's results that repeat businesses of the previous query.
+        :param website_rate: Share of businesses with a website.
+        """
+        self.businesses = businesses
+        self.token_delay = token_delay
+        self.latency = latency
+        self.duplicate_rate = duplicate_rate
+        self.website_rate = website_rate
+        self.tokens = {}  # token -> (query number, page, issued at)
+        self.requests = {'textsearch': 0, 'details': 0}
+        self.lock = threading.Lock()
+
+    def query_results(self, number):
+        start = number * RESULTS_PER_QUERY
+        indexes = list(range(start, min(start + RESULTS_PER_QUERY, self.businesses)))
+        repeats = int(len(indexes) * self.duplicate_rate) if number else 0
+        # Overlapping searches return some of the same places, which dedupe must catch
+        return list(range(start - repeats, start)) + indexes[:len(indexes) - repeats]
+
+    def page(self, number, page):
+        results = self.query_results(number)
+        chunk = results[page * RESULTS_PER_PAGE:(page + 1) * RESULTS_PER_PAGE]
+        body = {'status': 'OK' if chunk else 'ZERO_RESULTS', 'html_attributions': [],
+                'results': [{key: value for key, value in fake_business(i, self.website_rate).items()
+                             if key in ('place_id', 'name', 'formatted_address')} for i in chunk]}
+        if (page + 1) * RESULTS_PER_PAGE < len(results):
+            token = f'token-{number}-{page + 1}'
+            with self.lock:
+                self.tokens[token] = (number, page + 1, time.monotonic())
+            body['next_page_token'] = token
+        return body
+
+
+def make_handler(state):
+    class PlacesStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, body):
+            payload = json.dumps(body).encode()
+            self.send_response(200)  # The Places API reports errors in the body's status
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _text_search(self, params):
+            with state.lock:
+                state.requests['textsearch'] += 1
+            token = params.get('pagetoken')
+            if token:
+                with state.lock:
+                    issued = state.tokens.get(token)
+                if issued is None or time.monotonic() - issued[2] < state.token_delay:
+                    return self._send({'status': 'INVALID_REQUEST', 'results': []})
+                return self._send(state.page(issued[0], issued[1]))
+            match = QUERY_NUMBER_PATTERN.search(params.get('query', ''))
+            if match is None:
+                return self._send({'status': 'ZERO_RESULTS', 'results': []})
+            return self._send(state.page(int(match.group(1)), 0))
+
+        def _details(self, params):
+            with state.lock:
+                state.requests['details'] += 1
+            place_id = params.get('placeid') or params.get('place_id') or ''
+            try:
+                index = int(place_id.rsplit('-', 1)[1])
+            except (IndexError, ValueError):
+                return self._send({'status': 'NOT_FOUND'})
+            if index >= state.businesses:
+                return self._send({'status': 'NOT_FOUND'})
+            return self._send({'status': 'OK', 'result': fake_business(index, state.website_rate)})
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            if state.latency:
+                time.sleep(state.latency)
+            if url.path.endswith('/place/textsearch/json'):
+                return self._text_search(params)
+            if url.path.endswith('/place/details/json'):
+                return self._details(params)
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    return PlacesStubHandler
+
+
+def start_places_stub(port=0, **state_kwargs):
+    """
+    Starts the stub on a background thread.
+
+    :return: (server, state, base_url); call server.shutdown() to stop it.
+    """
+    state = PlacesStubState(**state_kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--businesses', type=int, default=1000)
+    parser.add_argument('--token-delay', type=float, default=0.2)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    args = parser.parse_args()
+
+    state = PlacesStubState(businesses=args.businesses, token_delay=args.token_delay, latency=args.latency)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(state))
+    print(f"Places stub listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Local SMTP relay for outreach runs, built on aiosmtpd.
+
+Usage:
+    python -m stubs.relay [--port 8025] [--latency 0.0]
+
+Then point the sender at it with OUTREACH_SMTP_HOST=127.0.0.1,
+OUTREACH_SMTP_PORT=8025 and OUTREACH_SMTP_STARTTLS=0.
+
+Messages are accepted and counted, never delivered. Recipients whose local
+part starts with 'bounce' are rejected (550) and those starting with 'defer'
+are deferred (451), so both failure paths of the sender can be exercised.
+"""
+from aiosmtpd.controller import Controller
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+
+class RelayStubHandler:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = []  # (session id, envelope recipients, Message-ID)
+        self.sessions = set()
+        self.rejected = 0
+        self.deferred = 0
+        self.lock = threading.Lock()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        local = address.partition('@')[0].lower()
+        if local.startswith('bounce'):
+            with self.lock:
+                self.rejected += 1
+            return '550 5.1.1 User unknown'
+        if local.startswith('defer'):
+            with self.lock:
+                self.deferred += 1
+            return '451 4.3.0 Try again later'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message_id = next((line.split(':', 1)[1].strip() for line in envelope.content.decode('utf-8', 'replace').splitlines()
+                           if line.lower().startswith('message-id:')), None)
+        with self.lock:
+            self.sessions.add(id(session))
+            self.messages.append((id(session), list(envelope.rcpt_tos), message_id))
+        return '250 Message accepted'
+
+
+def start_relay_stub(port=0, **handler_kwargs):
+    """
+    Starts the relay on a background thread.
+
+    :return: (controller, handler, port); call controller.stop() to stop it.
+    """
+    if not port:
+        # Controller checks it is up by connecting to the port it was given, so 0 cannot be passed through
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+    handler = RelayStubHandler(**handler_kwargs)
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    return controller, handler, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every accepted message')
+    args = parser.parse_args()
+
+    controller, handler, port = start_relay_stub(args.port, latency=args.latency)
+    print(f"SMTP relay stub listening on smtp://127.0.0.1:{port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{len(handler.messages)} messages in {len(handler.sessions)} sessions, "
+                  f"{handler.rejected} rejected, {handler.deferred} deferred")
+    except KeyboardInterrupt:
+        controller.stop()
+
+
+if __name__ == '__main__':
+    main()
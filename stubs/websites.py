@@ -0,0 +1,173 @@
+"""
+Local server for a generated corpus of small business websites.
+
+Usage:
+    python -m stubs.websites [--port 8767] [--latency 0.0] [--page-kb 24]
+
+The server is meant to be used as an HTTP proxy: with
+HTTP_PROXY=http://127.0.0.1:8767 (and NO_PROXY=127.0.0.1,localhost), a request
+for http://www.company42.test/contact is answered from the corpus
+without any DNS lookup. The site is picked from the host name, so the same
+URLs that stubs.places hands out resolve here.
+
+Sites are deterministic per number and cover the cases the scraper handles:
+an email on the landing page, behind a contact or about link, listed only in
+the sitemap, obfuscated as "[at]", Cloudflare-encoded, or absent.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import argparse
+import hashlib
+import re
+import threading
+import time
+
+HOST_PATTERN = re.compile(r'company(\d+)\.')
+
+FILLER = ('We are a family owned roofing company serving the region for over twenty years. '
+          'Our crews handle shingle, flat and metal roofs, repairs, inspections and gutters. ')
+
+
+def cloudflare_encode(email, key=0x5a):
+    """Encodes an email the way Cloudflare's email protection does."""
+    return f'{key:02x}' + ''.join(f'{ord(char) ^ key:02x}' for char in email)
+
+
+def _page(title, body, page_kb):
+    filler = '<p>' + FILLER * max(1, page_kb * 1024 // len(FILLER)) + '</p>'
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title></head><body>'
+            f'<nav><a href="/">Home</a> <a href="/services">Services</a> <a href="/gallery">Gallery</a> '
+            f'<a href="/blog">Blog</a>{body.get("nav", "")}</nav>'
+            f'<main><h1>{title}</h1>{filler}{body.get("main", "")}</main>'
+            f'<footer>{body.get("footer", "")}</footer></body></html>')
+
+
+def site_pages(index, page_kb=24):
+    """
+    Returns {path: html} for site `index`.
+
+    The variant is index % 10: 0-3 email on the landing page, 4-5 on a linked
+    contact page, 6 on an about page only listed in the sitemap, 7 obfuscated,
+    8 Cloudflare-encoded, 9 no email at all.
+    """
+    domain = f'company{index}.test'
+    email = f'info@{domain}'
+    variant = index % 10
+    title = f'Company {index} Roofing'
+    pages = {
+        '/services': _page('Services', {}, page_kb),
+        '/gallery': _page('Gallery', {}, page_kb),
+        '/blog': _page('Blog', {}, page_kb),
+    }
+    home = {}
+    sitemap_paths = ['/', '/services', '/gallery', '/blog']
+
+    if variant <= 3:
+        home['footer'] = f'Email us: <a href="mailto:{email}">{email}</a>'
+    elif variant <= 5:
+        home['nav'] = ' <a href="/contact-us">Contact Us</a>'
+        pages['/contact-us'] = _page('Contact', {'main': f'<p>Write to {email} for a free quote.</p>'}, page_kb)
+        sitemap_paths.append('/contact-us')
+    elif variant == 6:
+        pages['/about/our-team'] = _page('Our team', {'main': f'<p>Reach the office at {email}</p>'}, page_kb)
+        sitemap_paths.append('/about/our-team')
+    elif variant == 7:
+        home['nav'] = ' <a href="/contact">Contact</a>'
+        pages['/contact'] = _page('Contact', {'main': f'<p>info [at] {domain.replace(".", " [dot] ")}</p>'}, page_kb)
+    elif variant == 8:
+        home['footer'] = (f'<a href="/cdn-cgi/l/email-protection" class="__cf_email__" '
+                          f'data-cfemail="{cloudflare_encode(email)}">[email&#160;protected]</a>')
+    else:
+        home['nav'] = ' <a href="/contact">Contact</a>'
+        pages['/contact'] = _page('Contact', {'main': '<form><input name="message"></form>'}, page_kb)
+
+    pages['/'] = _page(title, home, page_kb)
+    pages['/sitemap.xml'] = (
+        '<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        + ''.join(f'<url><loc>http://www.{domain}{path}</loc></url>' for path in sitemap_paths)
+        + '</urlset>'
+    )
+    return pages
+
+
+class WebsiteStubState:
+    def __init__(self, latency=0.0, page_kb=24):
+        self.latency = latency
+        self.page_kb = page_kb
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(state):
+    class WebsiteStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload=b'', headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            with state.lock:
+                state.requests += 1
+                state.bytes_sent += len(payload)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            host = url.hostname or self.headers.get('Host', '')
+            match = HOST_PATTERN.search(host)
+            if state.latency:
+                time.sleep(state.latency)
+            if match is None:
+                return self._send(404)
+
+            html = site_pages(int(match.group(1)), state.page_kb).get(url.path or '/')
+            if html is None:
+                return self._send(404, b'<html><body>Not found</body></html>', {'Content-Type': 'text/html'})
+
+            payload = html.encode('utf-8')
+            etag = '"' + hashlib.md5(payload).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                with state.lock:
+                    state.not_modified += 1
+                return self._send(304, headers={'ETag': etag})
+            content_type = 'application/xml' if url.path.endswith('.xml') else 'text/html; charset=utf-8'
+            self._send(200, payload, {'Content-Type': content_type, 'ETag': etag})
+
+    return WebsiteStubHandler
+
+
+def start_website_stub(port=0, **state_kwargs):
+    """
+    Starts the server on a background thread.
+
+    :return: (server, state, proxy_url); call server.shutdown() to stop it.
+    """
+    state = WebsiteStubState(**state_kwargs)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--page-kb', type=int, default=24, help='Approximate size of each page')
+    args = parser.parse_args()
+
+    state = WebsiteStubState(latency=args.latency, page_kb=args.page_kb)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(state))
+    print(f"Website corpus listening on http://127.0.0.1:{args.port} (use it as HTTP_PROXY)")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,8 @@
 from cerberus import Validator
+from datetime import datetime
+import threading
+import re
+import os
 
 # User collection schema
 user_schema = {
@@ -10,6 +14,10 @@ user_schema = {
 # Companies collection schema
 companies_schema = {
     'company_name': {'type': 'string', 'required': True},  # Only company_name is required
+    'normalized_name': {'type': 'string', 'nullable': True},  # Dedupe keys, see normalizers.py
+    'site': {'type': 'string', 'nullable': True},  # Host, plus the page path on platforms like facebook.com
+    'domain': {'type': 'string', 'nullable': True},
+    'place_id': {'type': 'string', 'nullable': True},  # Google Maps place_id
     'address': {'type': 'string', 'nullable': True},  # Nullable fields can be None or empty
     'industry': {'type': 'string', 'nullable': True},
     'website': {'type': 'string', 'nullable': True},
@@ -19,9 +27,22 @@ companies_schema = {
     'phone_number': {'type': 'string', 'nullable': True},
     'email': {'type': 'string', 'nullable': True, 'regex': r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'},
     'linkedin_description': {'type': 'string', 'nullable': True},
+    'linkedin_id': {'type': 'string', 'nullable': True},  # LinkedIn enrichment, see LinkedInScraper.py
+    'logo_url': {'type': 'string', 'nullable': True},
+    'short_description': {'type': 'string', 'nullable': True},
+    'linkedin_specialities': {'type': 'list', 'schema': {'type': 'string'}, 'nullable': True},
+    'linkedin_industries': {'type': 'list', 'schema': {'type': 'string'}, 'nullable': True},
+    'linkedin_checked_at': {'type': 'datetime', 'nullable': True},
     'search_term_used': {'type': 'string', 'required': True},
     'scrape_timestamp': {'type': 'datetime', 'required': True},
      'has_been_hunted': {'type': 'boolean', 'default': False},
+    'hunt_claimed_at': {'type': 'datetime', 'nullable': True},  # Lease taken by a Hunter worker
+    'hunt_claimed_by': {'type': 'string', 'nullable': True},
+    'website_etag': {'type': 'string', 'nullable': True},  # Conditional GET validators from the last website scrape
+    'website_last_modified': {'type': 'string', 'nullable': True},
+    'website_content_hash': {'type': 'string', 'nullable': True},
+    'website_checked_at': {'type': 'datetime', 'nullable': True},
+    'website_failures': {'type': 'integer', 'nullable': True},  # Consecutive failed website fetches
     'other_emails': {  # New field for other emails, an array of strings
         'type': 'list',
         'schema': {'type': 'string', 'regex': r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'},
@@ -43,6 +64,134 @@ people_schema = {
 
 }
 
+# Email verification results, one document per address (_id is the address), see EmailVerifier.py
+email_verifications_schema = {
+    'email': {'type': 'string', 'required': True},
+    'domain': {'type': 'string', 'required': True},
+    'status': {'type': 'string', 'required': True,
+               'allowed': ['valid', 'invalid', 'catch_all', 'no_mx', 'unknown']},
+    'smtp_code': {'type': 'integer', 'nullable': True},
+    'smtp_message': {'type': 'string', 'nullable': True},
+    'mx_host': {'type': 'string', 'nullable': True},
+    'catch_all': {'type': 'boolean', 'nullable': True},
+    'verified_at': {'type': 'datetime', 'required': True},
+    'expires_at': {'type': 'datetime', 'required': True},  # TTL index, see EmailVerifier.ensure_verification_indexes
+}
+
+# Cerberus validators are stateful, so each thread keeps its own, compiled once per schema
+_local = threading.local()
+
+# Fast-path checkers, keyed by id(schema); None means the schema needs Cerberus
+_fast_checkers = {}
+
+FAST_PATH_ENABLED = os.getenv('VALIDATION_FAST_PATH', '1') != '0'
+
+FAST_PATH_RULES = {'type', 'required', 'nullable', 'regex', 'allowed', 'default', 'schema'}
+
+FAST_PATH_TYPES = {
+    'string': lambda value: isinstance(value, str),
+    'boolean': lambda value: isinstance(value, bool),
+    'integer': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'datetime': lambda value: isinstance(value, datetime),
+    'list': lambda value: isinstance(value, (list, tuple)),
+}
+
+
+def get_validator(schema):
+    """Returns this thread's Cerberus Validator for the schema, building it on first use."""
+    cache = getattr(_local, 'validators', None)
+    if cache is None:
+        cache = _local.validators = {}
+    entry = cache.get(id(schema))
+    if entry is None or entry[0] is not schema:
+        entry = cache[id(schema)] = (schema, Validator(schema, allow_unknown=False))
+    return entry[1]
+
+
+def _compile_field(rules):
+    """Compiles one field's rules into a value check, or returns None if a rule is not supported."""
+    if not set(rules) <= FAST_PATH_RULES:
+        return None
+    type_check = FAST_PATH_TYPES.get(rules.get('type')) if 'type' in rules else (lambda value: True)
+    if type_check is None:
+        return None
+    nullable = rules.get('nullable', False)
+    pattern = rules.get('regex')
+    # Cerberus anchors regexes at the end of the value
+    regex = re.compile(pattern if pattern.endswith('$') else pattern + '$') if pattern else None
+    allowed = set(rules['allowed']) if 'allowed' in rules else None
+    item_check = None
+    if 'schema' in rules:
+        if rules.get('type') != 'list':
+            return None
+        item_check = _compile_field(rules['schema'])
+        if item_check is None:
+            return None
+
+    def check(value):
+        if value is None:
+            return nullable
+        if not type_check(value):
+            return False
+        if regex is not None and not (isinstance(value, str) and regex.match(value)):
+            return False
+        if allowed is not None and value not in allowed:
+            return False
+        if item_check is not None and not all(item_check(item) for item in value):
+            return False
+        return True
+
+    return check
+
+
+def _compile_fast_checker(schema):
+    """
+    Compiles a schema using only simple type/required/nullable/regex/allowed rules into a plain function.
+
+    The function returns True when a document is valid. It never reports
+    errors itself; invalid documents are re-checked by Cerberus, which builds
+    the error messages.
+    """
+    field_checks = {}
+    for field, rules in schema.items():
+        check = _compile_field(rules)
+        if check is None:
+            return None
+        field_checks[field] = check
+    required = [field for field, rules in schema.items() if rules.get('required')]
+
+    def is_valid(document):
+        for field in required:
+            if field not in document:
+                return False
+        for field, value in document.items():
+            check = field_checks.get(field)
+            if check is None or not check(value):  # Unknown fields are not allowed
+                return False
+        return True
+
+    return is_valid
+
+
+def _fast_checker(schema):
+    key = id(schema)
+    entry = _fast_checkers.get(key)
+    if entry is None or entry[0] is not schema:
+        entry = _fast_checkers[key] = (schema, _compile_fast_checker(schema))
+    return entry[1]
+
+
+def schema_errors(data, schema):
+    """Returns Cerberus' error dict for the data, or None if it is valid."""
+    fast_check = _fast_checker(schema) if FAST_PATH_ENABLED else None
+    if fast_check is not None and fast_check(data):
+        return None
+    v = get_validator(schema)
+    if v.validate(data):
+        return None
+    return v.errors
+
+
 def validate_data(data, schema):
     """
     Validates the data against the given schema using Cerberus.
@@ -51,7 +200,26 @@ def validate_data(data, schema):
     :param schema: The schema to validate against.
     :return: True if data is valid, raises ValueError if not.
     """
-    v = Validator(schema, allow_unknown=False)  
-    if not v.validate(data):
-        raise ValueError(f"Validation error: {v.errors}")
-    return True
\ No newline at end of file
+    errors = schema_errors(data, schema)
+    if errors is not None:
+        raise ValueError(f"Validation error: {errors}")
+    return True
+
+
+def validate_many(documents, schema):
+    """
+    Validates a batch of documents against the given schema.
+
+    :param documents: Iterable of documents.
+    :param schema: The schema to validate against.
+    :return: (valid_documents, errors) where errors is a list of (index, error dict) pairs.
+    """
+    valid = []
+    errors = []
+    for index, document in enumerate(documents):
+        document_errors = schema_errors(document, schema)
+        if document_errors is None:
+            valid.append(document)
+        else:
+            errors.append((index, document_errors))
+    return valid, errors